@@ -0,0 +1,164 @@
+import math
+from gcode_lexer import code_value, format_block, to_float, tokenize
+
+# Ajuste de arcos para la salida de Kiri:Moto: las curvas llegan como cadenas
+# de muchos G1 cortos. Se agrupan los puntos consecutivos que caen sobre una
+# misma circunferencia (dentro de la tolerancia de cuerda) y se sustituyen por
+# un solo G2/G3 con CR, el mismo formato que ya escribe el conversor.
+
+MIN_ARC_SEGMENTS = 3      # Menos segmentos no compensan el arco
+MAX_ARC_POINTS = 100      # Límite de puntos por arco (la comprobación es O(n) por punto)
+MAX_RUN_POINTS = 10000    # Tamaño máximo del buffer antes de ajustar, para no cargar el archivo
+
+LINEAR_ADDRESSES = frozenset(("G", "X", "Y", "Z", "F"))
+
+def _circle(p1, p2, p3):
+    """Centro y radio de la circunferencia por tres puntos, o None si están alineados."""
+    ax, ay = p1
+    bx, by = p2
+    cx, cy = p3
+    d = 2 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    if abs(d) < 1e-12:
+        return None
+    a2 = ax * ax + ay * ay
+    b2 = bx * bx + by * by
+    c2 = cx * cx + cy * cy
+    ux = (a2 * (by - cy) + b2 * (cy - ay) + c2 * (ay - by)) / d
+    uy = (a2 * (cx - bx) + b2 * (ax - cx) + c2 * (bx - ax)) / d
+    return ux, uy, math.hypot(ax - ux, ay - uy)
+
+def fit_arc(points, tolerance: float):
+    """Comprueba si la polilínea points cabe en un arco de menos de 180°.
+
+    Devuelve (código G, radio) o None.
+    """
+    first, last = points[0], points[-1]
+
+    # Polilíneas casi rectas se quedan como G1
+    chord_x, chord_y = last[0] - first[0], last[1] - first[1]
+    chord = math.hypot(chord_x, chord_y)
+    if chord < tolerance:
+        return None
+    deviation = max(abs(chord_x * (p[1] - first[1]) - chord_y * (p[0] - first[0])) / chord for p in points)
+    if deviation <= tolerance:
+        return None
+
+    circle = _circle(first, points[len(points) // 2], last)
+    if circle is None:
+        return None
+    ux, uy, radius = circle
+
+    sweep = 0.0
+    direction = 0
+    previous = None
+    for x, y in points:
+        if abs(math.hypot(x - ux, y - uy) - radius) > tolerance:
+            return None
+        if previous is not None:
+            cross = (previous[0] - ux) * (y - uy) - (previous[1] - uy) * (x - ux)
+            dot = (previous[0] - ux) * (x - ux) + (previous[1] - uy) * (y - uy)
+            sign = 1 if cross > 0 else -1
+            if cross == 0 or (direction and sign != direction):
+                return None
+            direction = sign
+            sweep += math.atan2(abs(cross), dot)
+
+            # Flecha de la cuerda respecto al arco
+            half = math.hypot(x - previous[0], y - previous[1]) / 2
+            if half >= radius or radius - math.sqrt(radius * radius - half * half) > tolerance:
+                return None
+        previous = (x, y)
+
+    if sweep >= math.pi:
+        return None
+    return (3 if direction > 0 else 2), radius
+
+def _fit_run(start, run, tolerance: float, stats):
+    """Ajusta arcos en un tramo de G1 en XY que empieza en start. run: [(x, y, palabras_arco, bloque)]."""
+    output = []
+    previous = start
+    index = 0
+    while index < len(run):
+        best = None
+        end = index + MIN_ARC_SEGMENTS - 1
+        while end < len(run) and end - index < MAX_ARC_POINTS:
+            arc = fit_arc([previous] + [(p[0], p[1]) for p in run[index:end + 1]], tolerance)
+            if arc is None:
+                break
+            best = (end, arc)
+            end += 1
+
+        if best is None:
+            output.append(run[index][3])
+            previous = run[index][:2]
+            index += 1
+            continue
+
+        end, (g, radius) = best
+        x, y, words, _ = run[end]
+        arc_words = [("G", str(g)), *words[:2], ("CR", f"{radius:.4f}"), *words[2:]]
+        output.append(format_block(arc_words))
+        stats["arcs"] = stats.get("arcs", 0) + 1
+        stats["arc_segments"] = stats.get("arc_segments", 0) + end - index + 1
+        previous = (x, y)
+        index = end + 1
+    return output
+
+def fit_arcs(blocks, tolerance: float, stats=None, start=None):
+    """Etapa: sustituye cadenas de G1 en XY que siguen un arco por G2/G3 con CR.
+
+    stats (dict opcional) recibe "arcs" (arcos creados) y "arc_segments" (G1 sustituidos).
+    start (opcional): {eje: texto} de la posición al empezar, si los bloques siguen a otros.
+    """
+    if stats is None:
+        stats = {}
+    start = start or {}
+    x_text, y_text = start.get("X"), start.get("Y")
+    x, y, z = (to_float(start[axis]) if start.get(axis) is not None else None for axis in ("X", "Y", "Z"))
+    run = []
+    run_start = None
+    run_feed = None
+    previous_xy = (x, y) if x is not None and y is not None else None
+
+    for block in blocks:
+        words = tokenize(block)
+        g_values = [code_value(value) for address, value in words if address == "G"]
+        values = {address: value for address, value in words}
+        new_z = to_float(values["Z"]) if "Z" in values else z
+        linear_xy = (g_values == ["1"]
+                     and all(address in LINEAR_ADDRESSES for address, _ in words)
+                     and ("X" in values or "Y" in values)
+                     and x is not None and y is not None
+                     and new_z == z)
+        feed = values.get("F")
+
+        if linear_xy and run and feed != run_feed:
+            yield from _fit_run(run_start, run, tolerance, stats)
+            run = []
+
+        # Actualizar la posición
+        if "X" in values:
+            x, x_text = to_float(values["X"]), values["X"]
+        if "Y" in values:
+            y, y_text = to_float(values["Y"]), values["Y"]
+        z = new_z
+
+        if linear_xy:
+            if not run:
+                run_start = previous_xy
+                run_feed = feed
+            arc_words = [("X", x_text), ("Y", y_text)] + ([("F", feed)] if feed is not None else [])
+            run.append((x, y, arc_words, block))
+            if len(run) >= MAX_RUN_POINTS:
+                yield from _fit_run(run_start, run, tolerance, stats)
+                run = []
+        else:
+            if run:
+                yield from _fit_run(run_start, run, tolerance, stats)
+                run = []
+            yield block
+
+        previous_xy = (x, y) if x is not None and y is not None else None
+
+    if run:
+        yield from _fit_run(run_start, run, tolerance, stats)
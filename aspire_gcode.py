@@ -1,124 +1,185 @@
-import re
-import math
+from conversion_job import track_progress
+from decimation import simplify_polylines
+from emco_program import NUMBER_ALL, number_blocks, program_blocks, write_emco_program, spindle_restart_on_tool_change
+from feed_planning import dialect_feed
+from parallel_convert import chunked_blocks
+from profiling import ConversionProfile, clock
+from gcode_lexer import (
+    ARC_CODES, MOTION_CODES, code_set, code_value, find_value, format_block, g_codes,
+    has_address, has_code, matching_code, pad_leading_zero, rename_address, replace_value,
+    strip_comments, strip_sequence, tokenize)
+
+# 'G17D1' queda cubierto por G17 (se lee como las palabras G17 y D1)
+SKIP_CODES = code_set(
+    "G54", "G90", "G91", "G20", "G21", "G70", "G71", "G4", "G04", "M03", "M3", "G28",
+    "M05", "M30", "G43", "G40", "G49", "G80", "G17", "%",
+    'L100', 'G451', 'L2', 'MSG', 'G53', 'G64', 'TRANS', "M0")
+
+XYZ_ADDRESSES = frozenset("XYZ")
+XY_ADDRESSES = frozenset("XY")
+R_ADDRESS = frozenset("R")
+AXES = ("X", "Y", "Z")
 
 def skip_line_aspire(line: str):
-    upper_line = line.upper()
-    skip_code = [
-        "G54", "G90", "G91", "G20", "G21", "G70", "G71", "G4", "G04", "M03", "M3", "G28", 
-        "M05", "M30", "G43", "G40", "G49", "G80", "G17", ";", "%", "G54",
-        'L100', 'G451', 'L2', 'G17D1', 'MSG', 'G53', 'G64', 'TRANS', "M0"
-    ]
-
-    for code in skip_code:
-        if code in upper_line:
-            return True
-    
-    return False
+    return has_code(tokenize(strip_comments(line)), SKIP_CODES)
 
 def check_if_xyz(line: str):
-    return ("X" in line.upper()) or ("Y" in line.upper() or ("Z" in line.upper()))
-
-def emco_gcode_from_aspire_gcode(mastercam_file: str, emco_file: str, S: int, F: int, units: str):
-    
-    SEQUENCE_STEP = 10
-    sequence = SEQUENCE_STEP
-    #last_g_code = None  # Registro del último código G usado
-
-    with open(mastercam_file, 'r') as input_file, open(emco_file, 'w') as output_file:
-
-        # CABECERA DEL PROGRAMA
-        output_file.write(f"N{sequence} G90\n")
-        sequence += SEQUENCE_STEP
-        output_file.write(f"N{sequence} {'G71' if units == 'mm' else 'G70'}\n")
-        sequence += SEQUENCE_STEP
-        output_file.write(f"N{sequence} M03 S{S}\n")
-        sequence += SEQUENCE_STEP
-        
-        for line in input_file:
-            output_line = line.strip()
-            
-            # Eliminar números de secuencia (Nxxx) al inicio de la línea
-            output_line = re.sub(r'^N\d+\s*', '', output_line)
-
-            # 🔧 Normalizar formato M06T# → M6 T#
-            output_line = re.sub(r'\bM0?6T(\d+)\b', r'M6 T\1', output_line, flags=re.IGNORECASE)
-
-            # 🔧 Reordenar formato T# M6 → M6 T#
-            output_line = re.sub(r'\bT(\d+)\s*M0?6\b', r'M6 T\1', output_line, flags=re.IGNORECASE)
-
-            # Eliminar comentarios
-            output_line = re.sub(r"\([^)]*\)", "", output_line)
-            output_line = re.sub(r";.*", "", output_line)
-
-            # ELIMINAR CÓDIGOS ESPECÍFICOS QUE QUEREMOS QUITAR
-            if skip_line_aspire(output_line):
-                continue
-
-            if "G0" in output_line and not check_if_xyz(output_line):
-                continue
-
-            # LIMPIAR ESPACIOS MÚLTIPLES
-            output_line = re.sub(r'\s+', ' ', output_line).strip()
-
-            # --- DETECTAR CAMBIO DE HERRAMIENTA Y AGREGAR M05 ANTES ---
-            tool_change_detected = False
-            #tool_number = None
-            
-            # Detectar M6 T1, M6 T2, etc.
-            m6_t_match = re.search(r'M6\s+T(\d+)', output_line, re.IGNORECASE)
-            if m6_t_match:
-                tool_change_detected = True
-                #tool_number = m6_t_match.group(1)
-            
-            # Si se detectó cambio de herramienta, agregar M05 antes
-            if tool_change_detected:
-                output_file.write(f"N{sequence} M05\n")
-                sequence += SEQUENCE_STEP
-
-            # --- CONVERSIÓN DE G2/G3 CON I J - PATRÓN MÁS FLEXIBLE ---
-            if re.search(r"\bG[23]\b", output_line, re.IGNORECASE):
-                aspire_arc_pattern = re.compile(r'^(.*G[23].*[XY][0-9.-]+)\s+([0-9.-]+)\s+([0-9.-]+)(.*)$', re.IGNORECASE)
-                match_aspire_arc = aspire_arc_pattern.search(output_line)
-                
-                if match_aspire_arc:
-                    part1 = match_aspire_arc.group(1)   
-                    num_i = match_aspire_arc.group(2)   
-                    num_j = match_aspire_arc.group(3)   
-                    part_end = match_aspire_arc.group(4) 
-                    
-                    # Agregar ceros si faltan
-                    if num_i.startswith('.'):
-                        num_i = '0' + num_i
-                    elif num_i.startswith('-.'):
-                        num_i = '-0' + num_i[1:]
-                    
-                    if num_j.startswith('.'):
-                        num_j = '0' + num_j
-                    elif num_j.startswith('-.'):
-                        num_j = '-0' + num_j[1:]
-                    
-                    output_line = f"{part1} I{num_i} J{num_j}{part_end}"
-                
-                # También cambiar R por CR
-                output_line = re.sub(r"\bR(-?\.?\d+(\.\d+)?)", r"CR\1", output_line, flags=re.IGNORECASE)
-
-            # REEMPLAZAR F EXISTENTES
-            if re.search(r'\bF\d+(\.\d+)?', output_line, re.IGNORECASE):
-                output_line = re.sub(r'\bF\d+(\.\d+)?', f'F{F}', output_line, flags=re.IGNORECASE)
-            
-            # Si no tiene F pero es movimiento G0/G1/G2/G3, agregar F
-            if re.search(r'\bG[0123]\b', output_line, re.IGNORECASE) and not re.search(r'\bF\d+(\.\d+)?', output_line, re.IGNORECASE):
-                output_line += f' F{F}'
-
-            # Escribir solo si queda contenido
-            if output_line.strip():
-                output_file.write(f"N{sequence} {output_line}\n")
-                sequence += SEQUENCE_STEP
-                if tool_change_detected:
-                    output_file.write(f"N{sequence} M03 S{S}\n") 
-                    sequence += SEQUENCE_STEP
-
-        # FINAL DEL PROGRAMA
-        output_file.write(f"N{sequence} M05\n")
-        sequence += SEQUENCE_STEP
-        output_file.write(f"N{sequence} M30\n")
+    return has_address(tokenize(line), XYZ_ADDRESSES)
+
+def normalize_tool_change(words):
+    # Normalizar M06T#, M06 T# y T# M6 → M6 T#
+    tool = find_value(words, "T")
+    if tool is None:
+        return words, False
+    for index, (address, value) in enumerate(words):
+        if address == "M" and code_value(value) == "6":
+            break
+    else:
+        return words, False
+
+    first = min(index, next(i for i, word in enumerate(words) if word[0] == "T"))
+    words = [word for i, word in enumerate(words) if i != index and word[0] != "T"]
+    words[first:first] = [("M", "6"), ("T", tool)]
+    return words, True
+
+def convert_aspire_arc(words):
+    # Aspire escribe I y J como números sueltos detrás de la última X/Y:
+    # G2 X1. Y2. .5 -.5 → G2 X1. Y2. I0.5 J-0.5
+    for index in range(len(words) - 2, 0, -1):
+        if (words[index - 1][0] in XY_ADDRESSES and words[index][0] == ""
+                and words[index + 1][0] == ""):
+            words = list(words)
+            words[index] = ("I", pad_leading_zero(words[index][1]))
+            words[index + 1] = ("J", pad_leading_zero(words[index + 1][1]))
+            break
+    return words
+
+def aspire_blocks(lines, F: int, profile: ConversionProfile = None):
+    """Etapa de conversión: líneas de Aspire -> bloques EMCO sin número de secuencia.
+
+    profile (opcional) recibe los tiempos por etapa y los contadores de reglas aplicadas.
+    Con F None se conservan los F del CAM (para feed_planning con factor de CAM).
+    """
+    feed = str(F) if F is not None else None
+
+    for line in lines:
+        if profile:
+            t = clock()
+        # Eliminar números de secuencia (Nxxx) y comentarios, y separar en palabras
+        words = tokenize(strip_comments(strip_sequence(line.strip())))
+        if profile:
+            t = profile.lap("comments", t)
+        if not words:
+            continue
+
+        # Normalizar el cambio de herramienta a M6 T#
+        words, _ = normalize_tool_change(words)
+
+        # ELIMINAR CÓDIGOS ESPECÍFICOS QUE QUEREMOS QUITAR
+        if has_code(words, SKIP_CODES):
+            if profile:
+                profile.lap("skip", t)
+                profile.skip(matching_code(words, SKIP_CODES))
+            continue
+
+        g_values = g_codes(words)
+        if "0" in g_values and not has_address(words, XYZ_ADDRESSES):
+            if profile:
+                profile.lap("skip", t)
+                profile.skip("G0")
+            continue
+        if profile:
+            t = profile.lap("skip", t)
+
+        # --- CONVERSIÓN DE G2/G3 CON I J ---
+        if ARC_CODES.intersection(g_values):
+            converted = convert_aspire_arc(words)
+            if profile:
+                if converted is not words:
+                    profile.count("bare_ij")
+                if has_address(converted, R_ADDRESS):
+                    profile.count("r_to_cr")
+            # También cambiar R por CR
+            words = rename_address(converted, "R", "CR")
+        if profile:
+            t = profile.lap("arcs", t)
+
+        # REEMPLAZAR F EXISTENTES
+        if feed is None:
+            pass
+        elif find_value(words, "F") is not None:
+            words = replace_value(words, "F", feed)
+            if profile:
+                profile.count("f_overridden")
+        # Si no tiene F pero es movimiento G0/G1/G2/G3, agregar F
+        elif MOTION_CODES.intersection(g_values):
+            words.append(("F", feed))
+            if profile:
+                profile.count("f_appended")
+        if profile:
+            profile.lap("feed", t)
+
+        yield format_block(words)
+
+def aspire_modal_state(previous_lines):
+    """Estado modal al final de previous_lines, recorridas hacia atrás desde el corte.
+
+    Los bloques de Aspire no dependen de los anteriores; solo hace falta la posición
+    ({"position": {eje: texto}}) para la simplificación.
+    """
+    position = dict.fromkeys(AXES)
+    pending = set(AXES)
+    for line in previous_lines:
+        words = tokenize(strip_comments(strip_sequence(line.strip())))
+        if not words or has_code(words, SKIP_CODES):
+            continue
+        for address, value in reversed(words):
+            if address in pending:
+                position[address] = value
+                pending.discard(address)
+        if not pending:
+            break
+    return {"position": position}
+
+def aspire_stages(lines, S: int, F: int, report, profiler: ConversionProfile = None, state=None,
+                  simplify_tolerance: float = None):
+    """Bloques EMCO (sin cabecera ni números) de las líneas; report recibe los informes de las etapas."""
+    blocks = aspire_blocks(lines, F, profiler)
+    if profiler:
+        blocks = profiler.iterate("dialect", blocks)
+    if simplify_tolerance:
+        report["simplify"] = {}
+        blocks = simplify_polylines(blocks, simplify_tolerance, report["simplify"], state and state["position"])
+        if profiler:
+            blocks = profiler.iterate("simplify", blocks)
+    return spindle_restart_on_tool_change(blocks, S, profiler)
+
+def emco_blocks_from_aspire_gcode(lines, S: int, F: int, units: str):
+    """Programa EMCO completo y numerado a partir de un iterable de líneas de Aspire."""
+    blocks = spindle_restart_on_tool_change(aspire_blocks(lines, F), S)
+    return number_blocks(program_blocks(blocks, S, units))
+
+def emco_gcode_from_aspire_gcode(mastercam_file: str, emco_file: str, S: int, F: int, units: str, progress=None, subprograms: bool = False,
+                                 simplify_tolerance: float = None, profile: bool = False, columnar: bool = False,
+                                 jobs: int = None, compact: bool = False, numbering: str = NUMBER_ALL,
+                                 validate=None, feed_plan=None):
+
+    report = {}
+    profiler = ConversionProfile() if profile else None
+    feed = dialect_feed(F, feed_plan)  # None: el plan de avances parte de los F del CAM
+    # Con columnar el F se fija sobre el modelo en columnas y el dialecto conserva los del CAM
+    stage_feed = None if columnar else feed
+    with open(mastercam_file, 'r') as input_file:
+        if jobs is not None and not profiler:
+            # Por trozos en varios procesos; la salida es la misma que la secuencial
+            blocks = chunked_blocks(input_file, aspire_stages, aspire_modal_state, skip_line_aspire,
+                                    S, stage_feed, report, jobs, progress, any_line=not simplify_tolerance,
+                                    simplify_tolerance=simplify_tolerance)
+        else:
+            lines = track_progress(input_file, progress)
+            blocks = aspire_stages(lines, S, stage_feed, report, profiler, simplify_tolerance=simplify_tolerance)
+        write_emco_program(emco_file, blocks, S, units, subprograms, report, columnar, compact, numbering,
+                           validate, feed_plan, feed, profiler=profiler)
+    if profiler:
+        report["profile"] = profiler.report()
+    return report
@@ -0,0 +1,291 @@
+import math
+import mmap
+import os
+import queue
+import threading
+from array import array
+from cycle_time import CycleTimeEstimator, file_subprogram_loader
+
+# Trazado de la trayectoria de un programa EMCO convertido para la vista
+# previa. El archivo se recorre con un índice de líneas sobre mmap, los
+# movimientos se siguen con el mismo estado modal que el estimador de tiempo
+# de ciclo (G90/G91, subprogramas L####) y los arcos CR o I/J se convierten
+# en polilíneas. Las coordenadas se guardan en float32 y cada redibujado
+# descarta los puntos que caen en el mismo píxel que el anterior, así la
+# cantidad de líneas que llegan al Canvas depende del tamaño de la ventana y
+# no del número de bloques.
+
+RAPID = "rapid"
+FEED = "feed"
+
+CHUNK_LINES = 20000        # Líneas por trozo al leer (y entre avisos de progreso)
+ARC_TOLERANCE = 0.01       # Flecha máxima al dividir arcos, en unidades del programa
+MAX_ARC_SEGMENTS = 128
+BATCH_POINTS = 2000        # Puntos por línea del Canvas
+LOD_PIXELS = 1.0           # Distancia mínima en pantalla entre puntos dibujados
+
+PLANES = {"XY": (0, 1), "XZ": (0, 2), "YZ": (1, 2)}
+
+class LineIndex:
+    """Índice de inicio de línea sobre el archivo mapeado en memoria."""
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        offsets = array('Q', [0])
+        find = self._map.find
+        position = find(b"\n")
+        while position != -1:
+            offsets.append(position + 1)
+            position = find(b"\n", position + 1)
+        if offsets[-1] != size:
+            offsets.append(size)  # Última línea sin salto de línea
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def line(self, number: int):
+        return self._map[self.offsets[number]:self.offsets[number + 1]].decode("latin-1")
+
+    def lines(self, start: int, stop: int):
+        for number in range(start, min(stop, len(self))):
+            yield self.line(number)
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+def arc_points(start, end, g: str, i=None, j=None, cr=None, tolerance: float = ARC_TOLERANCE):
+    """Puntos XY intermedios y final de un arco G2/G3 (CR o I/J relativos al inicio)."""
+    sx, sy = start
+    ex, ey = end
+    if cr is not None:
+        radius = abs(cr)
+        dx, dy = ex - sx, ey - sy
+        chord = math.hypot(dx, dy)
+        if chord == 0 or radius == 0:
+            return [end]
+        height = math.sqrt(max(0.0, radius * radius - chord * chord / 4))
+        # Centro a la izquierda de la cuerda en G3 con CR positivo y en G2 con CR negativo
+        side = 1 if (g == "3") == (cr > 0) else -1
+        cx = (sx + ex) / 2 - side * height * dy / chord
+        cy = (sy + ey) / 2 + side * height * dx / chord
+    else:
+        cx, cy = sx + (i or 0.0), sy + (j or 0.0)
+        radius = math.hypot(sx - cx, sy - cy)
+        if radius == 0:
+            return [end]
+
+    start_angle = math.atan2(sy - cy, sx - cx)
+    end_angle = math.atan2(ey - cy, ex - cx)
+    if g == "3":
+        sweep = (end_angle - start_angle) % (2 * math.pi) or 2 * math.pi
+    else:
+        sweep = -((start_angle - end_angle) % (2 * math.pi) or 2 * math.pi)
+
+    step = 2 * math.acos(1 - tolerance / radius) if tolerance < radius else math.pi / 2
+    segments = max(1, min(MAX_ARC_SEGMENTS, math.ceil(abs(sweep) / step)))
+    points = [(cx + radius * math.cos(start_angle + sweep * k / segments),
+               cy + radius * math.sin(start_angle + sweep * k / segments)) for k in range(1, segments)]
+    points.append(end)
+    return points
+
+class Toolpath:
+    """Polilíneas de un tipo de movimiento: coordenadas xyz en float32 e índice de inicio de cada una."""
+
+    def __init__(self):
+        self.coords = array('f')
+        self.starts = array('I')
+
+    def __len__(self):
+        return len(self.starts)
+
+    def polylines(self):
+        points = len(self.coords) // 3
+        for index, start in enumerate(self.starts):
+            stop = self.starts[index + 1] if index + 1 < len(self.starts) else points
+            yield start, stop
+
+class _PathCollector(CycleTimeEstimator):
+    """Estimador de ciclo que guarda cada movimiento como polilínea en lugar de sumar tiempos."""
+
+    def __init__(self, subprogram_loader, tolerance: float):
+        super().__init__(subprogram_loader=subprogram_loader)
+        self.tolerance = tolerance
+        self.paths = {RAPID: Toolpath(), FEED: Toolpath()}
+        self.bounds = [math.inf, math.inf, math.inf, -math.inf, -math.inf, -math.inf]
+        self._last_kind = None
+
+    def _move(self, start, end, values):
+        motion = self.state.motion
+        kind = RAPID if motion == "0" or not self.state.feed else FEED
+        path = self.paths[kind]
+        if kind != self._last_kind:
+            path.starts.append(len(path.coords) // 3)
+            path.coords.extend((start["X"], start["Y"], start["Z"]))
+            self._grow((start["X"], start["Y"], start["Z"]))
+        self._last_kind = kind
+
+        if motion in ("2", "3"):
+            planar = arc_points((start["X"], start["Y"]), (end["X"], end["Y"]), motion,
+                                values.get("I"), values.get("J"), values.get("CR"), self.tolerance)
+            dz = (end["Z"] - start["Z"]) / len(planar)
+            points = [(x, y, start["Z"] + dz * (k + 1)) for k, (x, y) in enumerate(planar)]
+        else:
+            points = [(end["X"], end["Y"], end["Z"])]
+        for point in points:
+            path.coords.extend(point)
+            self._grow(point)
+
+    def _grow(self, point):
+        bounds = self.bounds
+        for axis in range(3):
+            if point[axis] < bounds[axis]:
+                bounds[axis] = point[axis]
+            if point[axis] > bounds[axis + 3]:
+                bounds[axis + 3] = point[axis]
+
+def fit_view(bounds, plane: str, width: int, height: int, margin: int = 20):
+    """(escala, origen_x, origen_y) que encaja la trayectoria en un lienzo de width x height."""
+    u, v = PLANES[plane]
+    if bounds[u] > bounds[u + 3]:
+        return 1.0, width / 2, height / 2
+    span_u = max(bounds[u + 3] - bounds[u], 1e-6)
+    span_v = max(bounds[v + 3] - bounds[v], 1e-6)
+    scale = min((width - 2 * margin) / span_u, (height - 2 * margin) / span_v)
+    origin_x = (width - scale * (bounds[u] + bounds[u + 3])) / 2
+    origin_y = (height + scale * (bounds[v] + bounds[v + 3])) / 2
+    return scale, origin_x, origin_y
+
+def screen_lines(path: Toolpath, plane: str, view, width: int, height: int, cancelled=None):
+    """Líneas en coordenadas de pantalla, sin puntos en el mismo píxel ni tramos fuera del lienzo.
+
+    Produce listas planas [x0, y0, x1, y1, ...] de como mucho BATCH_POINTS puntos.
+    """
+    u, v = PLANES[plane]
+    scale, origin_x, origin_y = view
+    coords = path.coords
+    for start, stop in path.polylines():
+        if cancelled is not None and cancelled():
+            return
+        line = []
+        previous = None
+        for index in range(start, stop):
+            x = origin_x + coords[3 * index + u] * scale
+            y = origin_y - coords[3 * index + v] * scale
+            # Lados del lienzo por los que queda fuera el punto (0 = dentro)
+            out = (x < 0) | (x > width) << 1 | (y < 0) << 2 | (y > height) << 3
+            if previous is not None:
+                last_x, last_y, last_out = previous
+                if not out & last_out:
+                    if abs(x - last_x) < LOD_PIXELS and abs(y - last_y) < LOD_PIXELS and index != stop - 1:
+                        continue  # Mismo píxel que el último punto dibujado
+                    line.extend((x, y))
+                    previous = (x, y, out)
+                    if len(line) >= 2 * BATCH_POINTS:
+                        yield line
+                        line = [x, y]
+                    continue
+                # Tramo entero fuera del lienzo por el mismo lado: cortar la línea
+                if len(line) >= 4:
+                    yield line
+            line = [x, y]
+            previous = (x, y, out)
+        if len(line) >= 4:
+            yield line
+
+class BackplotJob:
+    """Lee el programa y calcula los redibujados en un hilo; la ventana recoge los mensajes de la cola.
+
+    Mensajes de la cola:
+        ("progress", líneas_leídas, total)
+        ("loaded", límites, polilíneas)
+        ("begin", generación)
+        ("lines", generación, tipo, [x0, y0, x1, y1, ...])
+        ("end", generación)
+        ("error", mensaje)
+    """
+
+    def __init__(self, emco_file: str, tolerance: float = ARC_TOLERANCE):
+        self.emco_file = emco_file
+        self.tolerance = tolerance
+        self.messages = queue.Queue()
+        self.paths = None
+        self.bounds = None
+        self._requests = queue.Queue()
+        self._generation = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._requests.put(None)
+
+    def render(self, plane: str, view, width: int, height: int):
+        """Pide un redibujado; cancela el que esté en curso. Devuelve su número de generación."""
+        self._generation += 1
+        self._requests.put((self._generation, plane, view, width, height))
+        return self._generation
+
+    def _run(self):
+        try:
+            self._load()
+        except Exception as e:
+            self.messages.put(("error", str(e)))
+            return
+        while not self._stop.is_set():
+            request = self._requests.get()
+            # Atender solo la petición más reciente
+            while True:
+                try:
+                    request = self._requests.get_nowait()
+                except queue.Empty:
+                    break
+            if request is None or self._stop.is_set():
+                return
+            self._render(*request)
+
+    def _load(self):
+        index = LineIndex(self.emco_file)
+        try:
+            collector = _PathCollector(file_subprogram_loader(self.emco_file), self.tolerance)
+            total = len(index)
+            for start in range(0, total, CHUNK_LINES):
+                if self._stop.is_set():
+                    return
+                collector.feed(index.lines(start, start + CHUNK_LINES))
+                self.messages.put(("progress", min(start + CHUNK_LINES, total), total))
+        finally:
+            index.close()
+        self.paths = collector.paths
+        self.bounds = collector.bounds
+        self.messages.put(("loaded", self.bounds, sum(len(path) for path in self.paths.values())))
+
+    def _render(self, generation, plane, view, width, height):
+        def cancelled():
+            return generation != self._generation or self._stop.is_set()
+
+        self.messages.put(("begin", generation))
+        for kind in (RAPID, FEED):
+            for line in screen_lines(self.paths[kind], plane, view, width, height, cancelled):
+                if cancelled():
+                    return
+                self.messages.put(("lines", generation, kind, line))
+        if not cancelled():
+            self.messages.put(("end", generation))
+
+    def drain(self, limit: int = None):
+        """Devuelve hasta limit mensajes pendientes sin bloquear."""
+        messages = []
+        while limit is None or len(messages) < limit:
+            try:
+                messages.append(self.messages.get_nowait())
+            except queue.Empty:
+                break
+        return messages
@@ -0,0 +1,138 @@
+import tkinter as tk
+from tkinter import ttk
+import os
+from backplot import FEED, RAPID, BackplotJob, fit_view
+
+POLL_INTERVAL_MS = 30
+MAX_LINES_PER_POLL = 200      # Líneas del Canvas creadas por vuelta del bucle de Tk
+RENDER_DELAY_MS = 250         # Espera tras zoom/desplazamiento antes de redibujar con detalle
+ZOOM_STEP = 1.25
+
+COLORS = {RAPID: "#d04040", FEED: "#2060c0"}
+
+class BackplotWindow:
+    """Ventana de vista previa de la trayectoria de un programa EMCO convertido.
+
+    La lectura y el cálculo de cada redibujado se hacen en BackplotJob; aquí
+    solo se crean las líneas del Canvas por lotes desde root.after. El zoom y
+    el desplazamiento mueven primero lo ya dibujado y después se pide un
+    redibujado con el detalle de la nueva escala.
+    """
+
+    def __init__(self, parent, emco_file):
+        self.top = tk.Toplevel(parent)
+        self.top.title(f"Vista previa - {os.path.basename(emco_file)}")
+        self.top.geometry("700x560")
+        self.top.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.plane = tk.StringVar(value="XY")
+        self.status = tk.StringVar(value="Leyendo programa...")
+        self.view = None
+        self.generation = None
+        self.render_pending = None
+        self.drag_start = None
+        self.closed = False
+
+        self.create_widgets()
+
+        self.job = BackplotJob(emco_file)
+        self.job.start()
+        self.top.after(POLL_INTERVAL_MS, self.poll)
+
+    def create_widgets(self):
+        self.top.columnconfigure(0, weight=1)
+        self.top.rowconfigure(1, weight=1)
+
+        toolbar = ttk.Frame(self.top, padding=5)
+        toolbar.grid(row=0, column=0, sticky=(tk.W, tk.E))
+        toolbar.columnconfigure(5, weight=1)
+
+        ttk.Label(toolbar, text="Plano:").grid(row=0, column=0, padx=(0, 5))
+        for column, plane in enumerate(("XY", "XZ", "YZ"), 1):
+            ttk.Radiobutton(toolbar, text=plane, variable=self.plane, value=plane,
+                           command=self.fit).grid(row=0, column=column, padx=(0, 5))
+        ttk.Button(toolbar, text="Ajustar", command=self.fit).grid(row=0, column=4, padx=(10, 0))
+        ttk.Label(toolbar, textvariable=self.status).grid(row=0, column=5, sticky=tk.E)
+
+        self.canvas = tk.Canvas(self.top, background="white", highlightthickness=0)
+        self.canvas.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+
+        # Zoom con la rueda (Windows/macOS y X11) y desplazamiento arrastrando
+        self.canvas.bind("<MouseWheel>", lambda event: self.zoom(event, event.delta > 0))
+        self.canvas.bind("<Button-4>", lambda event: self.zoom(event, True))
+        self.canvas.bind("<Button-5>", lambda event: self.zoom(event, False))
+        self.canvas.bind("<ButtonPress-1>", self.start_drag)
+        self.canvas.bind("<B1-Motion>", self.drag)
+        self.canvas.bind("<Configure>", lambda event: self.schedule_render())
+
+    def canvas_size(self):
+        return max(self.canvas.winfo_width(), 1), max(self.canvas.winfo_height(), 1)
+
+    def fit(self):
+        if self.job.bounds is None:
+            return
+        self.view = fit_view(self.job.bounds, self.plane.get(), *self.canvas_size())
+        self.render()
+
+    def render(self):
+        self.render_pending = None
+        if self.view is None or self.closed:
+            return
+        self.generation = self.job.render(self.plane.get(), self.view, *self.canvas_size())
+
+    def schedule_render(self):
+        if self.render_pending is not None:
+            self.top.after_cancel(self.render_pending)
+        self.render_pending = self.top.after(RENDER_DELAY_MS, self.render)
+
+    def zoom(self, event, zoom_in):
+        if self.view is None:
+            return
+        factor = ZOOM_STEP if zoom_in else 1 / ZOOM_STEP
+        scale, origin_x, origin_y = self.view
+        self.view = (scale * factor, event.x + (origin_x - event.x) * factor,
+                     event.y + (origin_y - event.y) * factor)
+        self.canvas.scale("path", event.x, event.y, factor, factor)
+        self.schedule_render()
+
+    def start_drag(self, event):
+        self.drag_start = (event.x, event.y)
+
+    def drag(self, event):
+        if self.view is None or self.drag_start is None:
+            return
+        dx, dy = event.x - self.drag_start[0], event.y - self.drag_start[1]
+        self.drag_start = (event.x, event.y)
+        scale, origin_x, origin_y = self.view
+        self.view = (scale, origin_x + dx, origin_y + dy)
+        self.canvas.move("path", dx, dy)
+        self.schedule_render()
+
+    def poll(self):
+        """Vacía parte de la cola del trabajo y dibuja las líneas recibidas."""
+        if self.closed:
+            return
+        for message in self.job.drain(MAX_LINES_PER_POLL):
+            kind = message[0]
+            if kind == "progress":
+                _, done, total = message
+                self.status.set(f"Leyendo programa... {100 * done / max(total, 1):.0f}%")
+            elif kind == "loaded":
+                self.status.set(f"{message[2]} trayectorias")
+                self.fit()
+            elif kind == "begin" and message[1] == self.generation:
+                # El nuevo dibujo sustituye al anterior cuando empieza a llegar
+                self.canvas.delete("path")
+            elif kind == "lines" and message[1] == self.generation:
+                _, _, path_kind, coords = message
+                self.canvas.create_line(*coords, fill=COLORS[path_kind], tags=("path", path_kind))
+            elif kind == "end" and message[1] == self.generation:
+                self.canvas.tag_raise(FEED)
+            elif kind == "error":
+                self.status.set(f"Error: {message[1]}")
+        self.top.after(POLL_INTERVAL_MS, self.poll)
+
+    def close(self):
+        self.closed = True
+        self.job.stop()
+        self.top.destroy()
@@ -0,0 +1,297 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dialects import DIALECTS, sniff_dialect, sniff_lines
+from cycle_time import RAPID_RATE, TOOL_CHANGE_TIME, estimate_cycle_time
+from emco_program import NUMBER_ALL, NUMBERING_MODES, report_summary
+from feed_planning import feed_plan_settings, parse_feeds
+from conversion_cache import MAX_CACHE_BYTES, ConversionCache, cache_summary, default_cache_dir
+from program_split import split_emco_program
+from program_validation import SURFACE_Z, parse_limits, validation_settings
+
+AUTO_SOURCE = "auto"  # Detectar la fuente de cada archivo con dialects.sniff_dialect
+
+SOURCE_ALIASES = {
+    "auto": AUTO_SOURCE,
+    "mastercam": "Mastercam",
+    "aspire": "Aspire",
+    "kiri:moto": "Kiri:Moto",
+    "kirimoto": "Kiri:Moto",
+    "kiri": "Kiri:Moto",
+}
+
+INPUT_EXTENSIONS = (".nc", ".txt", ".ngc")
+OUTPUT_SUFFIX = "_FOR_EMCO.SPF"
+
+def generate_output_filename(input_file: str):
+    """Genera el nombre del archivo de salida"""
+    base_name = os.path.splitext(input_file)[0]
+    return f"{base_name}{OUTPUT_SUFFIX}"
+
+def source_name(value: str):
+    try:
+        return SOURCE_ALIASES[value.lower()]
+    except KeyError:
+        raise argparse.ArgumentTypeError(
+            f"fuente desconocida '{value}' (opciones: {', '.join(DIALECTS)}, {AUTO_SOURCE})")
+
+def limits_argument(value: str):
+    try:
+        return parse_limits(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def feeds_argument(value: str):
+    try:
+        return parse_feeds(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def expand_inputs(patterns):
+    """Expande archivos, globs y directorios a una lista ordenada de archivos GCode."""
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for name in sorted(os.listdir(pattern)):
+                path = os.path.join(pattern, name)
+                if os.path.isfile(path) and name.lower().endswith(INPUT_EXTENSIONS):
+                    files.append(path)
+        elif glob.has_magic(pattern):
+            files.extend(path for path in sorted(glob.glob(pattern)) if os.path.isfile(path))
+        else:
+            files.append(pattern)
+
+    # No volver a convertir salidas de ejecuciones anteriores ni repetir archivos
+    unique = []
+    seen = set()
+    for path in files:
+        key = os.path.abspath(path)
+        if key not in seen and not path.upper().endswith(OUTPUT_SUFFIX):
+            seen.add(key)
+            unique.append(path)
+    return unique
+
+def convert_file(input_file: str, source: str, S: int, F: int, units: str, estimate=None, cache=None, split=None,
+                 output_dir: str = None, **options):
+    """Convierte un archivo; se ejecuta en un proceso del pool.
+
+    estimate: None o (avance rápido en mm/min, segundos por cambio de herramienta).
+    cache: None o (directorio, tamaño máximo en bytes) de la caché de conversiones.
+    split: None o (tamaño máximo en bytes o None, cortar en cambios de herramienta) para dividir la salida.
+    output_dir: directorio de la salida; por defecto, junto al archivo de entrada.
+    Con source "auto" la fuente se detecta a partir del contenido del archivo.
+    """
+    output_file = generate_output_filename(input_file)
+    if output_dir:
+        output_file = os.path.join(output_dir, os.path.basename(output_file))
+    detected = source == AUTO_SOURCE
+    if detected:
+        source = sniff_dialect(input_file)
+        if source is None:
+            raise ValueError("no se pudo detectar la fuente GCode, indícala con --source")
+    dialect = DIALECTS[source]
+    options = dialect.supported_options(options)
+    converter = dialect.converter
+    if cache is not None:
+        converter = ConversionCache(*cache).cached(source, converter)
+    start = time.perf_counter()
+    report = converter(input_file, output_file, S, F, units, **options)
+    seconds = time.perf_counter() - start
+    if estimate is not None:
+        report["cycle_time"] = estimate_cycle_time(output_file, *estimate)
+    if split is not None:
+        report["split"] = split_emco_program(output_file, *split)
+    if detected:
+        report["detected_source"] = source
+    return output_file, seconds, report
+
+def converter_options(args):
+    """Opciones adicionales del conversor según los argumentos."""
+    options = {"subprograms": args.subprograms}
+    if args.estimate:
+        options["estimate"] = (args.rapid_rate, args.tool_change_time)
+    if args.arc_tolerance:
+        options["arc_tolerance"] = args.arc_tolerance
+    if args.stock_top is not None:
+        options["stock_top"] = args.stock_top
+    if args.simplify_tolerance:
+        options["simplify_tolerance"] = args.simplify_tolerance
+    if args.profile:
+        options["profile"] = True
+    if args.columnar:
+        options["columnar"] = True
+    if args.compact:
+        options["compact"] = True
+    if args.numbering != NUMBER_ALL:
+        options["numbering"] = args.numbering
+    if args.chunk_jobs is not None:
+        options["jobs"] = args.chunk_jobs
+    if args.feed_plan or args.feeds or args.cam_feed_factor:
+        options["feed_plan"] = feed_plan_settings(args.feed_rate, args.feeds, args.cam_feed_factor)
+    if args.validate or args.limits:
+        # Sin --surface, la superficie de --stock-top si se indicó
+        surface = args.surface if args.surface is not None else args.stock_top
+        options["validate"] = validation_settings(args.limits, SURFACE_Z if surface is None else surface)
+    if args.split_size or args.split_tool_changes:
+        options["split"] = (args.split_size * 1000 if args.split_size else None, args.split_tool_changes)
+    if not args.no_cache:
+        options["cache"] = (args.cache_dir, args.cache_size * 1_000_000)
+    return options
+
+def file_only_options(args):
+    """Opciones indicadas que la conversión en streaming de stdin no aplica."""
+    used = [("--subprograms", args.subprograms), ("--estimate", args.estimate),
+            ("--arc-tolerance", args.arc_tolerance), ("--stock-top", args.stock_top is not None),
+            ("--simplify-tolerance", args.simplify_tolerance), ("--split-size", args.split_size),
+            ("--split-tool-changes", args.split_tool_changes), ("--compact", args.compact),
+            ("--numbering", args.numbering != NUMBER_ALL), ("--feed-plan", args.feed_plan),
+            ("--feeds", args.feeds), ("--cam-feed-factor", args.cam_feed_factor),
+            ("--validate", args.validate), ("--limits", args.limits), ("--surface", args.surface is not None),
+            ("--columnar", args.columnar), ("--profile", args.profile), ("--json-report", args.json_report),
+            ("--jobs", args.jobs), ("--chunk-jobs", args.chunk_jobs is not None)]
+    return [option for option, value in used if value]
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Convierte archivos GCode (Mastercam, Aspire, Kiri:Moto) a programas SPF para CNC Emco.")
+    parser.add_argument("inputs", nargs="*",
+                        help="archivos, globs o directorios de entrada ('-' lee de stdin y escribe en stdout)")
+    parser.add_argument("--source", "-s", type=source_name, default=AUTO_SOURCE,
+                        help="fuente GCode: Mastercam, Aspire, Kiri:Moto o auto para detectarla en cada archivo (auto)")
+    parser.add_argument("-S", "--spindle-speed", type=int, default=1500, help="velocidad husillo en RPM (1500)")
+    parser.add_argument("-F", "--feed-rate", type=int, default=150, help="velocidad avance (150)")
+    parser.add_argument("--units", choices=("mm", "inches"), default="mm", help="sistema de unidades (mm)")
+    parser.add_argument("--subprograms", action="store_true",
+                        help="crear subprogramas L####.SPF con los recorridos repetidos")
+    parser.add_argument("--arc-tolerance", type=float, default=None,
+                        help="solo Kiri:Moto: agrupar cadenas de G1 en arcos G2/G3 con esta tolerancia de cuerda")
+    parser.add_argument("--stock-top", type=float, default=None,
+                        help="solo Kiri:Moto: Z de la superficie del material; los G0 por encima se mantienen como rápidos")
+    parser.add_argument("--simplify-tolerance", type=float, default=None,
+                        help="eliminar puntos G1 redundantes dentro de esta tolerancia (en las unidades elegidas)")
+    parser.add_argument("--estimate", action="store_true", help="estimar el tiempo de ciclo de cada programa")
+    parser.add_argument("--rapid-rate", type=float, default=RAPID_RATE,
+                        help=f"avance rápido de la máquina en mm/min ({RAPID_RATE:g})")
+    parser.add_argument("--tool-change-time", type=float, default=TOOL_CHANGE_TIME,
+                        help=f"segundos por cambio de herramienta ({TOOL_CHANGE_TIME:g})")
+    parser.add_argument("--split-size", type=int, default=None,
+                        help="dividir además cada programa en partes _NN_FOR_EMCO.SPF de como mucho estos KB")
+    parser.add_argument("--split-tool-changes", action="store_true",
+                        help="dividir además cada programa en una parte por herramienta")
+    parser.add_argument("--compact", action="store_true",
+                        help="quitar los G0-G3 y F modales repetidos y los ceros sobrantes de los números")
+    parser.add_argument("--numbering", choices=NUMBERING_MODES, default=NUMBER_ALL,
+                        help="bloques con número N: all, tool_changes (solo cambios de herramienta) u off (all)")
+    parser.add_argument("--feed-plan", action="store_true",
+                        help="avance por tipo de movimiento (bajadas, rampas, arcos pequeños, acabados) "
+                             "con -F como máximo")
+    parser.add_argument("--feeds", type=feeds_argument, default=None,
+                        help="avances por clase, p. ej. plunge=50,ramp=80,small_arc=100,finishing=120,linear=200 "
+                             "(implica --feed-plan)")
+    parser.add_argument("--cam-feed-factor", type=float, default=None,
+                        help="conservar los F del CAM multiplicados por este factor, con -F como máximo "
+                             "(implica --feed-plan)")
+    parser.add_argument("--validate", action="store_true",
+                        help="validar el programa: límites, radios de arcos, rápidos en el material y unidades")
+    parser.add_argument("--limits", type=limits_argument, default=None,
+                        help="límites de recorrido en mm y coordenadas de pieza, p. ej. X-10:180,Y0:130,Z-60:20 "
+                             "(implica --validate)")
+    parser.add_argument("--surface", type=float, default=None,
+                        help=f"Z de la superficie del material para la validación (--stock-top o {SURFACE_Z:g})")
+    parser.add_argument("--columnar", action="store_true",
+                        help="pasar el programa por el modelo en columnas (informa de la extensión de los ejes)")
+    parser.add_argument("--profile", action="store_true",
+                        help="medir el tiempo de cada etapa y contar las reglas aplicadas (sin usar la caché)")
+    parser.add_argument("--json-report", help="guardar el informe de cada archivo en este JSON")
+    parser.add_argument("--jobs", "-j", type=int, default=None,
+                        help="procesos en paralelo (por defecto, uno por CPU)")
+    parser.add_argument("--chunk-jobs", type=int, default=None,
+                        help="convertir cada archivo grande por trozos en estos procesos (0 = uno por CPU); "
+                             "el resultado es el mismo que sin trozos. Solo con un proceso en el lote "
+                             "(--jobs 1 o un único archivo)")
+    parser.add_argument("--no-cache", action="store_true", help="no usar la caché de conversiones")
+    parser.add_argument("--cache-dir", default=default_cache_dir(),
+                        help=f"directorio de la caché de conversiones ({default_cache_dir()})")
+    parser.add_argument("--cache-size", type=int, default=MAX_CACHE_BYTES // 1_000_000,
+                        help=f"tamaño máximo de la caché en MB ({MAX_CACHE_BYTES // 1_000_000})")
+    parser.add_argument("--cache-info", action="store_true", help="mostrar el estado de la caché y salir")
+    parser.add_argument("--cache-clear", action="store_true", help="vaciar la caché y salir")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.cache_info or args.cache_clear:
+        cache = ConversionCache(args.cache_dir, args.cache_size * 1_000_000)
+        if args.cache_clear:
+            print(f"Caché vaciada: {cache.clear()} entradas eliminadas")
+        if args.cache_info:
+            print(cache_summary(cache.info()))
+        return 0
+    if not args.inputs:
+        parser.error("se necesitan archivos de entrada")
+    if (args.arc_tolerance or args.stock_top is not None) and args.source not in ("Kiri:Moto", AUTO_SOURCE):
+        parser.error("--arc-tolerance y --stock-top solo están disponibles para Kiri:Moto")
+
+    if args.inputs == ["-"]:
+        unsupported = file_only_options(args)
+        if unsupported:
+            parser.error(f"la entrada '-' (stdin) solo convierte el dialecto y no admite {', '.join(unsupported)}")
+        source, lines = args.source, sys.stdin
+        if source == AUTO_SOURCE:
+            source, lines = sniff_lines(lines)
+            if source is None:
+                parser.error("no se pudo detectar la fuente GCode de stdin, indícala con --source")
+        lines = DIALECTS[source].stream_converter(lines, args.spindle_speed, args.feed_rate, args.units)
+        sys.stdout.writelines(lines)
+        return 0
+
+    files = expand_inputs(args.inputs)
+    if not files:
+        print("No se encontraron archivos GCode para convertir", file=sys.stderr)
+        return 2
+
+    workers = min(args.jobs or os.cpu_count() or 1, len(files))
+    options = converter_options(args)
+    if workers > 1 and options.get("jobs", 1) != 1:
+        # Un pool de procesos dentro de cada proceso del lote solo reparte las mismas CPU
+        print(f"--chunk-jobs se ignora con {workers} procesos en paralelo: cada archivo se convierte entero",
+              file=sys.stderr)
+        options["jobs"] = 1
+    failures = 0
+    reports = {}
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(convert_file, path, args.source, args.spindle_speed, args.feed_rate, args.units,
+                            **options): path
+            for path in files
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                output_file, seconds, report = future.result()
+            except Exception as e:
+                failures += 1
+                reports[path] = {"error": str(e)}
+                print(f"ERROR {path}: {e}", file=sys.stderr)
+            else:
+                reports[path] = {"output": output_file, "seconds": round(seconds, 3), **report}
+                print(f"OK    {path} -> {output_file} ({seconds:.2f} s)")
+                for line in report_summary(report):
+                    print(f"      {line}")
+
+    if args.json_report:
+        with open(args.json_report, 'w') as json_report:
+            json.dump(reports, json_report, indent=2)
+
+    print(f"{len(files) - failures}/{len(files)} archivos convertidos en {time.perf_counter() - start:.2f} s")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
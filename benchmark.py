@@ -0,0 +1,278 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from batch_convert import source_name
+from dialects import get_converter
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Tamaños de los corpus sintéticos
+SIZES = {"10k": 10_000, "1M": 1_000_000, "10M": 10_000_000}
+
+TOOL_CHANGE_EVERY = 50_000  # Bloques de movimiento entre cambios de herramienta
+CLEARANCE_Z = 5.0
+
+def toolpath_moves(seed: int):
+    """Recorrido sintético sin fin: pasadas lineales, arcos, bajadas en Z y cambios de herramienta.
+
+    Genera tuplas (tipo, datos):
+        ("tool", número), ("retract", z), ("rapid", (x, y)), ("plunge", z),
+        ("line", (x, y)), ("arc", (2|3, x, y, i, j, radio))
+    """
+    rng = random.Random(seed)
+    x = y = 0.0
+    tool = 1
+    count = 0
+    while True:
+        count += 1
+        if count % TOOL_CHANGE_EVERY == 0:
+            tool += 1
+            yield "retract", CLEARANCE_Z
+            yield "tool", tool
+
+        choice = rng.random()
+        if choice < 0.02:
+            yield "retract", CLEARANCE_Z
+            x, y = rng.uniform(-50, 50), rng.uniform(-50, 50)
+            yield "rapid", (x, y)
+            yield "plunge", -rng.uniform(0.1, 3.0)
+        elif choice < 0.15:
+            radius = rng.uniform(0.5, 10.0)
+            angle = rng.uniform(0, 2 * math.pi)
+            sweep = rng.uniform(0.2, 1.5) * rng.choice((1, -1))
+            i, j = -radius * math.cos(angle), -radius * math.sin(angle)
+            cx, cy = x + i, y + j
+            x, y = cx + radius * math.cos(angle + sweep), cy + radius * math.sin(angle + sweep)
+            yield "arc", (3 if sweep > 0 else 2, x, y, i, j, radius)
+        else:
+            x += rng.uniform(-1, 1)
+            y += rng.uniform(-1, 1)
+            yield "line", (x, y)
+
+def mastercam_body(seed: int):
+    sequence = 110
+    last_g = None
+    for kind, data in toolpath_moves(seed):
+        if kind == "tool":
+            blocks = [f"(TOOL - {data} DIA. OFF. - {data} LEN. - {data} DIA. - 6.)",
+                      f"T{data} M6",
+                      "G0 G90 G54 X0. Y0. A0. S1500 M3",
+                      f"G43 H{data} Z{CLEARANCE_Z:.1f}"]
+            last_g = 0
+        elif kind == "retract":
+            blocks, last_g = [f"G0 Z{data:.1f}"], 0
+        elif kind == "rapid":
+            blocks = [f"X{data[0]:.4f} Y{data[1]:.4f}"]
+        elif kind == "plunge":
+            blocks, last_g = [f"G1 Z{data:.4f} F100."], 1
+        elif kind == "line":
+            prefix = "" if last_g == 1 else "G1 "
+            blocks, last_g = [f"{prefix}X{data[0]:.4f} Y{data[1]:.4f}"], 1
+        else:
+            g, x, y, i, j, radius = data
+            # Alternar arcos con I/J y con R
+            if sequence % 4:
+                blocks = [f"G{g} X{x:.4f} Y{y:.4f} I{i:.4f} J{j:.4f} F150."]
+            else:
+                blocks = [f"G{g} X{x:.4f} Y{y:.4f} R{radius:.4f}"]
+            last_g = g
+
+        for block in blocks:
+            if block.startswith("("):
+                yield block
+            else:
+                yield f"N{sequence} {block}"
+                sequence += 2
+
+def mastercam_lines(n: int, seed: int = 0):
+    header = ["%", "O0000(BENCHMARK)", "(DATE=DD-MM-YY - 01-01-26 TIME=HH:MM - 00:00)",
+              "N100 G21", "N102 G0 G17 G40 G49 G80 G90", "(TOOL - 1 DIA. OFF. - 1 LEN. - 1 DIA. - 6.)",
+              "N104 T1 M6", "N106 G0 G90 G54 X0. Y0. A0. S1500 M3", "N108 G43 H1 Z5."]
+    footer = ["M5", "G91 G28 Z0.", "M30", "%"]
+    return _sized(header, mastercam_body(seed), footer, n)
+
+def aspire_body(seed: int):
+    arc_count = 0
+    for kind, data in toolpath_moves(seed):
+        if kind == "tool":
+            yield f"(Tool {data})"
+            yield f"T{data}M6"
+            yield "M3 S12000"
+        elif kind == "retract":
+            yield f"G0 Z{data:.1f}"
+        elif kind == "rapid":
+            yield f"G0 X{data[0]:.3f} Y{data[1]:.3f}"
+        elif kind == "plunge":
+            yield f"G1 Z{data:.3f} F500.0"
+        elif kind == "line":
+            yield f"G1 X{data[0]:.3f} Y{data[1]:.3f}"
+        else:
+            g, x, y, i, j, radius = data
+            arc_count += 1
+            # Formato de Aspire: I y J como números sueltos, con y sin cero inicial
+            if arc_count % 2:
+                yield f"G{g} X{x:.3f} Y{y:.3f} {i:.3f} {j:.3f}"
+            else:
+                yield f"G{g} X{x:.3f} Y{y:.3f} {i:.3f} {j:.3f}".replace(" 0.", " .").replace(" -0.", " -.")
+
+def aspire_lines(n: int, seed: int = 0):
+    header = ["%", "(Aspire benchmark)", "G90", "G17D1", "T1M6", "M3 S12000", "G0 Z5.0"]
+    footer = ["G0 Z5.0", "M05", "M30", "%"]
+    return _sized(header, aspire_body(seed), footer, n)
+
+def kirimoto_body(seed: int):
+    arc_count = 0
+    for kind, data in toolpath_moves(seed):
+        if kind == "tool":
+            yield f"; tool change to {data}"
+            yield f"M6 T{data}"
+            yield "M3 S1000"
+        elif kind == "retract":
+            yield f"G0 Z{data:g}"
+        elif kind == "rapid":
+            yield f"G0 X{data[0]:.4f} Y{data[1]:.4f}"
+        elif kind == "plunge":
+            yield f"G1 Z{data:.4f} F100"
+        elif kind == "line":
+            yield f"G1 X{data[0]:.4f} Y{data[1]:.4f} F200"
+        else:
+            g, x, y, i, j, radius = data
+            arc_count += 1
+            if arc_count % 2:
+                yield f"G{g} X{x:.4f} Y{y:.4f} I{i:.4f} J{j:.4f}"
+            else:
+                yield f"G{g} X{x:.4f} Y{y:.4f} R{radius:.4f}"
+
+def kirimoto_lines(n: int, seed: int = 0):
+    header = ["; Generated by Kiri:Moto (benchmark)", "G21 ; set units to MM", "G90", "M6 T1", "M3 S1000", "G0 Z5"]
+    footer = ["G0 Z5", "M5", "M30"]
+    return _sized(header, kirimoto_body(seed), footer, n)
+
+def _sized(header, body, footer, n: int):
+    """Cabecera + cuerpo + final con exactamente n líneas (como mínimo cabecera y final)."""
+    yield from header
+    yield from islice(body, max(n - len(header) - len(footer), 0))
+    yield from footer
+
+CORPORA = {
+    "Mastercam": mastercam_lines,
+    "Aspire": aspire_lines,
+    "Kiri:Moto": kirimoto_lines,
+}
+
+def corpus_path(directory: str, source: str, n: int, seed: int):
+    name = source.replace(":", "").lower()
+    path = os.path.join(directory, f"{name}_{n}_{seed}.nc")
+    if not os.path.exists(path):
+        with open(path + ".tmp", "w") as corpus:
+            corpus.writelines(line + "\n" for line in CORPORA[source](n, seed))
+        os.replace(path + ".tmp", path)
+    return path
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def run_conversion(source: str, input_file: str, S: int, F: int, units: str):
+    """Se ejecuta en un proceso nuevo para que el pico de memoria sea solo el de esta conversión."""
+    output_file = input_file + "_FOR_EMCO.SPF"
+    start = time.perf_counter()
+    get_converter(source)(input_file, output_file, S, F, units)
+    seconds = time.perf_counter() - start
+    output_bytes = os.path.getsize(output_file)
+    os.remove(output_file)
+    return seconds, peak_rss_mb(), output_bytes
+
+def benchmark(sources, sizes, directory: str, seed: int = 0, repeat: int = 1, S: int = 1500, F: int = 150, units: str = "mm"):
+    results = []
+    for size in sizes:
+        n = SIZES[size]
+        for source in sources:
+            input_file = corpus_path(directory, source, n, seed)
+            runs = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    runs.append(executor.submit(run_conversion, source, input_file, S, F, units).result())
+            seconds, rss, output_bytes = min(runs, key=lambda run: run[0])
+            result = {
+                "source": source,
+                "size": size,
+                "lines": n,
+                "seconds": round(seconds, 4),
+                "lines_per_sec": round(n / seconds),
+                "peak_rss_mb": None if rss is None else round(rss, 1),
+                "output_bytes": output_bytes,
+            }
+            results.append(result)
+            print(f"{source:10} {size:>4}  {result['seconds']:9.3f} s  {result['lines_per_sec']:>10} líneas/s  "
+                  f"{result['peak_rss_mb']} MB  {output_bytes} bytes")
+    return results
+
+def compare(results, baseline, threshold: float):
+    """Lista de regresiones de líneas/s respecto a un JSON anterior."""
+    previous = {(r["source"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get((result["source"], result["size"]))
+        if old is None:
+            continue
+        change = result["lines_per_sec"] / old["lines_per_sec"] - 1
+        print(f"{result['source']:10} {result['size']:>4}  {change:+.1%} líneas/s")
+        if change < -threshold:
+            regressions.append((result["source"], result["size"], change))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de los conversores con corpus sintéticos.")
+    parser.add_argument("--sources", "-s", type=source_name, nargs="+", default=list(CORPORA),
+                        help="fuentes a medir (por defecto, todas)")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=["10k"], help="tamaños de corpus (10k)")
+    parser.add_argument("--seed", type=int, default=0, help="semilla de los corpus (0)")
+    parser.add_argument("--repeat", type=int, default=1, help="repeticiones; se guarda la más rápida (1)")
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "emco_benchmark"),
+                        help="directorio donde se generan y reutilizan los corpus")
+    parser.add_argument("--output", "-o", help="guardar los resultados en este JSON")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior para detectar regresiones")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="caída de líneas/s que cuenta como regresión (0.10)")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.corpus_dir, exist_ok=True)
+    results = benchmark(args.sources, args.sizes, args.corpus_dir, args.seed, args.repeat)
+
+    if args.output:
+        report = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "results": results,
+        }
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline), args.threshold)
+        if regressions:
+            for source, size, change in regressions:
+                print(f"REGRESIÓN {source} {size}: {change:+.1%}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
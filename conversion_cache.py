@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from subprograms import allocate_subprograms, renumber_calls, subprogram_path
+
+# Caché persistente de conversiones. La clave es el hash del contenido del
+# archivo de entrada junto con la fuente, S, F, unidades, el resto de opciones
+# del conversor y la versión del conversor; cada entrada es un directorio con
+# el SPF, los subprogramas L####.SPF y un meta.json con el informe y el
+# sha256 de cada archivo. Las entradas se comprueban antes de reutilizarse y
+# se expulsan por orden de último uso cuando se supera el tamaño máximo.
+
+CACHE_FORMAT = 1
+MAX_CACHE_BYTES = 1_000_000_000   # 1 GB
+HASH_CHUNK = 1 << 20          # Lectura por bloques al calcular el sha256
+META_FILE = "meta.json"
+PROGRAM_FILE = "program.SPF"
+
+# Módulos cuya salida depende del código: cualquier cambio en ellos invalida la caché
+CONVERTER_MODULES = (
+    "gcode_lexer.py", "mastercam_gcode.py", "aspire_gcode.py", "kirimoto_gcode.py",
+    "emco_program.py", "subprograms.py", "arc_fitting.py", "decimation.py", "program_model.py",
+    "parallel_convert.py", "program_validation.py", "feed_planning.py",
+)
+
+# Opciones que no cambian el programa convertido y no forman parte de la clave
+OUTPUT_NEUTRAL_OPTIONS = frozenset(("jobs",))
+
+_converter_version = None
+
+def default_cache_dir():
+    base = (os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME")
+            or os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "emco_gcode_formatter")
+
+def converter_version():
+    """Huella del código de los conversores (formato de caché + sha256 de los módulos)."""
+    global _converter_version
+    if _converter_version is None:
+        digest = hashlib.sha256(f"formato {CACHE_FORMAT}".encode())
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in CONVERTER_MODULES:
+            try:
+                with open(os.path.join(directory, name), 'rb') as module:
+                    digest.update(module.read())
+            except OSError:
+                digest.update(name.encode())
+        _converter_version = digest.hexdigest()[:16]
+    return _converter_version
+
+def file_sha256(path: str):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as data:
+        for chunk in iter(lambda: data.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ConversionCache:
+    """Caché de conversiones en directory, limitada a max_bytes."""
+
+    def __init__(self, directory: str = None, max_bytes: int = MAX_CACHE_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def key(self, input_file: str, source: str, S, F, units: str, options=None):
+        parameters = {
+            "input": file_sha256(input_file),
+            "source": source,
+            "S": S,
+            "F": F,
+            "units": units,
+            "options": {name: value for name, value in sorted((options or {}).items())
+                        if value is not None and name not in OUTPUT_NEUTRAL_OPTIONS},
+            "version": converter_version(),
+        }
+        return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+
+    def _entry(self, key: str):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return
+        for prefix in os.listdir(self.directory):
+            folder = os.path.join(self.directory, prefix)
+            if len(prefix) != 2 or not os.path.isdir(folder):
+                continue
+            for key in os.listdir(folder):
+                if key.startswith("."):  # Entradas que otro proceso está escribiendo
+                    continue
+                meta = os.path.join(folder, key, META_FILE)
+                try:
+                    stat = os.stat(meta)
+                    with open(meta, 'r') as meta_file:
+                        size = json.load(meta_file)["size"]
+                except (OSError, ValueError, KeyError):
+                    # Entrada a medio escribir o dañada
+                    yield key, os.path.join(folder, key), 0, 0.0
+                    continue
+                yield key, os.path.join(folder, key), size, stat.st_mtime
+
+    def fetch(self, key: str, output_file: str):
+        """Copia la entrada key en output_file (y sus subprogramas) y devuelve el informe, o None."""
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, META_FILE), 'r') as meta_file:
+                meta = json.load(meta_file)
+        except OSError:
+            return None
+        except ValueError:
+            # Las entradas se publican con os.rename ya completas: un meta.json ilegible está dañado
+            self.remove(key)
+            return None
+
+        # Comprobación de integridad antes de reutilizar nada
+        try:
+            intact = all(file_sha256(os.path.join(entry, name)) == digest
+                         for name, digest in meta["files"].items())
+        except (OSError, KeyError):
+            intact = False
+        if not intact:
+            self.remove(key)
+            return None
+
+        # Los subprogramas pasan al rango reservado para output_file en su carpeta
+        stored = sorted(meta["subprograms"])
+        numbers = {}
+        if stored:
+            first = allocate_subprograms(output_file, len(stored))
+            numbers = {old: first + index for index, old in enumerate(stored)}
+        if all(old == new for old, new in numbers.items()):
+            shutil.copyfile(os.path.join(entry, PROGRAM_FILE), output_file)
+        else:
+            with open(os.path.join(entry, PROGRAM_FILE), 'r') as program, open(output_file, 'w') as output:
+                output.writelines(block + "\n" for block in renumber_calls(
+                    (line.rstrip("\n") for line in program), numbers))
+        for old, new in numbers.items():
+            shutil.copyfile(os.path.join(entry, f"L{old}.SPF"), subprogram_path(output_file, new))
+
+        # El mtime de meta.json marca el último uso para la expulsión LRU
+        os.utime(os.path.join(entry, META_FILE))
+        report = meta["report"]
+        if numbers and "subprograms" in report:
+            report["subprograms"]["numbers"] = sorted(numbers.values())
+        return report
+
+    def store(self, key: str, output_file: str, report):
+        """Guarda output_file, sus subprogramas y el informe bajo key."""
+        entry = self._entry(key)
+        if os.path.exists(entry):
+            return
+        numbers = report.get("subprograms", {}).get("numbers", [])
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+
+        # Se escribe en un directorio temporal y se renombra, así otro proceso
+        # del lote nunca ve una entrada a medias
+        staging = tempfile.mkdtemp(prefix=".tmp-", dir=os.path.dirname(entry))
+        try:
+            files = {PROGRAM_FILE: output_file}
+            files.update({f"L{number}.SPF": subprogram_path(output_file, number) for number in numbers})
+            digests = {}
+            size = 0
+            for name, path in files.items():
+                target = os.path.join(staging, name)
+                shutil.copyfile(path, target)
+                digests[name] = file_sha256(target)
+                size += os.path.getsize(target)
+            meta = {"files": digests, "subprograms": numbers, "size": size, "report": report,
+                    "created": time.time()}
+            with open(os.path.join(staging, META_FILE), 'w') as meta_file:
+                json.dump(meta, meta_file)
+            os.rename(staging, entry)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            if not os.path.exists(entry):
+                raise
+            return
+        self.evict()
+
+    def remove(self, key: str):
+        shutil.rmtree(self._entry(key), ignore_errors=True)
+
+    def evict(self):
+        """Elimina las entradas usadas hace más tiempo hasta quedar por debajo de max_bytes."""
+        entries = sorted(self._entries(), key=lambda entry: entry[3])
+        total = sum(entry[2] for entry in entries)
+        removed = 0
+        for key, path, size, _ in entries:
+            if total <= self.max_bytes and size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def info(self):
+        entries = list(self._entries())
+        return {
+            "directory": self.directory,
+            "entries": len(entries),
+            "bytes": sum(entry[2] for entry in entries),
+            "max_bytes": self.max_bytes,
+        }
+
+    def clear(self):
+        """Vacía la caché y devuelve el número de entradas eliminadas."""
+        count = sum(1 for _ in self._entries())
+        shutil.rmtree(self.directory, ignore_errors=True)
+        return count
+
+    def cached(self, source: str, converter):
+        """Envuelve un conversor emco_gcode_from_* para consultar la caché antes de convertir."""
+        def convert(input_file, output_file, S, F, units, progress=None, **options):
+            if options.get("profile"):
+                # Al perfilar interesa medir la conversión real, no la copia de la caché
+                return converter(input_file, output_file, S, F, units, progress=progress, **options)
+            key = self.key(input_file, source, S, F, units, options)
+            report = self.fetch(key, output_file)
+            if report is not None:
+                report["cache_hit"] = True
+                return report
+            report = converter(input_file, output_file, S, F, units, progress=progress, **options)
+            try:
+                self.store(key, output_file, report)
+            except OSError:
+                pass  # Sin caché la conversión sigue siendo válida
+            return report
+        return convert
+
+def cache_summary(info):
+    return (f"Caché: {info['entries']} entradas, {info['bytes'] / 1e6:.1f} MB "
+            f"de {info['max_bytes'] / 1e6:.0f} MB en {info['directory']}")
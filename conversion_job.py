@@ -0,0 +1,107 @@
+import os
+import queue
+import threading
+import time
+from cycle_time import estimate_cycle_time
+from subprograms import release_subprograms
+
+PROGRESS_INTERVAL = 5000  # Líneas entre avisos de progreso
+
+class ConversionCancelled(Exception):
+    pass
+
+def track_progress(input_file, progress, interval: int = PROGRESS_INTERVAL):
+    """Recorre las líneas de input_file avisando a progress(caracteres_leídos) cada interval líneas.
+
+    Sin callback devuelve el archivo tal cual, así que no añade coste por línea.
+    """
+    if progress is None:
+        return input_file
+    return _track_progress(input_file, progress, interval)
+
+def _track_progress(input_file, progress, interval):
+    read_chars = 0
+    for line_number, line in enumerate(input_file, 1):
+        read_chars += len(line)
+        if line_number % interval == 0:
+            progress(read_chars)
+        yield line
+    progress(read_chars)
+
+class ConversionJob:
+    """Ejecuta un conversor emco_gcode_from_* en un hilo y publica su estado en una cola.
+
+    Mensajes de la cola:
+        ("progress", leídos, total, segundos)
+        ("done", archivo_salida, segundos, informe_del_conversor)
+        ("cancelled", archivo_salida)
+        ("error", mensaje)
+    """
+
+    def __init__(self, converter, input_file: str, output_file: str, S: int, F: int, units: str,
+                 estimate: bool = False, **options):
+        self.converter = converter
+        self.input_file = input_file
+        self.output_file = output_file
+        self.S = S
+        self.F = F
+        self.units = units
+        self.estimate = estimate
+        self.options = options
+        self.messages = queue.Queue()
+        self.total = max(os.path.getsize(input_file), 1)
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._start = None
+
+    def start(self):
+        self._start = time.perf_counter()
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def _progress(self, read_chars: int):
+        if self._cancel.is_set():
+            raise ConversionCancelled()
+        self.messages.put(("progress", min(read_chars, self.total), self.total,
+                           time.perf_counter() - self._start))
+
+    def _run(self):
+        try:
+            report = self.converter(self.input_file, self.output_file, self.S, self.F, self.units,
+                                    progress=self._progress, **self.options)
+            if self.estimate:
+                report["cycle_time"] = estimate_cycle_time(self.output_file)
+        except ConversionCancelled:
+            self._remove_output()
+            self.messages.put(("cancelled", self.output_file))
+        except Exception as e:
+            self._remove_output()
+            self.messages.put(("error", str(e)))
+        else:
+            self.messages.put(("done", self.output_file, time.perf_counter() - self._start, report))
+
+    def _remove_output(self):
+        # Eliminar la salida parcial, con los subprogramas escritos y su rango reservado
+        try:
+            os.remove(self.output_file)
+        except OSError:
+            pass
+        if self.options.get("subprograms"):
+            try:
+                release_subprograms(self.output_file)
+            except OSError:
+                pass
+
+    def drain(self):
+        """Devuelve todos los mensajes pendientes sin bloquear."""
+        messages = []
+        while True:
+            try:
+                messages.append(self.messages.get_nowait())
+            except queue.Empty:
+                return messages
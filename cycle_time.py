@@ -0,0 +1,245 @@
+import math
+import os
+from gcode_lexer import MOTION_CODES, code_value, strip_sequence, to_float, tokenize
+from subprograms import subprogram_path
+
+# Estimación del tiempo de ciclo de un programa EMCO ya convertido. Sigue la
+# posición modal, G0-G3, G90/G91, G70/G71 y las llamadas L#### P<n> a
+# subprogramas, y calcula las longitudes lineales y de arco (CR o I/J).
+# ModalTracker es el seguimiento de la posición y del estado modal que
+# comparten esta estimación, la validación y el plan de avances.
+
+RAPID_RATE = 5000.0       # mm/min
+TOOL_CHANGE_TIME = 10.0   # segundos
+INCH = 25.4
+MAX_CALL_DEPTH = 8
+
+AXES = ("X", "Y", "Z")
+MOTIONS = {value: value[-1] for value in ("0", "1", "2", "3", "00", "01", "02", "03")}
+ARC_ADDRESSES = frozenset(("I", "J", "CR"))
+
+class ModalTracker:
+    """Posición y estado modal (G0-G3, G90/G91, G70/G71) de un programa EMCO."""
+
+    def __init__(self, origin: float = None):
+        self.position = dict.fromkeys(AXES, origin)
+        self.motion = None
+        self.absolute = True
+        self.inches = False
+
+    def advance(self, words):
+        """Aplica las palabras de un bloque en texto ("G1", "X10.5", "CR3") y deja self.position en el destino.
+
+        Devuelve (posición inicial, ejes programados, resto de palabras como (dirección, valor)).
+        Las etapas sobre la salida EMCO pasan block.split(), mucho más barato que tokenize;
+        CR es la única dirección de dos letras.
+        """
+        start = self.position
+        target = dict(start)
+        moved = []
+        rest = []
+        for word in words:
+            address = word[0]
+            value = word[1:]
+            if address == "C":
+                address, value = word[:2], word[2:]
+            if address == "G":
+                code = MOTIONS.get(value)
+                if code is None:
+                    code = code_value(value)
+                if code in MOTION_CODES:
+                    self.motion = code
+                elif code == "90":
+                    self.absolute = True
+                elif code == "91":
+                    self.absolute = False
+                elif code == "70":
+                    self.inches = True
+                elif code == "71":
+                    self.inches = False
+            elif address in target:
+                number = to_float(value)
+                if number is not None:
+                    if self.absolute:
+                        target[address] = number
+                    elif target[address] is not None:
+                        target[address] += number
+                    moved.append(address)
+            else:
+                rest.append((address, value))
+        self.position = target
+        return start, moved, rest
+
+class _MachineState(ModalTracker):
+    def __init__(self):
+        super().__init__(0.0)
+        self.feed = None
+        self.tool = None
+
+def arc_length(start, end, g: str, i=None, j=None, cr=None):
+    """Longitud en el plano XY de un arco G2/G3 definido por CR o por I/J (relativos al inicio)."""
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    chord = math.hypot(dx, dy)
+    if cr is not None:
+        radius = abs(cr)
+        if radius == 0:
+            return chord
+        angle = 2 * math.asin(min(1.0, chord / (2 * radius)))
+        if cr < 0:  # CR negativo: arco de más de 180°
+            angle = 2 * math.pi - angle
+        return radius * angle
+
+    cx, cy = start[0] + (i or 0.0), start[1] + (j or 0.0)
+    radius = math.hypot(start[0] - cx, start[1] - cy)
+    start_angle = math.atan2(start[1] - cy, start[0] - cx)
+    end_angle = math.atan2(end[1] - cy, end[0] - cx)
+    sweep = end_angle - start_angle
+    if g == "2":
+        sweep = -sweep
+    sweep %= 2 * math.pi
+    if sweep < 1e-9:  # Mismo punto inicial y final: círculo completo
+        sweep = 2 * math.pi
+    return radius * sweep
+
+class CycleTimeEstimator:
+    """Acumula tiempos y distancias bloque a bloque.
+
+    subprogram_loader(número) debe devolver las líneas del subprograma L#### o None.
+    """
+
+    def __init__(self, rapid_rate: float = RAPID_RATE, tool_change_time: float = TOOL_CHANGE_TIME,
+                 subprogram_loader=None):
+        self.rapid_rate = rapid_rate
+        self.tool_change_time = tool_change_time
+        self.subprogram_loader = subprogram_loader
+        self.state = _MachineState()
+        self.cutting_time = 0.0
+        self.rapid_time = 0.0
+        self.tool_change_total = 0.0
+        self.cutting_distance = 0.0
+        self.rapid_distance = 0.0
+        self.tools = {}
+        self.missing_subprograms = set()
+        self._subprograms = {}
+
+    def _add_tool_time(self, seconds: float):
+        tool = self.state.tool or "sin herramienta"
+        self.tools[tool] = self.tools.get(tool, 0.0) + seconds
+
+    def feed(self, lines, depth: int = 0):
+        for line in lines:
+            self.block(tokenize(strip_sequence(line.strip())), depth)
+        return self
+
+    def block(self, words, depth: int = 0):
+        state = self.state
+        start, moved, rest = state.advance([address + value for address, value in words])
+        values = {}
+        call = None
+        repeat = 1
+
+        for address, value in rest:
+            if address == "F":
+                state.feed = to_float(value)
+            elif address == "M" and code_value(value) == "6":
+                values["M6"] = True
+            elif address == "T":
+                values["T"] = code_value(value)
+            elif address == "L":
+                call = code_value(value)
+            elif address == "P":
+                repeat = int(to_float(value) or 1)
+            elif address in ARC_ADDRESSES:
+                values[address] = to_float(value)
+
+        if "M6" in values:
+            if "T" in values:
+                state.tool = "T" + values["T"]
+            self.tool_change_total += self.tool_change_time
+            self._add_tool_time(self.tool_change_time)
+
+        if moved and state.motion is not None:
+            self._move(start, state.position, values)
+
+        if call is not None and depth < MAX_CALL_DEPTH:
+            lines = self._load(call)
+            if lines is None:
+                self.missing_subprograms.add(call)
+            else:
+                for _ in range(repeat):
+                    self.feed(lines, depth + 1)
+
+    def _move(self, start, end, values):
+        state = self.state
+        dz = end["Z"] - start["Z"]
+        if state.motion in ("2", "3"):
+            planar = arc_length((start["X"], start["Y"]), (end["X"], end["Y"]), state.motion,
+                                values.get("I"), values.get("J"), values.get("CR"))
+            distance = math.hypot(planar, dz)
+        else:
+            distance = math.sqrt(sum((end[axis] - start[axis]) ** 2 for axis in end))
+
+        if state.motion == "0" or not state.feed:
+            # Rápidos (y movimientos sin avance conocido) al avance rápido de la máquina
+            rate = self.rapid_rate / INCH if state.inches else self.rapid_rate
+            seconds = 60 * distance / rate
+            self.rapid_time += seconds
+            self.rapid_distance += distance
+        else:
+            seconds = 60 * distance / state.feed
+            self.cutting_time += seconds
+            self.cutting_distance += distance
+        self._add_tool_time(seconds)
+
+    def _load(self, number: str):
+        if number not in self._subprograms:
+            lines = self.subprogram_loader(number) if self.subprogram_loader else None
+            self._subprograms[number] = list(lines) if lines is not None else None
+        return self._subprograms[number]
+
+    def report(self):
+        return {
+            "total_seconds": round(self.cutting_time + self.rapid_time + self.tool_change_total, 2),
+            "cutting_seconds": round(self.cutting_time, 2),
+            "rapid_seconds": round(self.rapid_time, 2),
+            "tool_change_seconds": round(self.tool_change_total, 2),
+            "cutting_distance": round(self.cutting_distance, 3),
+            "rapid_distance": round(self.rapid_distance, 3),
+            "units": "inches" if self.state.inches else "mm",
+            "tools": {tool: round(seconds, 2) for tool, seconds in self.tools.items()},
+            "missing_subprograms": sorted(self.missing_subprograms),
+        }
+
+def file_subprogram_loader(emco_file: str):
+    """Carga los subprogramas L####.SPF escritos junto a emco_file."""
+    def load(number: str):
+        path = subprogram_path(emco_file, int(number))
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as subprogram:
+            return subprogram.readlines()
+    return load
+
+def estimate_cycle_time(emco_file: str, rapid_rate: float = RAPID_RATE, tool_change_time: float = TOOL_CHANGE_TIME):
+    """Estima el tiempo de ciclo de un archivo SPF convertido."""
+    estimator = CycleTimeEstimator(rapid_rate, tool_change_time, file_subprogram_loader(emco_file))
+    with open(emco_file, 'r') as program:
+        estimator.feed(program)
+    return estimator.report()
+
+def format_duration(seconds: float):
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+def cycle_time_summary(report):
+    unit = "in" if report["units"] == "inches" else "mm"
+    lines = [f"Tiempo de ciclo estimado: {format_duration(report['total_seconds'])} "
+             f"(corte {format_duration(report['cutting_seconds'])}, rápidos {format_duration(report['rapid_seconds'])}, "
+             f"cambios de herramienta {format_duration(report['tool_change_seconds'])})",
+             f"Distancia de corte {report['cutting_distance']:.1f} {unit}, rápidos {report['rapid_distance']:.1f} {unit}"]
+    for tool, seconds in report["tools"].items():
+        lines.append(f"  {tool}: {format_duration(seconds)}")
+    if report["missing_subprograms"]:
+        lines.append(f"Subprogramas no encontrados: {', '.join('L' + n for n in report['missing_subprograms'])}")
+    return lines
@@ -0,0 +1,122 @@
+import math
+from gcode_lexer import code_value, format_block, to_float, tokenize
+
+# Simplificación de polilíneas: elimina los puntos G1 intermedios que quedan a
+# menos de la tolerancia (en las unidades del programa, mm o pulgadas) de la
+# recta simplificada, con Douglas-Peucker por tramos. Un tramo solo contiene
+# G1 con X/Y/Z/F y el mismo F; los rápidos, arcos, cambios de herramienta,
+# cambios de plano o de avance y cualquier otro bloque lo cortan y se
+# escriben tal cual.
+
+MAX_RUN_POINTS = 5000          # Tamaño de cada trozo; acota memoria y el peor caso O(n²)
+BLOCK_PROCESSING_TIME = 0.004  # Segundos estimados que tarda el control en procesar un bloque
+
+LINEAR_ADDRESSES = frozenset(("G", "X", "Y", "Z", "F"))
+AXES = ("X", "Y", "Z")
+
+def _segment_distance(point, start, end):
+    """Distancia 3D de point al segmento start-end."""
+    dx, dy, dz = end[0] - start[0], end[1] - start[1], end[2] - start[2]
+    px, py, pz = point[0] - start[0], point[1] - start[1], point[2] - start[2]
+    length2 = dx * dx + dy * dy + dz * dz
+    if length2 == 0:
+        return math.sqrt(px * px + py * py + pz * pz)
+    t = max(0.0, min(1.0, (px * dx + py * dy + pz * dz) / length2))
+    ex, ey, ez = px - t * dx, py - t * dy, pz - t * dz
+    return math.sqrt(ex * ex + ey * ey + ez * ez)
+
+def douglas_peucker(points, tolerance: float):
+    """Lista de booleanos con los puntos que hay que conservar (el primero y el último siempre)."""
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest = None
+        distance = tolerance
+        for index in range(first + 1, last):
+            d = _segment_distance(points[index], points[first], points[last])
+            if d > distance:
+                farthest, distance = index, d
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return keep
+
+def _simplify_run(start, run, tolerance: float, stats):
+    """run: [(punto, textos_de_ejes, palabras, bloque)], start: (punto, textos) anterior al tramo."""
+    points = [start[0]] + [item[0] for item in run]
+    keep = douglas_peucker(points, tolerance)
+
+    output = []
+    emitted_texts = start[1]
+    previous_kept = True
+    for item, kept in zip(run, keep[1:]):
+        point, texts, words, block = item
+        if not kept:
+            previous_kept = False
+            continue
+        if previous_kept:
+            output.append(block)
+        else:
+            # Repetir los ejes que cambiaron en los bloques eliminados
+            present = {address for address, _ in words}
+            rebuilt = [word for word in words if word[0] == "G"]
+            rebuilt += [(axis, texts[axis]) for axis in AXES
+                        if axis in present or texts[axis] != emitted_texts[axis]]
+            rebuilt += [word for word in words if word[0] == "F"]
+            output.append(format_block(rebuilt))
+        emitted_texts = texts
+        previous_kept = True
+
+    removed = len(run) - sum(keep[1:])
+    stats["points_removed"] = stats.get("points_removed", 0) + removed
+    stats["points_total"] = stats.get("points_total", 0) + len(run)
+    stats["time_saved"] = stats.get("time_saved", 0.0) + removed * BLOCK_PROCESSING_TIME
+    return output
+
+def simplify_polylines(blocks, tolerance: float, stats=None, start=None):
+    """Etapa: elimina los puntos G1 redundantes dentro de la tolerancia.
+
+    stats (dict opcional) recibe "points_removed", "points_total" (G1 analizados) y
+    "time_saved" (segundos estimados a BLOCK_PROCESSING_TIME por bloque).
+    start (opcional): {eje: texto} de la posición al empezar, si los bloques siguen a otros.
+    """
+    if stats is None:
+        stats = {}
+    texts = {axis: (start or {}).get(axis) for axis in AXES}
+    values = {axis: to_float(text) if text is not None else None for axis, text in texts.items()}
+    run = []
+    run_start = None
+    run_feed = None
+
+    for block in blocks:
+        words = tokenize(block)
+        g_values = [code_value(value) for address, value in words if address == "G"]
+        feed = next((value for address, value in words if address == "F"), None)
+        moves = [(address, value, to_float(value)) for address, value in words if address in values]
+        linear = (g_values == ["1"] and moves
+                  and all(value is not None for value in values.values())
+                  and all(number is not None for _, _, number in moves)
+                  and all(address in LINEAR_ADDRESSES for address, _ in words))
+
+        if run and (not linear or feed != run_feed or len(run) >= MAX_RUN_POINTS):
+            yield from _simplify_run(run_start, run, tolerance, stats)
+            run = []
+
+        if linear and not run:
+            run_start = ((values["X"], values["Y"], values["Z"]), dict(texts))
+            run_feed = feed
+
+        for address, value, number in moves:
+            values[address] = number
+            texts[address] = value
+
+        if linear:
+            run.append(((values["X"], values["Y"], values["Z"]), dict(texts), words, block))
+        else:
+            yield block
+
+    if run:
+        yield from _simplify_run(run_start, run, tolerance, stats)
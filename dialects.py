@@ -0,0 +1,130 @@
+import importlib
+import re
+from itertools import chain
+from gcode_lexer import ARC_CODES, g_codes, strip_comments, strip_sequence, tokenize
+
+# Registro de dialectos de entrada. Cada conversor se importa la primera vez
+# que se usa, así la ventana y el proceso por lotes no cargan los tres
+# módulos al arrancar. sniff_dialect lee solo los primeros KB de un archivo y
+# puntúa las firmas típicas de cada CAM para elegir el conversor.
+
+SNIFF_BYTES = 8192
+
+# Opciones que aceptan todos los conversores emco_gcode_from_*
+COMMON_OPTIONS = frozenset(("progress", "subprograms", "simplify_tolerance", "profile", "columnar", "jobs",
+                            "compact", "numbering", "validate", "feed_plan"))
+
+class Dialect:
+    def __init__(self, name: str, module: str, converter: str, stream_converter: str, options=()):
+        self.name = name
+        self.module = module
+        self.converter_name = converter
+        self.stream_converter_name = stream_converter
+        self.options = COMMON_OPTIONS.union(options)
+
+    def _load(self, attribute: str):
+        return getattr(importlib.import_module(self.module), attribute)
+
+    @property
+    def converter(self):
+        """emco_gcode_from_*(archivo_entrada, archivo_salida, S, F, unidades, **opciones)."""
+        return self._load(self.converter_name)
+
+    @property
+    def stream_converter(self):
+        """emco_blocks_from_*(líneas, S, F, unidades) -> líneas EMCO numeradas."""
+        return self._load(self.stream_converter_name)
+
+    def supported_options(self, options):
+        """Quita las opciones que este conversor no admite (p. ej. las de Kiri:Moto)."""
+        return {name: value for name, value in options.items() if name in self.options}
+
+# Mismos nombres que el combobox "Fuente GCode" de MainForm
+DIALECTS = {
+    dialect.name: dialect for dialect in (
+        Dialect("Mastercam", "mastercam_gcode", "emco_gcode_from_mastercam_gcode",
+                "emco_blocks_from_mastercam_gcode"),
+        Dialect("Aspire", "aspire_gcode", "emco_gcode_from_aspire_gcode",
+                "emco_blocks_from_aspire_gcode"),
+        Dialect("Kiri:Moto", "kirimoto_gcode", "emco_gcode_from_kirimoto_gcode",
+                "emco_blocks_from_kirimoto_gcode", options=("arc_tolerance", "stock_top")),
+    )
+}
+
+def get_converter(name: str):
+    return DIALECTS[name].converter
+
+def get_stream_converter(name: str):
+    return DIALECTS[name].stream_converter
+
+# FIRMAS: (dialecto, patrón sobre la línea en mayúsculas, puntos, máximo de apariciones que puntúan)
+SIGNATURES = (
+    ("Mastercam", re.compile(r"^O\d{4}"), 5, 1),
+    ("Mastercam", re.compile(r"^%$"), 1, 1),
+    ("Mastercam", re.compile(r"^N\d+"), 1, 3),
+    ("Mastercam", re.compile(r"^\(.*\)$"), 1, 3),
+    ("Mastercam", re.compile(r"G43\s*H"), 2, 1),
+    ("Aspire", re.compile(r"^%$"), 1, 1),
+    ("Aspire", re.compile(r"G17\s*D1"), 5, 1),
+    ("Aspire", re.compile(r"TRANS"), 3, 1),
+    ("Kiri:Moto", re.compile(r"KIRI:?MOTO"), 10, 1),
+    ("Kiri:Moto", re.compile(r"^;"), 2, 5),
+    ("Kiri:Moto", re.compile(r"\S\s*;"), 1, 3),
+)
+ASPIRE_ARC_POINTS = 3    # Arcos con I/J como números sueltos
+ASPIRE_ARC_MAX = 2
+
+def _is_aspire_arc(line: str):
+    words = tokenize(strip_comments(strip_sequence(line)))
+    if not ARC_CODES.intersection(g_codes(words)):
+        return False
+    return any(words[index - 1][0] in ("X", "Y") and words[index][0] == "" and words[index + 1][0] == ""
+               for index in range(1, len(words) - 1))
+
+def score_dialects(lines):
+    """Puntuación de cada dialecto para las líneas dadas."""
+    scores = dict.fromkeys(DIALECTS, 0)
+    hits = {}
+    for line in lines:
+        line = line.strip().upper()
+        if not line:
+            continue
+        for index, (name, pattern, points, limit) in enumerate(SIGNATURES):
+            if hits.get(index, 0) < limit and pattern.search(line):
+                hits[index] = hits.get(index, 0) + 1
+                scores[name] += points
+        if hits.get("arc", 0) < ASPIRE_ARC_MAX and _is_aspire_arc(line):
+            hits["arc"] = hits.get("arc", 0) + 1
+            scores["Aspire"] += ASPIRE_ARC_POINTS
+    return scores
+
+def best_dialect(scores):
+    """Dialecto con más puntos, o None si no hay ninguno o hay empate."""
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    if not ranked or ranked[0][1] <= 0 or (len(ranked) > 1 and ranked[1][1] == ranked[0][1]):
+        return None
+    return ranked[0][0]
+
+def sniff_dialect(path: str, size: int = SNIFF_BYTES):
+    """Detecta el dialecto de un archivo leyendo solo sus primeros size bytes; None si no se reconoce."""
+    with open(path, 'rb') as input_file:
+        head = input_file.read(size)
+    lines = head.decode("latin-1").splitlines()
+    if len(head) == size and lines:
+        lines.pop()  # La última línea puede estar cortada
+    return best_dialect(score_dialects(lines))
+
+def sniff_lines(lines, size: int = SNIFF_BYTES):
+    """Detecta el dialecto de un iterable de líneas (p. ej. stdin).
+
+    Devuelve (dialecto o None, líneas) donde líneas vuelve a incluir las ya leídas.
+    """
+    lines = iter(lines)
+    head = []
+    read = 0
+    for line in lines:
+        head.append(line)
+        read += len(line)
+        if read >= size:
+            break
+    return best_dialect(score_dialects(head)), chain(head, lines)
@@ -0,0 +1,253 @@
+import argparse
+import os
+import queue
+import select
+import sys
+import threading
+import time
+from dialects import DIALECTS, sniff_lines
+
+# Modo DNC: envía el programa al control por el puerto serie bloque a bloque
+# mientras se sigue convirtiendo (drip feed). La conversión va en un hilo
+# que llena una cola acotada, así la máquina empieza a trabajar enseguida y
+# la memoria no crece con el tamaño del programa. XON/XOFF se atiende aquí
+# (el control pide pausa con XOFF y reanuda con XON); RTS/CTS lo hace el
+# controlador del puerto. En POSIX se usa termios, así que un pty sirve de
+# puerto de pruebas; sin termios (Windows) hace falta pyserial.
+
+try:
+    import termios
+    import tty
+except ImportError:
+    termios = None
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+FLOW_CONTROLS = ("xonxoff", "rtscts", "none")
+XON = 0x11
+XOFF = 0x13
+BAUD_RATE = 9600
+BUFFER_BLOCKS = 1000       # Bloques convertidos por delante del envío
+NEWLINE = "\r\n"
+
+class DncError(Exception):
+    pass
+
+class _TermiosPort:
+    def __init__(self, device: str, baud: int, flow: str):
+        speed = getattr(termios, f"B{baud}", None)
+        if speed is None:
+            raise DncError(f"velocidad no soportada: {baud} baudios")
+        self.fd = os.open(device, os.O_RDWR | os.O_NOCTTY)
+        try:
+            tty.setraw(self.fd)
+            iflag, oflag, cflag, lflag, _, _, cc = termios.tcgetattr(self.fd)
+            # XON/XOFF se gestiona en drip_feed, no en el controlador
+            iflag &= ~(termios.IXON | termios.IXOFF | termios.IXANY)
+            cflag |= termios.CLOCAL | termios.CREAD
+            crtscts = getattr(termios, "CRTSCTS", 0)
+            cflag = cflag | crtscts if flow == "rtscts" else cflag & ~crtscts
+            termios.tcsetattr(self.fd, termios.TCSANOW, [iflag, oflag, cflag, lflag, speed, speed, cc])
+        except BaseException:
+            os.close(self.fd)
+            raise
+
+    def write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+
+    def read_available(self, timeout: float = 0):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        return os.read(self.fd, 1024) if ready else b""
+
+    def drain(self):
+        termios.tcdrain(self.fd)
+
+    def close(self):
+        os.close(self.fd)
+
+class _PySerialPort:
+    def __init__(self, device: str, baud: int, flow: str):
+        self.port = serial.Serial(device, baud, rtscts=flow == "rtscts", timeout=0)
+
+    def write(self, data: bytes):
+        self.port.write(data)
+
+    def read_available(self, timeout: float = 0):
+        deadline = time.monotonic() + timeout
+        while not self.port.in_waiting and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.port.read(self.port.in_waiting)
+
+    def drain(self):
+        self.port.flush()
+
+    def close(self):
+        self.port.close()
+
+def open_port(device: str, baud: int = BAUD_RATE, flow: str = "xonxoff"):
+    if flow not in FLOW_CONTROLS:
+        raise DncError(f"control de flujo desconocido: {flow}")
+    if termios is not None:
+        return _TermiosPort(device, baud, flow)
+    if serial is not None:
+        return _PySerialPort(device, baud, flow)
+    raise DncError("no hay soporte de puerto serie en este sistema: instala pyserial")
+
+def _put(blocks: queue.Queue, item, stop: threading.Event):
+    """Mete item en la cola esperando por tramos; False si el envío se detuvo antes."""
+    while not stop.is_set():
+        try:
+            blocks.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _produce(lines, blocks: queue.Queue, stop: threading.Event):
+    """Hilo de conversión: mete las líneas en la cola y al final None (o la excepción).
+
+    Nunca se queda bloqueado en la cola si el envío ya terminó, y al salir cierra
+    lines si se puede (generador o archivo), también si se aborta el envío.
+    """
+    try:
+        for line in lines:
+            if not _put(blocks, line, stop):
+                return
+        _put(blocks, None, stop)
+    except Exception as e:
+        _put(blocks, e, stop)
+    finally:
+        close = getattr(lines, "close", None)
+        if close is not None:
+            close()
+
+def drip_feed(port, lines, flow: str = "xonxoff", buffer_blocks: int = BUFFER_BLOCKS,
+              newline: str = NEWLINE, progress=None, xoff_timeout: float = None):
+    """Envía lines (líneas EMCO numeradas) por port a medida que se convierten.
+
+    progress(bloques_enviados, segundos_en_pausa) se llama tras cada bloque.
+    Devuelve el informe del envío.
+    """
+    blocks = queue.Queue(maxsize=buffer_blocks)
+    stop = threading.Event()
+    producer = threading.Thread(target=_produce, args=(iter(lines), blocks, stop), daemon=True)
+    producer.start()
+
+    paused = False
+    sent = 0
+    sent_bytes = 0
+    paused_seconds = 0.0
+    pauses = 0
+    start = time.perf_counter()
+
+    def read_flow(timeout):
+        nonlocal paused
+        for byte in port.read_available(timeout):
+            if byte == XOFF:
+                paused = True
+            elif byte == XON:
+                paused = False
+
+    try:
+        while True:
+            line = blocks.get()
+            if line is None:
+                break
+            if isinstance(line, Exception):
+                raise line
+
+            if flow == "xonxoff":
+                read_flow(0)
+                if paused:
+                    pauses += 1
+                    pause_start = time.perf_counter()
+                    while paused:
+                        read_flow(0.1)
+                        if xoff_timeout is not None and time.perf_counter() - pause_start > xoff_timeout:
+                            raise DncError(f"el control no envió XON en {xoff_timeout:g} s")
+                    paused_seconds += time.perf_counter() - pause_start
+
+            data = (line.rstrip("\r\n") + newline).encode("ascii")
+            port.write(data)
+            sent += 1
+            sent_bytes += len(data)
+            if progress is not None:
+                progress(sent, paused_seconds)
+        port.drain()
+    finally:
+        stop.set()
+
+    return {"blocks": sent, "bytes": sent_bytes, "seconds": round(time.perf_counter() - start, 2),
+            "pauses": pauses, "paused_seconds": round(paused_seconds, 2)}
+
+def program_lines(input_file: str, source: str, S: int, F: int, units: str):
+    """Generador de líneas EMCO numeradas del archivo; source None envía un SPF ya convertido tal cual.
+
+    El archivo se cierra al terminar o al cerrar el generador.
+    """
+    with open(input_file, 'r') as input_lines:
+        if source is None:
+            yield from input_lines
+            return
+        if source == "auto":
+            source, input_lines = sniff_lines(input_lines)
+            if source is None:
+                raise DncError("no se pudo detectar la fuente GCode, indícala con --source")
+        yield from DIALECTS[source].stream_converter(input_lines, S, F, units)
+
+def build_parser():
+    from batch_convert import AUTO_SOURCE, source_name
+
+    parser = argparse.ArgumentParser(
+        description="Envía un programa al CNC Emco por el puerto serie (DNC) mientras se convierte.")
+    parser.add_argument("input", help="archivo GCode de entrada (o SPF ya convertido con --spf)")
+    parser.add_argument("--port", "-p", required=True, help="dispositivo serie (p. ej. /dev/ttyUSB0, COM1 o un pty)")
+    parser.add_argument("--baud", "-b", type=int, default=BAUD_RATE, help=f"velocidad en baudios ({BAUD_RATE})")
+    parser.add_argument("--flow", choices=FLOW_CONTROLS, default="xonxoff", help="control de flujo (xonxoff)")
+    parser.add_argument("--buffer", type=int, default=BUFFER_BLOCKS,
+                        help=f"bloques convertidos por delante del envío ({BUFFER_BLOCKS})")
+    parser.add_argument("--xoff-timeout", type=float, default=None,
+                        help="segundos máximos en pausa por XOFF antes de abortar (sin límite)")
+    parser.add_argument("--spf", action="store_true", help="el archivo ya es un programa EMCO convertido")
+    parser.add_argument("--source", "-s", type=source_name, default=AUTO_SOURCE,
+                        help="fuente GCode: Mastercam, Aspire, Kiri:Moto o auto (auto)")
+    parser.add_argument("-S", "--spindle-speed", type=int, default=1500, help="velocidad husillo en RPM (1500)")
+    parser.add_argument("-F", "--feed-rate", type=int, default=150, help="velocidad avance (150)")
+    parser.add_argument("--units", choices=("mm", "inches"), default="mm", help="sistema de unidades (mm)")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    source = None if args.spf else args.source
+
+    def progress(sent, paused):
+        if sent % 100 == 0:
+            print(f"\r{sent} bloques enviados, {paused:.0f} s en pausa", end="", file=sys.stderr)
+
+    try:
+        lines = program_lines(args.input, source, args.spindle_speed, args.feed_rate, args.units)
+        port = open_port(args.port, args.baud, args.flow)
+        try:
+            report = drip_feed(port, lines, args.flow, args.buffer, progress=progress,
+                               xoff_timeout=args.xoff_timeout)
+        finally:
+            port.close()
+    except (DncError, OSError, ValueError) as e:
+        print(f"\nERROR: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print("\nEnvío interrumpido", file=sys.stderr)
+        return 130
+
+    print(f"\n{report['blocks']} bloques ({report['bytes']} bytes) enviados en {report['seconds']:.1f} s, "
+          f"{report['pauses']} pausas XOFF ({report['paused_seconds']:.1f} s)", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+import re
+from cycle_time import cycle_time_summary
+from feed_planning import feed_plan_summary, plan_feeds
+from gcode_lexer import MOTION_CODES, code_set, code_value, format_block, has_address, has_code, tokenize
+from profiling import profile_summary
+from program_model import ProgramModel, model_report, override_feed
+from program_validation import validate_blocks, validation_summary
+from subprograms import assign_subprograms, factor_subprograms, subprogram_path
+
+# Etapas comunes del programa EMCO. Cada etapa recibe un iterable de bloques
+# (texto sin número de secuencia ni salto de línea) y los va entregando uno a
+# uno, así que se pueden encadenar sin cargar el programa entero en memoria:
+#
+#   number_blocks(program_blocks(spindle_restart_on_tool_change(
+#       mastercam_blocks(lines, F), S), S, units))
+
+SEQUENCE_STEP = 10
+TOOL_CHANGE_CODES = code_set("M6")
+
+# Numeración de bloques: todos, solo los cambios de herramienta o ninguno
+NUMBER_ALL = "all"
+NUMBER_TOOL_CHANGES = "tool_changes"
+NUMBER_OFF = "off"
+NUMBERING_MODES = (NUMBER_ALL, NUMBER_TOOL_CHANGES, NUMBER_OFF)
+
+# Direcciones con valor numérico cuyos ceros se pueden recortar
+TRIM_ADDRESSES = frozenset(("X", "Y", "Z", "I", "J", "K", "CR", "R", "F"))
+CALL_ADDRESS = frozenset("L")
+_NUMBER_RE = re.compile(r'([+-]?)(\d*)\.?(\d*)$')
+
+def program_header(S: int, units: str):
+    # CABECERA DEL PROGRAMA
+    return ["G90", "G71" if units == "mm" else "G70", f"M03 S{S}"]
+
+def program_footer():
+    # FINAL DEL PROGRAMA
+    return ["M05", "M30"]
+
+def program_blocks(blocks, S: int, units: str):
+    """Rodea los bloques con la cabecera y el final del programa EMCO."""
+    yield from program_header(S, units)
+    yield from blocks
+    yield from program_footer()
+
+def is_tool_change(block: str):
+    return "M" in block and has_code(tokenize(block), TOOL_CHANGE_CODES)
+
+def spindle_restart_on_tool_change(blocks, S: int, profile=None):
+    """Para el husillo antes de cada cambio de herramienta (M6) y lo vuelve a arrancar después."""
+    for block in blocks:
+        if is_tool_change(block):
+            if profile:
+                profile.count("tool_changes")
+            yield "M05"
+            yield block
+            yield f"M03 S{S}"
+        else:
+            yield block
+
+def number_blocks(blocks, step: int = SEQUENCE_STEP, numbering: str = NUMBER_ALL):
+    """Agrega los números de secuencia N10, N20, ... y el salto de línea.
+
+    Con NUMBER_TOOL_CHANGES solo llevan número los cambios de herramienta (el que
+    tendrían numerando todos) y con NUMBER_OFF ningún bloque.
+    """
+    sequence = step
+    if numbering == NUMBER_ALL:
+        for block in blocks:
+            yield f"N{sequence} {block}\n"
+            sequence += step
+        return
+    for block in blocks:
+        if numbering == NUMBER_TOOL_CHANGES and is_tool_change(block):
+            yield f"N{sequence} {block}\n"
+        else:
+            yield f"{block}\n"
+        sequence += step
+
+def numbered_size(blocks, step: int = SEQUENCE_STEP):
+    return sum(len(line) for line in number_blocks(blocks, step))
+
+# --- SALIDA COMPACTA ---
+
+def trim_number(value: str):
+    """Quita los ceros sobrantes: "10.5000" -> "10.5", "007.0" -> "7", "-0.000" -> "0".
+
+    Se mantiene el 0 de "0.5" que escriben los conversores (y ".5" sigue como ".5").
+    """
+    match = _NUMBER_RE.match(value)
+    if match is None or not (match.group(2) or match.group(3)):
+        return value
+    sign, integer, fraction = match.groups()
+    integer = integer.lstrip("0") or ("0" if integer else "")
+    fraction = fraction.rstrip("0")
+    text = f"{integer}.{fraction}" if fraction else integer or "0"
+    return text if text == "0" or sign != "-" else sign + text
+
+def compact_blocks(blocks, stats):
+    """Etapa: quita los G0-G3 y F que repiten el valor modal y recorta los ceros de los números.
+
+    El estado modal se olvida en los cambios de herramienta, en las llamadas a
+    subprogramas (L) y en cualquier otro código G. Los bloques que quedarían vacíos
+    se escriben tal cual. stats recibe "g_removed" y "f_removed".
+    """
+    motion = feed = None
+    g_removed = f_removed = 0
+    for block in blocks:
+        words = tokenize(block)
+        if is_tool_change(block) or has_address(words, CALL_ADDRESS):
+            motion = feed = None
+            yield block
+            continue
+
+        compacted = []
+        block_motion, block_feed = motion, feed
+        removed_g = removed_f = 0
+        for address, value in words:
+            if address == "G":
+                code = code_value(value)
+                if code not in MOTION_CODES:
+                    block_motion = None
+                elif code == block_motion:
+                    removed_g += 1
+                    continue
+                else:
+                    block_motion = code
+            elif address in TRIM_ADDRESSES:
+                value = trim_number(value)
+                if address == "F":
+                    if value == block_feed:
+                        removed_f += 1
+                        continue
+                    block_feed = value
+            compacted.append((address, value))
+
+        motion, feed = block_motion, block_feed
+        if not compacted:
+            yield block
+            continue
+        g_removed += removed_g
+        f_removed += removed_f
+        yield format_block(compacted)
+    stats["g_removed"] = stats.get("g_removed", 0) + g_removed
+    stats["f_removed"] = stats.get("f_removed", 0) + f_removed
+
+def _sized_blocks(blocks, stats, step: int = SEQUENCE_STEP):
+    """Suma en stats["bytes_before"] lo que ocuparían los bloques numerados todos y sin compactar."""
+    sequence = step
+    for block in blocks:
+        stats["bytes_before"] += len(f"N{sequence} {block}\n")
+        sequence += step
+        yield block
+
+def _sized_lines(lines, stats):
+    for line in lines:
+        stats["bytes_after"] += len(line)
+        yield line
+
+def _output_lines(blocks, compact: bool, numbering: str, stats):
+    """Líneas numeradas de un archivo; con stats anota el tamaño antes y después de compactar."""
+    if stats is None:
+        return number_blocks(blocks)
+    stats.setdefault("bytes_before", 0)
+    stats.setdefault("bytes_after", 0)
+    blocks = _sized_blocks(blocks, stats)
+    if compact:
+        blocks = compact_blocks(blocks, stats)
+    return _sized_lines(number_blocks(blocks, numbering=numbering), stats)
+
+def write_emco_program(emco_file: str, blocks, S: int, units: str, subprograms: bool = False, report=None,
+                       columnar: bool = False, compact: bool = False, numbering: str = NUMBER_ALL, validate=None,
+                       feed_plan=None, F: float = None, feed_codes=MOTION_CODES, profiler=None):
+    """Escribe el programa numerado en emco_file.
+
+    Con subprograms, los tramos repetidos se escriben como subprogramas L####.SPF
+    junto a emco_file, con números del rango reservado para emco_file en su carpeta,
+    y el ahorro se anota en report; sin ellos se escribe en streaming.
+    Con columnar el programa pasa por ProgramModel (números en formato canónico), el F
+    del formulario se fija con override_feed sobre las columnas en los G de feed_codes,
+    como hace el dialecto sin columnar, y report["model"] recibe su tamaño, los
+    movimientos y la extensión de los ejes; profiler cuenta los F reemplazados y añadidos.
+    Con compact se quitan las palabras modales repetidas de cada archivo y numbering
+    elige qué bloques llevan N; report["compact"] recibe los bytes antes y después.
+    Con feed_plan (feed_planning.feed_plan_settings) cada movimiento de avance recibe el F
+    de su clase y report["feed_plan"] el cambio en el tiempo de corte. Con validate
+    (program_validation.validation_settings) el programa se valida en la misma pasada,
+    antes de compactarlo, y report["validation"] recibe el informe.
+    """
+    if numbering not in NUMBERING_MODES:
+        raise ValueError(f"numeración desconocida: {numbering}")
+    program = program_blocks(blocks, S, units)
+    if columnar:
+        model = ProgramModel.from_blocks(program)
+        if F is not None:
+            counts = override_feed(model, F, feed_codes)
+            if profiler:
+                profiler.count("f_overridden", counts["overridden"])
+                profiler.count("f_appended", counts["appended"])
+        if report is not None:
+            report["model"] = model_report(model)
+        program = model.blocks()
+    if feed_plan is not None:
+        plan = {}
+        if report is not None:
+            report["feed_plan"] = plan
+        program = plan_feeds(program, feed_plan, plan)
+    if validate is not None:
+        validation = {}
+        if report is not None:
+            report["validation"] = validation
+        program = validate_blocks(program, validate, validation)
+
+    stats = None
+    if compact or numbering != NUMBER_ALL:
+        stats = {"numbering": numbering}
+        if report is not None:
+            report["compact"] = stats
+
+    if not subprograms:
+        with open(emco_file, 'w') as output_file:
+            output_file.writelines(_output_lines(program, compact, numbering, stats))
+        return
+
+    program = list(program)
+    main, factored = assign_subprograms(emco_file, *factor_subprograms(program))
+
+    with open(emco_file, 'w') as output_file:
+        output_file.writelines(_output_lines(main, compact, numbering, stats))
+    for number, subprogram in factored.items():
+        with open(subprogram_path(emco_file, number), 'w') as output_file:
+            output_file.writelines(_output_lines(subprogram, compact, numbering, stats))
+
+    if report is not None:
+        report["subprograms"] = {
+            "count": len(factored),
+            "numbers": sorted(factored),
+            "blocks_before": len(program),
+            "blocks_after": len(main) + sum(len(subprogram) for subprogram in factored.values()),
+            "bytes_before": numbered_size(program),
+            "bytes_after": numbered_size(main) + sum(numbered_size(subprogram) for subprogram in factored.values()),
+        }
+
+def report_summary(report):
+    """Líneas de texto para MainForm.add_info y la salida por lotes a partir del informe de un conversor."""
+    lines = []
+    if "detected_source" in report:
+        lines.append(f"Fuente detectada: {report['detected_source']}")
+    if report.get("cache_hit"):
+        lines.append("Resultado reutilizado de la caché de conversiones")
+    if "subprograms" in report:
+        stats = report["subprograms"]
+        saved = stats["bytes_before"] - stats["bytes_after"]
+        percent = 100 * saved / stats["bytes_before"] if stats["bytes_before"] else 0
+        lines.append(f"Subprogramas: {stats['count']}, bloques {stats['blocks_before']} -> {stats['blocks_after']}, "
+                     f"bytes {stats['bytes_before']} -> {stats['bytes_after']} ({percent:.1f}% menos)")
+    if "arcs" in report:
+        stats = report["arcs"]
+        lines.append(f"Ajuste de arcos: {stats.get('arcs', 0)} arcos G2/G3 sustituyen "
+                     f"{stats.get('arc_segments', 0)} bloques G1")
+    if "simplify" in report:
+        stats = report["simplify"]
+        lines.append(f"Simplificación: {stats.get('points_removed', 0)} de {stats.get('points_total', 0)} "
+                     f"puntos G1 eliminados, ~{stats.get('time_saved', 0.0):.1f} s menos de proceso de bloques")
+    if "rapids" in report:
+        stats = report["rapids"]
+        lines.append(f"Rápidos recuperados: {stats.get('rapid_moves', 0)} movimientos en vacío, "
+                     f"{stats.get('rapid_distance', 0.0):.1f} de avance a rápido, ~{stats.get('time_saved', 0.0):.0f} s menos")
+    if "compact" in report:
+        stats = report["compact"]
+        saved = stats["bytes_before"] - stats["bytes_after"]
+        percent = 100 * saved / stats["bytes_before"] if stats["bytes_before"] else 0
+        numbering = {NUMBER_ALL: "todos los bloques", NUMBER_TOOL_CHANGES: "solo cambios de herramienta",
+                     NUMBER_OFF: "sin números"}[stats["numbering"]]
+        lines.append(f"Salida compacta: bytes {stats['bytes_before']} -> {stats['bytes_after']} "
+                     f"({percent:.1f}% menos), {stats.get('g_removed', 0)} G y {stats.get('f_removed', 0)} F "
+                     f"modales quitados, N: {numbering}")
+    if "model" in report:
+        stats = report["model"]
+        motions = stats["motions"]
+        lines.append(f"Modelo en columnas: {stats['blocks']} bloques en {stats['bytes'] / 1e6:.1f} MB "
+                     f"({motions['rapid']} G0, {motions['linear']} G1, {motions['arc']} arcos)")
+        if stats["bounds"]:
+            lines.append("Recorrido: " + ", ".join(f"{axis} {low:g} .. {high:g}"
+                                                   for axis, (low, high) in stats["bounds"].items()))
+    if "split" in report:
+        stats = report["split"]
+        limit = f", límite {stats['max_bytes']} bytes" if stats["max_bytes"] else ""
+        lines.append(f"Programa dividido en {len(stats['parts'])} partes{limit}: "
+                     + ", ".join(f"{name} ({size} bytes)" for name, size in zip(stats["parts"], stats["sizes"])))
+        if stats["oversized"]:
+            lines.append(f"Partes que superan el límite: {', '.join(stats['oversized'])}")
+    if "feed_plan" in report:
+        lines.extend(feed_plan_summary(report["feed_plan"]))
+    if "validation" in report:
+        lines.extend(validation_summary(report["validation"]))
+    if "cycle_time" in report:
+        lines.extend(cycle_time_summary(report["cycle_time"]))
+    if "profile" in report:
+        lines.extend(profile_summary(report["profile"]))
+    return lines
@@ -0,0 +1,163 @@
+import math
+from cycle_time import ARC_ADDRESSES, INCH, ModalTracker, arc_length, format_duration
+from gcode_lexer import to_float
+
+# Plan de avances por movimiento en lugar de un único F para todo el programa.
+# Etapa sobre los bloques EMCO (como program_validation, palabras separadas
+# por espacios y cycle_time.ModalTracker) que sigue la posición modal y
+# clasifica cada G1/G2/G3:
+#   - bajada (plunge): baja en Z con más de PLUNGE_SLOPE de pendiente;
+#   - rampa (ramp): baja en Z con más de RAMP_SLOPE (también arcos helicoidales);
+#   - arco pequeño (small_arc): G2/G3 de radio menor que SMALL_ARC_RADIUS;
+#   - acabado (finishing): segmentos más cortos que FINISH_SEGMENT, típicos
+#     de las pasadas de acabado 3D;
+#   - corte (linear): el resto.
+# Cada clase recibe su avance, nunca mayor que el F del formulario. Con
+# cam_factor se conserva el F del CAM multiplicado por el factor (también con
+# el F del formulario como tope); los movimientos sin F del CAM usan el de su
+# clase. Los G0 no se tocan. La etapa suma el tiempo de corte con el F único y
+# con el plan para informar del cambio en el tiempo de ciclo.
+
+PLUNGE, RAMP, LINEAR, SMALL_ARC, FINISHING = "plunge", "ramp", "linear", "small_arc", "finishing"
+MOVE_CLASSES = (PLUNGE, RAMP, LINEAR, SMALL_ARC, FINISHING)
+
+# Fracción del F del formulario para cada clase si no se indica otro avance
+DEFAULT_FRACTIONS = {PLUNGE: 0.3, RAMP: 0.5, LINEAR: 1.0, SMALL_ARC: 0.6, FINISHING: 0.8}
+
+PLUNGE_SLOPE = 1.0      # Más de 45° hacia abajo
+RAMP_SLOPE = 0.05       # Más de ~3° hacia abajo
+SMALL_ARC_RADIUS = 2.0  # mm
+FINISH_SEGMENT = 0.5    # mm
+
+LABELS = {PLUNGE: "bajadas", RAMP: "rampas", LINEAR: "cortes", SMALL_ARC: "arcos pequeños",
+          FINISHING: "acabados"}
+
+def feed_plan_settings(F: float, feeds=None, cam_factor: float = None):
+    """Opción feed_plan de los conversores: avance de cada clase (tope F) y factor para los F del CAM."""
+    planned = {name: fraction * F for name, fraction in DEFAULT_FRACTIONS.items()}
+    for name, value in (feeds or {}).items():
+        if name not in DEFAULT_FRACTIONS:
+            raise ValueError(f"clase de movimiento desconocida '{name}' (opciones: {', '.join(MOVE_CLASSES)})")
+        planned[name] = value
+    return {"max_feed": F, "feeds": {name: min(value, F) for name, value in planned.items()},
+            "cam_factor": cam_factor}
+
+def parse_feeds(text: str):
+    """'plunge=50,ramp=80' -> {"plunge": 50.0, "ramp": 80.0}."""
+    feeds = {}
+    for item in text.replace(" ", "").split(","):
+        name, separator, value = item.partition("=")
+        if name.lower() not in DEFAULT_FRACTIONS or not separator or not to_float(value) or to_float(value) < 0:
+            raise ValueError(f"avance no válido '{item}' (formato: plunge=50,ramp=80,small_arc=100,"
+                             f"finishing=120,linear=200)")
+        feeds[name.lower()] = to_float(value)
+    return feeds
+
+def dialect_feed(F: float, feed_plan):
+    """F para la etapa del dialecto: None si el plan conserva los F del CAM."""
+    return None if feed_plan and feed_plan.get("cam_factor") else F
+
+def format_feed(value: float):
+    return f"{round(value, 1):g}"
+
+class FeedPlanner:
+    """Sigue la posición modal y reescribe el F de cada movimiento de avance según su clase."""
+
+    def __init__(self, settings):
+        self.max_feed = settings["max_feed"]
+        self.feeds = settings["feeds"]
+        self.cam_factor = settings.get("cam_factor")
+        self.modal = ModalTracker()
+        self.cam_feed = None
+        self.counts = dict.fromkeys(MOVE_CLASSES, 0)
+        self.seconds_before = 0.0
+        self.seconds_after = 0.0
+
+    def classify(self, start, end, values):
+        """(clase, longitud) del movimiento de start a end."""
+        motion = self.modal.motion
+        scale = 1 / INCH if self.modal.inches else 1.0
+        dx = end["X"] - start["X"] if None not in (start["X"], end["X"]) else 0.0
+        dy = end["Y"] - start["Y"] if None not in (start["Y"], end["Y"]) else 0.0
+        dz = end["Z"] - start["Z"] if None not in (start["Z"], end["Z"]) else 0.0
+        radius = None
+        if motion in ("2", "3") and None not in (start["X"], start["Y"]):
+            cr = values.get("CR")
+            if cr is not None:
+                radius = abs(cr)
+            else:
+                radius = math.hypot(values.get("I") or 0.0, values.get("J") or 0.0)
+            planar = arc_length((0.0, 0.0), (dx, dy), motion, values.get("I"), values.get("J"), cr)
+        else:
+            planar = math.hypot(dx, dy)
+        length = math.hypot(planar, dz)
+
+        if dz < 0 and (planar == 0 or -dz > PLUNGE_SLOPE * planar):
+            return PLUNGE, length
+        if dz < 0 and -dz > RAMP_SLOPE * planar:
+            return RAMP, length
+        if radius is not None and radius < SMALL_ARC_RADIUS * scale:
+            return SMALL_ARC, length
+        if length < FINISH_SEGMENT * scale:
+            return FINISHING, length
+        return LINEAR, length
+
+    def plan(self, block: str):
+        """Bloque con el F del plan (o el mismo bloque si no es un movimiento de avance)."""
+        words = block.split()
+        start, moved, rest = self.modal.advance(words)
+        motion = self.modal.motion
+        values = {}
+        feed_word = None
+
+        for address, value in rest:
+            if address == "F":
+                feed_word = address + value
+                feed = to_float(value)
+                if feed and motion != "0":
+                    self.cam_feed = feed
+            elif address in ARC_ADDRESSES:
+                values[address] = to_float(value)
+
+        if not moved or motion in (None, "0"):
+            return block
+
+        kind, length = self.classify(start, self.modal.position, values)
+        if self.cam_factor and self.cam_feed is not None:
+            feed = min(self.cam_feed * self.cam_factor, self.max_feed)
+        else:
+            feed = self.feeds[kind]
+        self.counts[kind] += 1
+        if self.max_feed:
+            self.seconds_before += 60 * length / self.max_feed
+        if feed:
+            self.seconds_after += 60 * length / feed
+
+        word = "F" + format_feed(feed)
+        if feed_word is None:
+            words.append(word)
+        else:
+            words[words.index(feed_word)] = word
+        return " ".join(words)
+
+    def report(self):
+        return {"moves": dict(self.counts), "seconds_before": round(self.seconds_before, 2),
+                "seconds_after": round(self.seconds_after, 2), "feeds": dict(self.feeds),
+                "cam_factor": self.cam_factor}
+
+def plan_feeds(blocks, settings, stats):
+    """Etapa: F de cada movimiento según su clase; al terminar, stats recibe el informe."""
+    planner = FeedPlanner(settings)
+    plan = planner.plan
+    for block in blocks:
+        yield plan(block)
+    stats.update(planner.report())
+
+def feed_plan_summary(report):
+    moves = ", ".join(f"{count} {LABELS[name]}" for name, count in report["moves"].items() if count)
+    before, after = report["seconds_before"], report["seconds_after"]
+    change = 100 * (after - before) / before if before else 0.0
+    source = f"F del CAM x{report['cam_factor']:g}" if report["cam_factor"] else "avance por clase"
+    return [f"Plan de avances ({source}): {moves or 'sin movimientos de avance'}",
+            f"Tiempo de corte con F único {format_duration(before)} -> con plan {format_duration(after)} "
+            f"({change:+.1f}%)"]
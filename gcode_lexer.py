@@ -0,0 +1,111 @@
+import re
+
+# Una palabra G-code es una tupla (dirección, valor) con el valor como texto,
+# p. ej. "G01 X-.5 CR2.5" -> [("G", "01"), ("X", "-.5"), ("CR", "2.5")].
+# Los números sueltos (formato de arcos de Aspire) tienen dirección "" y los
+# caracteres sueltos ("%") tienen valor "".
+_WORD_RE = re.compile(r'([A-Z]+)\s*([+-]?[\d.]*)|([+-]?[\d.]+)|(\S)')
+_COMMENT_RE = re.compile(r'\([^)]*\)|;.*')
+_SEQUENCE_RE = re.compile(r'^N\d+\s*')
+
+MOTION_CODES = frozenset(("0", "1", "2", "3"))
+ARC_CODES = frozenset(("2", "3"))
+
+
+def strip_comments(line: str):
+    return _COMMENT_RE.sub("", line)
+
+def strip_sequence(line: str):
+    return _SEQUENCE_RE.sub("", line)
+
+def tokenize(line: str):
+    words = []
+    for address, value, number, other in _WORD_RE.findall(line.upper()):
+        if address:
+            words.append((address, value))
+        elif number:
+            words.append(("", number))
+        else:
+            words.append((other, ""))
+    return words
+
+def format_block(words):
+    return " ".join(address + value for address, value in words)
+
+def code_value(value: str):
+    """Valor normalizado de una palabra entera: "04" -> "4", "0000" -> "0"."""
+    if value.isdigit():
+        return value.lstrip("0") or "0"
+    return value
+
+def code_set(*codes: str):
+    """Conjunto de códigos (dirección, valor normalizado) para comparar palabras.
+
+    También guarda las direcciones solas para descartar rápido las palabras
+    (X, Y, Z...) que no pueden coincidir con ningún código.
+    """
+    result = set()
+    for code in codes:
+        for address, value in tokenize(code):
+            result.add(address)
+            result.add((address, code_value(value)))
+    return frozenset(result)
+
+def is_code(address: str, value: str, codes):
+    return address in codes and (address, code_value(value)) in codes
+
+def has_code(words, codes):
+    for address, value in words:
+        if address in codes and (address, code_value(value)) in codes:
+            return True
+    return False
+
+def matching_code(words, codes):
+    """Texto del primer código de codes presente en words (p. ej. "G54"), o None."""
+    for address, value in words:
+        if address in codes:
+            code = code_value(value)
+            if (address, code) in codes:
+                return address + code
+    return None
+
+def has_address(words, addresses):
+    for address, _ in words:
+        if address in addresses:
+            return True
+    return False
+
+def find_value(words, address: str):
+    for word_address, value in words:
+        if word_address == address:
+            return value
+    return None
+
+def g_codes(words):
+    return [code_value(value) for address, value in words if address == "G"]
+
+def to_float(value: str):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+def remove_codes(words, codes):
+    return [word for word in words if not is_code(word[0], word[1], codes)]
+
+def remove_addresses(words, addresses):
+    return [word for word in words if word[0] not in addresses]
+
+def replace_value(words, address: str, value: str):
+    return [(address, value) if word[0] == address else word for word in words]
+
+def rename_address(words, old: str, new: str):
+    return [(new, value) if address == old else (address, value) for address, value in words]
+
+def pad_leading_zero(value: str):
+    """Agrega el cero que falta delante del punto: ".5" -> "0.5", "-.5" -> "-0.5"."""
+    if value.startswith("."):
+        return "0" + value
+    if value.startswith("-."):
+        return "-0" + value[1:]
+    return value
@@ -1,114 +1,303 @@
-import re
 import math
+from arc_fitting import fit_arcs
+from conversion_job import track_progress
+from cycle_time import INCH, RAPID_RATE
+from decimation import simplify_polylines
+from emco_program import NUMBER_ALL, number_blocks, program_blocks, write_emco_program, spindle_restart_on_tool_change
+from feed_planning import dialect_feed
+from parallel_convert import chunked_blocks
+from profiling import ConversionProfile, clock
+from gcode_lexer import (
+    ARC_CODES, code_set, code_value, find_value, format_block, g_codes, has_address,
+    has_code, matching_code, remove_addresses, rename_address, replace_value, strip_comments,
+    to_float, tokenize)
 
-def skip_line(line: str):
-    upper_line = line.upper()
-    skip_code = ["G54", "G90", "G91", "G20", "G21", "G70", "G71", "G4", "G04", "M03", "M05", "M30"]
+SKIP_CODES = code_set("G54", "G90", "G91", "G20", "G21", "G70", "G71", "G4", "G04", "M03", "M05", "M30")
+
+FEED_MOTION_CODES = frozenset(("1", "2", "3"))
+XY_ADDRESSES = frozenset("XY")
+IJ_ADDRESSES = frozenset("IJ")
+R_ADDRESS = frozenset("R")
+AXES = ("X", "Y", "Z")
 
-    for code in skip_code:
-        if code in upper_line:
-            return True
-    
-    return False
+def skip_line(line: str):
+    return has_code(tokenize(strip_comments(line)), SKIP_CODES)
 
 def check_if_xy(line: str):
-    return ("X" in line.upper()) or ("Y" in line.upper())
-
-def emco_gcode_from_kirimoto_gcode(kiri_file: str, emco_file: str, S: int, F: int, units: str):
-    
-    SEQUENCE_STEP = 10
-    sequence = SEQUENCE_STEP
-    last_z = None
-    z_milling = False
-    xy_milling = False
-
-    with open(kiri_file, 'r') as input_file, open(emco_file, 'w') as output_file:
-
-        # CABECERA DEL PROGRAMA
-        output_file.write(f"N{sequence} G90\n")
-        sequence += SEQUENCE_STEP
-        output_file.write(f"N{sequence} {'G71' if units == 'mm' else 'G70'}\n")
-        sequence += SEQUENCE_STEP
-        output_file.write(f"N{sequence} M03 S{S}\n")
-        sequence += SEQUENCE_STEP
-        
-        for line in input_file:
-            output_line = line.strip()
-            
-            if skip_line(output_line):
-                continue
-
-            # Eliminar comentarios
-            output_line = re.sub(r"\([^)]*\)", "", output_line)
-            output_line = re.sub(r";.*", "", output_line)
-
-            line_contains_xy = check_if_xy(output_line)
-
-            # DETECCIÓN DE MOVIMIENTOS EN Z
-            match_z = re.search(r"Z(-?\d+(\.\d+)?)", output_line, re.IGNORECASE)
-            if match_z:
-                current_z = float(match_z.group(1))
-
-                if last_z is not None:
-                    if current_z < last_z:   # Bajando en Z
-                        z_milling = True
-                        output_line = re.sub(r"\bG0\b", "G1", output_line, flags=re.IGNORECASE)
-                    elif current_z > last_z: # Subiendo en Z
-                        z_milling = False
-            
-                last_z = current_z
-            
-            # CONVERTIR G0 A G1 CUANDO SE ESTÁ MAQUINANDO
-            if "G0" in output_line.upper() and (z_milling or xy_milling) and line_contains_xy:
-                output_line = re.sub(r"\bG0\b", "G1", output_line, flags=re.IGNORECASE)
-                output_line = re.sub(r"\sF[0-9\.]+", "", output_line)
-            
-            # DETECCIÓN DE G2/G3 Y CONVERSIÓN DE I,J A CR O R A CR
-            if re.search(r"\bG[23]\b", output_line, re.IGNORECASE):
-                match_i = re.search(r"I(-?\d+(\.\d+)?)", output_line, re.IGNORECASE)
-                match_j = re.search(r"J(-?\d+(\.\d+)?)", output_line, re.IGNORECASE)
-
-                # Si tiene I y J, calcular R y convertir a CR
-                if match_i and match_j:
-                    i = float(match_i.group(1))
-                    j = float(match_j.group(1))
-                    r = math.sqrt(i**2 + j**2)
-
-                    # Eliminar I y J
-                    output_line = re.sub(r"\sI-?\d+(\.\d+)?", "", output_line, flags=re.IGNORECASE)
-                    output_line = re.sub(r"\sJ-?\d+(\.\d+)?", "", output_line, flags=re.IGNORECASE)
-
-                    # Agregar CR con 4 decimales
-                    output_line += f" CR{r:.4f}"
-                # Si ya tiene R, simplemente cambiar R por CR
-                else:
-                    output_line = re.sub(r"\bR(-?\d+(\.\d+)?)", r"CR\1", output_line, flags=re.IGNORECASE)
-
-            xy_milling = line_contains_xy
-
-            # AHORA SÍ REEMPLAZAR S y F EXISTENTES - DESPUÉS DE TODAS LAS CONVERSIONES
-            if re.search(r'\bS\d+', output_line, re.IGNORECASE):
-                output_line = re.sub(r'\bS\d+', f'S{S}', output_line, flags=re.IGNORECASE)
-            
-            if re.search(r'\bF\d+', output_line, re.IGNORECASE):
-                output_line = re.sub(r'\bF\d+', f'F{F}', output_line, flags=re.IGNORECASE)
-            
-            # Si no tiene F pero es movimiento G1/G2/G3, agregar F
-            if re.search(r'\bG[123]\b', output_line, re.IGNORECASE) and not re.search(r'\bF\d+', output_line, re.IGNORECASE):
-                output_line += f' F{F}'
-
-            # Escribir solo si queda contenido
-            if output_line.strip():
-                if "M6" in output_line:
-                    output_file.write(f"N{sequence} M05\n")
-                    sequence += SEQUENCE_STEP
-                output_file.write(f"N{sequence} {output_line}\n")
-                sequence += SEQUENCE_STEP
-                if "M6" in output_line:
-                    output_file.write(f"N{sequence} M03 S{S}\n")
-                    sequence += SEQUENCE_STEP
-
-        # FINAL DEL PROGRAMA
-        output_file.write(f"N{sequence} M05\n")
-        sequence += SEQUENCE_STEP
-        output_file.write(f"N{sequence} M30\n")
\ No newline at end of file
+    return has_address(tokenize(line), XY_ADDRESSES)
+
+# Clasificación de los G0 con el modelo de estado modal
+AIR = "air"        # Todo el movimiento por encima del material: se queda en G0
+CUT = "cut"        # Entra o se mueve dentro del material: G1
+ENTRY = "entry"    # Bajada en Z que cruza la superficie: G0 hasta la aproximación y G1 el resto
+
+APPROACH_MARGIN = 1.0  # Distancia sobre la superficie a la que termina el rápido de una bajada
+
+class ModalState:
+    """Estado modal de la máquina: posición, modo de movimiento y superficie del material (stock_top)."""
+
+    def __init__(self, stock_top: float, approach_margin: float = APPROACH_MARGIN):
+        self.stock_top = stock_top
+        self.approach = stock_top + approach_margin
+        self.position = {"X": None, "Y": None, "Z": None}
+        self.motion = None
+
+    def update(self, words):
+        """Aplica el bloque y devuelve la posición anterior."""
+        start = dict(self.position)
+        for address, value in words:
+            if address in self.position:
+                number = to_float(value)
+                if number is not None:
+                    self.position[address] = number
+            elif address == "G" and code_value(value) in ("0", "1", "2", "3"):
+                self.motion = code_value(value)
+        return start
+
+    def classify_rapid(self, start):
+        """AIR, CUT o ENTRY; None si aún no se conoce la Z de partida."""
+        start_z, end_z = start["Z"], self.position["Z"]
+        if start_z is None or end_z is None:
+            return None
+        if min(start_z, end_z) >= self.stock_top:
+            return AIR
+        xy_move = any(start[axis] != self.position[axis] for axis in ("X", "Y"))
+        if not xy_move and end_z < start_z and start_z > self.approach:
+            return ENTRY
+        if not xy_move and end_z > start_z:
+            return AIR  # Retirada: la herramienta sale del material
+        return CUT
+
+def _distance(start, end):
+    return math.sqrt(sum((end[axis] - start[axis]) ** 2 for axis in end
+                         if end[axis] is not None and start[axis] is not None))
+
+def kirimoto_blocks(lines, S: int, F: int, stock_top: float = None, stats=None,
+                    profile: ConversionProfile = None, start_state=None):
+    """Etapa de conversión: líneas de Kiri:Moto -> bloques EMCO sin número de secuencia.
+
+    Sin stock_top los G0 pasan a G1 con la heurística de bajadas en Z y pasadas
+    en XY. Con stock_top (Z de la superficie del material) se usa ModalState:
+    solo los movimientos que entran en el material pasan a G1, y stats recibe
+    "rapid_moves" y "rapid_distance" (avance que vuelve a ser rápido).
+    profile (opcional) recibe los tiempos por etapa y los contadores de reglas aplicadas.
+    start_state (opcional) es el estado de kirimoto_modal_state si las líneas siguen a otras.
+    Con F None se conservan los F del CAM (para feed_planning con factor de CAM).
+    """
+    last_z = start_state["last_z"] if start_state else None
+    z_milling = start_state["z_milling"] if start_state else False
+    xy_milling = start_state["xy_milling"] if start_state else False
+    spindle = str(S)
+    feed = str(F) if F is not None else None
+    state = ModalState(stock_top) if stock_top is not None else None
+    if state is not None and start_state:
+        state.position.update(start_state["machine"])
+        state.motion = start_state["motion"]
+    if stats is None:
+        stats = {}
+
+    for line in lines:
+        if profile:
+            t = clock()
+        # Eliminar comentarios y separar en palabras
+        words = tokenize(strip_comments(line.strip()))
+        if profile:
+            t = profile.lap("comments", t)
+        if not words:
+            continue
+        if has_code(words, SKIP_CODES):
+            if profile:
+                profile.lap("skip", t)
+                profile.skip(matching_code(words, SKIP_CODES))
+            continue
+        if profile:
+            profile.lap("skip", t)
+
+        line_contains_xy = has_address(words, XY_ADDRESSES)
+        g_values = g_codes(words)
+
+        # DETECCIÓN DE MOVIMIENTOS EN Z
+        z_value = find_value(words, "Z")
+        current_z = to_float(z_value) if z_value is not None else None
+        plunge = False
+        if current_z is not None:
+            if last_z is not None:
+                if current_z < last_z:   # Bajando en Z
+                    z_milling = True
+                    plunge = True
+                elif current_z > last_z: # Subiendo en Z
+                    z_milling = False
+
+            last_z = current_z
+
+        # CONVERTIR G0 A G1 CUANDO SE ESTÁ MAQUINANDO
+        to_feed = "0" in g_values and (plunge or ((z_milling or xy_milling) and line_contains_xy))
+        if state is not None:
+            start = state.update(words)
+            kind = state.classify_rapid(start) if "0" in g_values else None
+            if kind is not None:
+                recovered = 0.0
+                if kind == ENTRY:
+                    # Rápido hasta la aproximación y avance solo dentro del material
+                    yield f"G0 Z{state.approach:g}"
+                    recovered = start["Z"] - state.approach
+                elif kind == AIR:
+                    recovered = _distance(start, state.position)
+                if to_feed and kind != CUT:
+                    stats["rapid_moves"] = stats.get("rapid_moves", 0) + 1
+                    stats["rapid_distance"] = stats.get("rapid_distance", 0.0) + recovered
+                to_feed = kind != AIR
+
+        if to_feed:
+            words = [("G", "1") if word[0] == "G" and code_value(word[1]) == "0" else word
+                     for word in words]
+            if not plunge:
+                words = remove_addresses(words, ("F",))
+            g_values = g_codes(words)
+            if profile:
+                profile.count("g0_to_g1")
+
+        if profile:
+            t = clock()
+
+        # DETECCIÓN DE G2/G3 Y CONVERSIÓN DE I,J A CR O R A CR
+        if ARC_CODES.intersection(g_values):
+            i_value = find_value(words, "I")
+            j_value = find_value(words, "J")
+            i = to_float(i_value) if i_value is not None else None
+            j = to_float(j_value) if j_value is not None else None
+
+            # Si tiene I y J, calcular R y convertir a CR con 4 decimales
+            if i is not None and j is not None:
+                r = math.sqrt(i**2 + j**2)
+                words = remove_addresses(words, IJ_ADDRESSES)
+                words.append(("CR", f"{r:.4f}"))
+                if profile:
+                    profile.count("ij_to_cr")
+            # Si ya tiene R, simplemente cambiar R por CR
+            else:
+                if profile and has_address(words, R_ADDRESS):
+                    profile.count("r_to_cr")
+                words = rename_address(words, "R", "CR")
+        if profile:
+            t = profile.lap("arcs", t)
+
+        xy_milling = line_contains_xy
+
+        # AHORA SÍ REEMPLAZAR S y F EXISTENTES - DESPUÉS DE TODAS LAS CONVERSIONES
+        words = replace_value(words, "S", spindle)
+        if feed is None:
+            pass
+        elif find_value(words, "F") is not None:
+            words = replace_value(words, "F", feed)
+            if profile:
+                profile.count("f_overridden")
+        # Si no tiene F pero es movimiento G1/G2/G3, agregar F
+        elif FEED_MOTION_CODES.intersection(g_values):
+            words.append(("F", feed))
+            if profile:
+                profile.count("f_appended")
+        if profile:
+            profile.lap("feed", t)
+
+        yield format_block(words)
+
+def kirimoto_modal_state(previous_lines):
+    """Estado modal al final de previous_lines, recorridas hacia atrás desde el corte.
+
+    Devuelve la última Z, las banderas de fresado en Z y en XY, la posición y el modo de
+    movimiento de ModalState ("machine", "motion") y la posición en texto para las etapas.
+    """
+    state = {"last_z": None, "z_milling": False, "xy_milling": None,
+             "machine": dict.fromkeys(AXES), "motion": None, "position": dict.fromkeys(AXES)}
+    texts = set(AXES)
+    numbers = set(AXES)
+    later_z = None
+    z_known = False
+    for line in previous_lines:
+        words = tokenize(strip_comments(line.strip()))
+        if not words or has_code(words, SKIP_CODES):
+            continue
+        if state["xy_milling"] is None:
+            state["xy_milling"] = has_address(words, XY_ADDRESSES)
+
+        # z_milling solo cambia cuando la Z sube o baja respecto a la anterior
+        z_value = find_value(words, "Z")
+        z = to_float(z_value) if z_value is not None else None
+        if z is not None and not z_known:
+            if later_z is None:
+                state["last_z"] = later_z = z
+            elif z != later_z:
+                state["z_milling"] = later_z < z
+                z_known = True
+
+        for address, value in reversed(words):
+            if address in texts:
+                state["position"][address] = value
+                texts.discard(address)
+            if address in numbers and to_float(value) is not None:
+                state["machine"][address] = to_float(value)
+                numbers.discard(address)
+            elif address == "G" and state["motion"] is None and code_value(value) in ("0", "1", "2", "3"):
+                state["motion"] = code_value(value)
+        if z_known and not texts and not numbers and state["motion"] is not None:
+            break
+    state["xy_milling"] = bool(state["xy_milling"])
+    return state
+
+def kirimoto_stages(lines, S: int, F: int, report, profiler: ConversionProfile = None, state=None,
+                    arc_tolerance: float = None, simplify_tolerance: float = None, stock_top: float = None):
+    """Bloques EMCO (sin cabecera ni números) de las líneas; report recibe los informes de las etapas."""
+    if stock_top is not None:
+        report["rapids"] = {}
+    blocks = kirimoto_blocks(lines, S, F, stock_top, report.get("rapids"), profiler, state)
+    if profiler:
+        blocks = profiler.iterate("dialect", blocks)
+    if arc_tolerance:
+        report["arcs"] = {}
+        blocks = fit_arcs(blocks, arc_tolerance, report["arcs"], state and state["position"])
+        if profiler:
+            blocks = profiler.iterate("arc_fitting", blocks)
+    if simplify_tolerance:
+        report["simplify"] = {}
+        blocks = simplify_polylines(blocks, simplify_tolerance, report["simplify"], state and state["position"])
+        if profiler:
+            blocks = profiler.iterate("simplify", blocks)
+    return spindle_restart_on_tool_change(blocks, S, profiler)
+
+def emco_blocks_from_kirimoto_gcode(lines, S: int, F: int, units: str):
+    """Programa EMCO completo y numerado a partir de un iterable de líneas de Kiri:Moto."""
+    blocks = spindle_restart_on_tool_change(kirimoto_blocks(lines, S, F), S)
+    return number_blocks(program_blocks(blocks, S, units))
+
+def emco_gcode_from_kirimoto_gcode(kiri_file: str, emco_file: str, S: int, F: int, units: str, progress=None, subprograms: bool = False,
+                                   arc_tolerance: float = None, simplify_tolerance: float = None,
+                                   stock_top: float = None, profile: bool = False, columnar: bool = False,
+                                   jobs: int = None, compact: bool = False, numbering: str = NUMBER_ALL,
+                                   validate=None, feed_plan=None):
+
+    report = {}
+    profiler = ConversionProfile() if profile else None
+    feed = dialect_feed(F, feed_plan)  # None: el plan de avances parte de los F del CAM
+    # Con columnar el F se fija sobre el modelo en columnas y el dialecto conserva los del CAM
+    stage_feed = None if columnar else feed
+    options = {"arc_tolerance": arc_tolerance, "simplify_tolerance": simplify_tolerance, "stock_top": stock_top}
+    with open(kiri_file, 'r') as input_file:
+        if jobs is not None and not profiler:
+            # Por trozos en varios procesos; la salida es la misma que la secuencial
+            blocks = chunked_blocks(input_file, kirimoto_stages, kirimoto_modal_state, skip_line, S, stage_feed,
+                                    report, jobs, progress, any_line=not (arc_tolerance or simplify_tolerance), **options)
+        else:
+            lines = track_progress(input_file, progress)
+            blocks = kirimoto_stages(lines, S, stage_feed, report, profiler, **options)
+        write_emco_program(emco_file, blocks, S, units, subprograms, report, columnar, compact, numbering,
+                           validate, feed_plan, feed, FEED_MOTION_CODES, profiler=profiler)
+    if profiler:
+        report["profile"] = profiler.report()
+
+    if "rapids" in report:
+        # Tiempo ganado: la distancia recuperada ya no va a F sino al avance rápido
+        distance = report["rapids"].get("rapid_distance", 0.0)
+        rapid_rate = RAPID_RATE if units == "mm" else RAPID_RATE / INCH
+        report["rapids"]["time_saved"] = 60 * distance / F - 60 * distance / rapid_rate if F else 0.0
+    return report
@@ -1,15 +1,21 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import os
-from kirimoto_gcode import emco_gcode_from_kirimoto_gcode
-from mastercam_gcode import emco_gcode_from_mastercam_gcode
-from aspire_gcode import emco_gcode_from_aspire_gcode
+from dialects import DIALECTS, sniff_dialect
+from conversion_job import ConversionJob
+from backplot_window import BackplotWindow
+from emco_program import NUMBER_TOOL_CHANGES, report_summary
+from conversion_cache import ConversionCache, cache_summary
+from feed_planning import feed_plan_settings
+from program_validation import SURFACE_Z, parse_limits, validation_settings
+
+POLL_INTERVAL_MS = 100
 
 class MainForm:
     def __init__(self):
         self.root = tk.Tk()
         self.root.title("Formateador de GCode para CNC Emco")
-        self.root.geometry("600x500")
+        self.root.geometry("600x650")
         
         # Variables
         self.file_path = tk.StringVar()
@@ -17,7 +23,25 @@ class MainForm:
         self.feed_rate = tk.StringVar(value="150")
         self.unit_system = tk.StringVar(value="mm")
         self.subprograms = tk.BooleanVar(value=False)
+        self.use_cache = tk.BooleanVar(value=True)
+        self.profile = tk.BooleanVar(value=False)
+        self.compact = tk.BooleanVar(value=False)
+        self.validate = tk.BooleanVar(value=False)
+        self.limits = tk.StringVar(value="")
+        self.feed_plan = tk.BooleanVar(value=False)
+        self.cam_feed_factor = tk.StringVar(value="")
         self.source_gcode = tk.StringVar(value="Mastercam")
+        self.arc_tolerance = tk.StringVar(value="")
+        self.simplify_tolerance = tk.StringVar(value="")
+        self.stock_top = tk.StringVar(value="")
+        self.progress_status = tk.StringVar(value="")
+        
+        # Conversión en curso (se ejecuta en un hilo para no congelar la ventana)
+        self.job = None
+        self.last_output = None
+        
+        # Caché de conversiones compartida con batch_convert
+        self.cache = ConversionCache()
         
         self.create_widgets()
     
@@ -34,10 +58,10 @@ class MainForm:
         main_frame.columnconfigure(1, weight=1)  # Columna de entrada/combos
         main_frame.columnconfigure(2, weight=0)  # Columna de unidades
         
-        # Configurar pesos de filas - la fila 9 (área de texto) se expande
-        for i in range(8):  # Filas 0-8 no se expanden
+        # Configurar pesos de filas - la fila 10 (área de texto) se expande
+        for i in range(10):  # Filas 0-9 no se expanden
             main_frame.rowconfigure(i, weight=0)
-        main_frame.rowconfigure(9, weight=1)  # Fila del área de texto se expande
+        main_frame.rowconfigure(10, weight=1)  # Fila del área de texto se expande
         
         # Título
         title_label = ttk.Label(main_frame, text="Formateador de GCode para CNC Emco", 
@@ -74,34 +98,75 @@ class MainForm:
         ttk.Radiobutton(unit_frame, text="Pulgadas (G70)", 
                        variable=self.unit_system, value="inches").grid(row=0, column=1, sticky=tk.W, padx=(20, 0))
         
-        # Checkbox para subprogramas
-        ttk.Checkbutton(main_frame, text="Crear subprogramas", 
-                       variable=self.subprograms).grid(row=5, column=0, columnspan=3, sticky=tk.W, pady=10)
+        # Opciones de optimización: subprogramas y tolerancias (vacío = desactivado)
+        options_frame = ttk.Frame(main_frame)
+        options_frame.grid(row=5, column=0, columnspan=3, sticky=tk.W, pady=10)
+        
+        ttk.Checkbutton(options_frame, text="Crear subprogramas", 
+                       variable=self.subprograms).grid(row=0, column=0, sticky=tk.W)
+        ttk.Checkbutton(options_frame, text="Usar caché", 
+                       variable=self.use_cache).grid(row=1, column=0, sticky=tk.W, pady=(5, 0))
+        ttk.Checkbutton(options_frame, text="Perfilar conversión", 
+                       variable=self.profile).grid(row=2, column=0, sticky=tk.W, pady=(5, 0))
+        ttk.Checkbutton(options_frame, text="Salida compacta (N solo en cambios de herramienta)", 
+                       variable=self.compact).grid(row=3, column=0, columnspan=3, sticky=tk.W, pady=(5, 0))
+        ttk.Checkbutton(options_frame, text="Validar programa", 
+                       variable=self.validate).grid(row=4, column=0, sticky=tk.W, pady=(5, 0))
+        ttk.Label(options_frame, text="Límites en mm (X-10:180,Y0:130,...):").grid(row=4, column=1, sticky=tk.W, padx=(20, 5), pady=(5, 0))
+        ttk.Entry(options_frame, textvariable=self.limits, width=22).grid(row=4, column=2, sticky=tk.W, pady=(5, 0))
+        ttk.Checkbutton(options_frame, text="Avance por tipo de movimiento", 
+                       variable=self.feed_plan).grid(row=5, column=0, sticky=tk.W, pady=(5, 0))
+        ttk.Label(options_frame, text="Factor F del CAM (opcional):").grid(row=5, column=1, sticky=tk.W, padx=(20, 5), pady=(5, 0))
+        ttk.Entry(options_frame, textvariable=self.cam_feed_factor, width=8).grid(row=5, column=2, sticky=tk.W, pady=(5, 0))
+        ttk.Label(options_frame, text="Tolerancia arcos (Kiri:Moto):").grid(row=0, column=1, sticky=tk.W, padx=(20, 5))
+        ttk.Entry(options_frame, textvariable=self.arc_tolerance, width=8).grid(row=0, column=2, sticky=tk.W)
+        ttk.Label(options_frame, text="Tolerancia simplificación:").grid(row=1, column=1, sticky=tk.W, padx=(20, 5), pady=(5, 0))
+        ttk.Entry(options_frame, textvariable=self.simplify_tolerance, width=8).grid(row=1, column=2, sticky=tk.W, pady=(5, 0))
+        ttk.Label(options_frame, text="Z superficie material (Kiri:Moto):").grid(row=2, column=1, sticky=tk.W, padx=(20, 5), pady=(5, 0))
+        ttk.Entry(options_frame, textvariable=self.stock_top, width=8).grid(row=2, column=2, sticky=tk.W, pady=(5, 0))
         
         # Combobox para fuente GCode
         ttk.Label(main_frame, text="Fuente GCode:").grid(row=6, column=0, sticky=tk.W, pady=5)
         
         source_combo = ttk.Combobox(main_frame, textvariable=self.source_gcode, 
                                    state="readonly", width=20)
-        source_combo['values'] = ('Mastercam', 'Aspire', 'Kiri:Moto')
+        source_combo['values'] = tuple(DIALECTS)
         # ('Fusion 360', 'Mastercam', 'Aspire', 'Kiri:Moto', 'Otro')
         source_combo.grid(row=6, column=1, sticky=tk.W, pady=5)
         
-        # Botón de formateo
-        ttk.Button(main_frame, text="Iniciar Formateo de GCode", 
-                  command=self.format_gcode).grid(row=7, column=0, columnspan=3, pady=20)
+        # Botones de formateo y cancelación
+        button_frame = ttk.Frame(main_frame)
+        button_frame.grid(row=7, column=0, columnspan=3, pady=(20, 5))
+        
+        self.format_button = ttk.Button(button_frame, text="Iniciar Formateo de GCode", 
+                                        command=self.format_gcode)
+        self.format_button.grid(row=0, column=0)
+        self.cancel_button = ttk.Button(button_frame, text="Cancelar", 
+                                        command=self.cancel_conversion, state=tk.DISABLED)
+        self.cancel_button.grid(row=0, column=1, padx=(10, 0))
+        ttk.Button(button_frame, text="Ver caché", 
+                  command=self.show_cache).grid(row=0, column=2, padx=(10, 0))
+        ttk.Button(button_frame, text="Vaciar caché", 
+                  command=self.clear_cache).grid(row=0, column=3, padx=(10, 0))
+        ttk.Button(button_frame, text="Vista previa", 
+                  command=self.show_preview).grid(row=0, column=4, padx=(10, 0))
+        
+        # Barra de progreso con velocidad y tiempo restante
+        self.progress_bar = ttk.Progressbar(main_frame, orient=tk.HORIZONTAL, mode="determinate", maximum=100)
+        self.progress_bar.grid(row=8, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
+        ttk.Label(main_frame, textvariable=self.progress_status).grid(row=8, column=2, sticky=tk.W, padx=(5, 0), pady=5)
         
         # Área de información
         info_label = ttk.Label(main_frame, text="Información del proceso:", 
                               font=("Arial", 10, "bold"))
-        info_label.grid(row=8, column=0, columnspan=3, sticky=tk.W, pady=(10, 5))
+        info_label.grid(row=9, column=0, columnspan=3, sticky=tk.W, pady=(10, 5))
         
         self.info_text = tk.Text(main_frame, height=8, width=60, state=tk.DISABLED)
-        self.info_text.grid(row=9, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
+        self.info_text.grid(row=10, column=0, columnspan=3, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5)
         
         # Barra de desplazamiento para el área de texto
         scrollbar = ttk.Scrollbar(main_frame, orient=tk.VERTICAL, command=self.info_text.yview)
-        scrollbar.grid(row=9, column=3, sticky=(tk.N, tk.S))
+        scrollbar.grid(row=10, column=3, sticky=(tk.N, tk.S))
         self.info_text.configure(yscrollcommand=scrollbar.set)
     
     def select_file(self):
@@ -118,6 +183,19 @@ class MainForm:
         if filename:
             self.file_path.set(filename)
             self.add_info(f"Archivo seleccionado: {os.path.basename(filename)}")
+            self.detect_source(filename)
+    
+    def detect_source(self, filename):
+        """Preselecciona la fuente GCode según el contenido del archivo."""
+        try:
+            source = sniff_dialect(filename)
+        except OSError:
+            return
+        if source is None:
+            self.add_info("No se pudo detectar la fuente GCode, revisa la selección")
+        else:
+            self.source_gcode.set(source)
+            self.add_info(f"Fuente detectada: {source}")
     
     def add_info(self, message):
         self.info_text.config(state=tk.NORMAL)
@@ -150,42 +228,151 @@ class MainForm:
         self.add_info(f"Velocidad avance: {feed_rate}")
         self.add_info(f"Sistema: {self.unit_system.get()}")
         self.add_info(f"Subprogramas: {'Sí' if self.subprograms.get() else 'No'}")
+        self.add_info(f"Caché: {'Sí' if self.use_cache.get() else 'No'}")
+        self.add_info(f"Salida compacta: {'Sí' if self.compact.get() else 'No'}")
+        self.add_info(f"Avance por tipo de movimiento: {'Sí' if self.feed_plan.get() else 'No'}")
+        if self.feed_plan.get() and self.cam_feed_factor.get().strip():
+            self.add_info(f"Factor F del CAM: {self.cam_feed_factor.get()}")
+        self.add_info(f"Validación: {'Sí' if self.validate.get() else 'No'}")
+        if self.validate.get() and self.limits.get().strip():
+            self.add_info(f"Límites: {self.limits.get()}")
         self.add_info(f"Fuente: {self.source_gcode.get()}")
+        if self.arc_tolerance.get().strip():
+            self.add_info(f"Tolerancia arcos: {self.arc_tolerance.get()}")
+        if self.stock_top.get().strip():
+            self.add_info(f"Z superficie material: {self.stock_top.get()}")
+        if self.simplify_tolerance.get().strip():
+            self.add_info(f"Tolerancia simplificación: {self.simplify_tolerance.get()} {self.unit_system.get()}")
         
         # Aquí llamarías a tu función de formateo
         self.process_gcode_file()
     
     def process_gcode_file(self):
         """
-        Esta función procesará el archivo GCode según los parámetros seleccionados.
-        Debes implementar aquí tu lógica de formateo.
+        Lanza la conversión del archivo GCode en un hilo según los parámetros seleccionados.
+        El progreso se recoge desde la cola del trabajo con root.after.
         """
+        if self.job is not None and self.job.is_alive():
+            return
+        
         try:
-            # Ejemplo de procesamiento - reemplaza con tu lógica real
             input_file = self.file_path.get()
             output_file = self.generate_output_filename(input_file)
             
-            # Simulación de procesamiento
-            self.add_info("Procesando archivo...")
-            
-            # Aquí iría tu lógica de formateo real
-            # Por ejemplo:
-            # formatted_gcode = self.format_gcode_logic(input_file)
-            # self.save_formatted_gcode(output_file, formatted_gcode)
-
-            if (self.source_gcode.get() == "Kiri:Moto"):
-                emco_gcode_from_kirimoto_gcode(input_file, output_file, int(self.spindle_speed.get()), int(self.feed_rate.get()), self.unit_system.get())
-            elif (self.source_gcode.get() == "Mastercam"):
-                emco_gcode_from_mastercam_gcode(input_file, output_file, int(self.spindle_speed.get()), int(self.feed_rate.get()), self.unit_system.get())
-            elif (self.source_gcode.get() == "Aspire"):
-                emco_gcode_from_aspire_gcode(input_file, output_file, int(self.spindle_speed.get()), int(self.feed_rate.get()), self.unit_system.get())
-
-            self.add_info(f"Archivo formateado guardado como: {output_file}")
-            self.add_info("Formateo completado exitosamente!")
+            converter = DIALECTS[self.source_gcode.get()].converter
+            if self.use_cache.get():
+                converter = self.cache.cached(self.source_gcode.get(), converter)
             
+            self.job = ConversionJob(converter, input_file, output_file, int(self.spindle_speed.get()),
+                                     int(self.feed_rate.get()), self.unit_system.get(), estimate=True,
+                                     **self.converter_options())
         except Exception as e:
             self.add_info(f"Error durante el formateo: {str(e)}")
             messagebox.showerror("Error", f"Ocurrió un error: {str(e)}")
+            return
+        
+        self.add_info("Procesando archivo...")
+        self.progress_bar["value"] = 0
+        self.progress_status.set("")
+        self.format_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.job.start()
+        self.root.after(POLL_INTERVAL_MS, self.poll_conversion)
+    
+    def converter_options(self):
+        """Opciones adicionales del conversor según el formulario."""
+        options = {"subprograms": self.subprograms.get()}
+        if self.profile.get():
+            options["profile"] = True
+        if self.compact.get():
+            options["compact"] = True
+            options["numbering"] = NUMBER_TOOL_CHANGES
+        if self.source_gcode.get() == "Kiri:Moto" and self.arc_tolerance.get().strip():
+            options["arc_tolerance"] = float(self.arc_tolerance.get())
+        if self.source_gcode.get() == "Kiri:Moto" and self.stock_top.get().strip():
+            options["stock_top"] = float(self.stock_top.get())
+        if self.simplify_tolerance.get().strip():
+            options["simplify_tolerance"] = float(self.simplify_tolerance.get())
+        if self.feed_plan.get():
+            cam_factor = float(self.cam_feed_factor.get()) if self.cam_feed_factor.get().strip() else None
+            options["feed_plan"] = feed_plan_settings(float(self.feed_rate.get()), cam_factor=cam_factor)
+        if self.validate.get():
+            limits = parse_limits(self.limits.get()) if self.limits.get().strip() else None
+            surface = options.get("stock_top", SURFACE_Z)
+            options["validate"] = validation_settings(limits, surface)
+        return options
+    
+    def show_cache(self):
+        self.add_info(cache_summary(self.cache.info()))
+    
+    def clear_cache(self):
+        if self.job is not None and self.job.is_alive():
+            return
+        if messagebox.askyesno("Vaciar caché", "¿Eliminar todas las conversiones guardadas en la caché?"):
+            self.add_info(f"Caché vaciada: {self.cache.clear()} entradas eliminadas")
+    
+    def show_preview(self):
+        """Abre la vista previa del último programa convertido (o del SPF del archivo elegido)."""
+        emco_file = self.last_output
+        if emco_file is None and self.file_path.get():
+            emco_file = self.generate_output_filename(self.file_path.get())
+        if emco_file is None or not os.path.exists(emco_file):
+            messagebox.showerror("Error", "Primero convierte un archivo GCode")
+            return
+        BackplotWindow(self.root, emco_file)
+    
+    def cancel_conversion(self):
+        if self.job is not None and self.job.is_alive():
+            self.cancel_button.config(state=tk.DISABLED)
+            self.job.cancel()
+    
+    def poll_conversion(self):
+        """Vacía la cola del trabajo y actualiza la barra de progreso y el área de información."""
+        info = []
+        finished = False
+        error = None
+        for message in self.job.drain():
+            kind = message[0]
+            if kind == "progress":
+                _, done, total, seconds = message
+                self.update_progress(done, total, seconds)
+            elif kind == "done":
+                _, output_file, seconds, result = message
+                self.progress_bar["value"] = 100
+                self.progress_status.set(f"{seconds:.1f} s")
+                info.append(f"Archivo formateado guardado como: {output_file}")
+                self.last_output = output_file
+                info.extend(report_summary(result))
+                info.append("Formateo completado exitosamente!")
+                finished = True
+            elif kind == "cancelled":
+                self.progress_status.set("Cancelado")
+                info.append("Formateo cancelado, se eliminó la salida parcial")
+                finished = True
+            elif kind == "error":
+                error = message[1]
+                info.append(f"Error durante el formateo: {error}")
+                finished = True
+        
+        # Un único add_info por lote de mensajes
+        if info:
+            self.add_info("\n".join(info))
+        
+        if finished:
+            self.format_button.config(state=tk.NORMAL)
+            self.cancel_button.config(state=tk.DISABLED)
+            if error is not None:
+                messagebox.showerror("Error", f"Ocurrió un error: {error}")
+        else:
+            self.root.after(POLL_INTERVAL_MS, self.poll_conversion)
+    
+    def update_progress(self, done, total, seconds):
+        self.progress_bar["value"] = 100 * done / total
+        if seconds <= 0 or done <= 0:
+            return
+        rate = done / seconds
+        remaining = (total - done) / rate
+        self.progress_status.set(f"{rate / 1e6:.2f} MB/s, quedan {remaining:.0f} s")
     
     def generate_output_filename(self, input_file):
         """Genera el nombre del archivo de salida"""
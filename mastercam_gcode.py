@@ -1,100 +1,186 @@
-import re
+from conversion_job import track_progress
+from decimation import simplify_polylines
+from emco_program import NUMBER_ALL, number_blocks, program_blocks, write_emco_program
+from feed_planning import dialect_feed
+from parallel_convert import chunked_blocks
+from profiling import ConversionProfile, clock
+from gcode_lexer import (
+    ARC_CODES, MOTION_CODES, code_set, find_value, format_block, g_codes, has_address, has_code,
+    matching_code, pad_leading_zero, remove_codes, rename_address, replace_value,
+    strip_comments, strip_sequence, to_float, tokenize)
+
+SKIP_CODES = code_set(
+    "G54", "G90", "G91", "G20", "G21", "G70", "G71", "G4", "G04", "M03", "G28",
+    "M05", "M30", "G43", "G40", "G49", "G80", "G17", "O0000", "%")
+
+# Códigos que Mastercam agrega a la primera línea G0 y que sí se pueden quitar
+RAPID_SETUP_CODES = code_set("G90", "G54", "M3", "M03")
+
+MOVE_ADDRESSES = frozenset("XYZIJRF")
+IJ_ADDRESSES = frozenset("IJ")
+R_ADDRESS = frozenset("R")
+AXES = ("X", "Y", "Z")
 
 def skip_line_mastercam(line: str):
-    upper_line = line.upper()
-    skip_code = [
-        "G54", "G90", "G91", "G20", "G21", "G70", "G71", "G4", "G04", "M03", "G28", 
-        "M05", "M30", "G43", "G40", "G49", "G80", "G17", "O0000", "%", "G90", "G54"]
-
-    for code in skip_code:
-        if code in upper_line:
-            return True
-    
-    return False
-
-def emco_gcode_from_mastercam_gcode(mastercam_file: str, emco_file: str, S: int, F: int, units: str):
-    
-    SEQUENCE_STEP = 10
-    sequence = SEQUENCE_STEP
-    last_g_code = None  # Registro del último código G usado
-
-    with open(mastercam_file, 'r') as input_file, open(emco_file, 'w') as output_file:
-
-        # CABECERA DEL PROGRAMA
-        output_file.write(f"N{sequence} G90\n")
-        sequence += SEQUENCE_STEP
-        output_file.write(f"N{sequence} {'G71' if units == 'mm' else 'G70'}\n")
-        sequence += SEQUENCE_STEP
-        output_file.write(f"N{sequence} M03 S{S}\n")
-        sequence += SEQUENCE_STEP
-        
-        for line in input_file:
-            output_line = line.strip()
-            
-            # Eliminar números de secuencia (Nxxx) al inicio de la línea
-            output_line = re.sub(r'^N\d+\s*', '', output_line)
-            
-            # ELIMINAR CÓDIGOS ESPECÍFICOS QUE QUEREMOS QUITAR
-            if "G0" in output_line and skip_line_mastercam(output_line): 
-                output_line = re.sub(r'\bG90\b', '', output_line, flags=re.IGNORECASE)
-                output_line = re.sub(r'\bG54\b', '', output_line, flags=re.IGNORECASE)
-                output_line = re.sub(r'\bA0\.\s*', '', output_line, flags=re.IGNORECASE)  # Eliminar A0.
-                output_line = re.sub(r'\bS\d+\b', '', output_line, flags=re.IGNORECASE)  # Eliminar S###
-                output_line = re.sub(r'\bM3\b', '', output_line, flags=re.IGNORECASE)    # Eliminar M3
-                output_line = re.sub(r'\bM03\b', '', output_line, flags=re.IGNORECASE)   # Eliminar M03
-
-            if skip_line_mastercam(output_line):
-                continue
-
-            # Eliminar comentarios
-            output_line = re.sub(r"\([^)]*\)", "", output_line)
-            output_line = re.sub(r";.*", "", output_line)
-
-            # LIMPIAR ESPACIOS MÚLTIPLES
-            output_line = re.sub(r'\s+', ' ', output_line).strip()
-
-            # DETECTAR SI LA LÍNEA TIENE CÓDIGO G
-            current_g_match = re.search(r'\bG(\d+)\b', output_line, re.IGNORECASE)
-            if current_g_match:
-                # Actualizar el último código G usado
-                last_g_code = int(current_g_match.group(1))
-            elif last_g_code is not None and re.search(r'\b[XYZIJRF]', output_line):
-                # Si no tiene código G pero tiene movimiento, agregar el último G
-                output_line = f"G{last_g_code} " + output_line
-
-            # SOLO AGREGAR CEROS FALTANTES EN VALORES I y J (mantener I y J)
-            # Para valores como I.026 -> I0.026, J3. -> J3.0
-            output_line = re.sub(r'\bI\.', 'I0.', output_line, flags=re.IGNORECASE)
-            output_line = re.sub(r'\bJ\.', 'J0.', output_line, flags=re.IGNORECASE)
-            output_line = re.sub(r'\bI-\.', 'I-0.', output_line, flags=re.IGNORECASE)
-            output_line = re.sub(r'\bJ-\.', 'J-0.', output_line, flags=re.IGNORECASE)
-            
-            # Para valores como J3. -> J3.0 (sin decimales después del punto)
-            output_line = re.sub(r'\bI(-?\d+)\.\s', r'I\1.0 ', output_line, flags=re.IGNORECASE)
-            output_line = re.sub(r'\bJ(-?\d+)\.\s', r'J\1.0 ', output_line, flags=re.IGNORECASE)
-            output_line = re.sub(r'\bI(-?\d+)\.$', r'I\1.0', output_line, flags=re.IGNORECASE)
-            output_line = re.sub(r'\bJ(-?\d+)\.$', r'J\1.0', output_line, flags=re.IGNORECASE)
-
-            # CONVERSIÓN DE G2/G3 - R A CR (pero mantener I y J)
-            if re.search(r"\bG[23]\b", output_line, re.IGNORECASE):
-                # Solo cambiar R por CR, mantener I y J
-                output_line = re.sub(r"\bR(-?\.?\d+(\.\d+)?)", r"CR\1", output_line, flags=re.IGNORECASE)
-
-            # REEMPLAZAR F EXISTENTES - MEJORADO PARA VALORES DECIMALES
-            # Manejar F con valores decimales (ej: F100.0, F50.5, etc.)
-            if re.search(r'\bF\d+(\.\d+)?', output_line, re.IGNORECASE):
-                output_line = re.sub(r'\bF\d+(\.\d+)?', f'F{F}', output_line, flags=re.IGNORECASE)
-            
-            # Si no tiene F pero es movimiento G0/G1/G2/G3, agregar F
-            if re.search(r'\bG[0123]\b', output_line, re.IGNORECASE) and not re.search(r'\bF\d+(\.\d+)?', output_line, re.IGNORECASE):
-                output_line += f' F{F}'
-
-            # Escribir solo si queda contenido
-            if output_line.strip():
-                output_file.write(f"N{sequence} {output_line}\n")
-                sequence += SEQUENCE_STEP
-
-        # FINAL DEL PROGRAMA
-        output_file.write(f"N{sequence} M05\n")
-        sequence += SEQUENCE_STEP
-        output_file.write(f"N{sequence} M30\n")
\ No newline at end of file
+    return has_code(tokenize(strip_comments(line)), SKIP_CODES)
+
+def fix_ij_value(value: str):
+    # Para valores como I.026 -> I0.026, J3. -> J3.0
+    value = pad_leading_zero(value)
+    if value.endswith("."):
+        value += "0"
+    return value
+
+def _rapid_setup_words(words, g_values):
+    """Quita de la primera línea G0 los códigos de preparación que agrega Mastercam."""
+    if "0" in g_values and has_code(words, SKIP_CODES):
+        words = remove_codes(words, RAPID_SETUP_CODES)
+        words = [word for word in words
+                 if word[0] != "S" and not (word[0] == "A" and to_float(word[1]) == 0)]
+        g_values = g_codes(words)
+    return words, g_values
+
+def mastercam_blocks(lines, F: int, profile: ConversionProfile = None, start_state=None):
+    """Etapa de conversión: líneas de Mastercam -> bloques EMCO sin número de secuencia.
+
+    profile (opcional) recibe los tiempos por etapa y los contadores de reglas aplicadas.
+    start_state (opcional) es el estado de mastercam_modal_state si las líneas siguen a otras.
+    Con F None se conservan los F del CAM (para feed_planning con factor de CAM).
+    """
+    last_g_code = start_state["g"] if start_state else None  # Registro del último código G usado
+    feed = str(F) if F is not None else None
+
+    for line in lines:
+        if profile:
+            t = clock()
+        # Eliminar números de secuencia (Nxxx) y comentarios, y separar en palabras
+        words = tokenize(strip_comments(strip_sequence(line.strip())))
+        if profile:
+            t = profile.lap("comments", t)
+        if not words:
+            continue
+
+        g_values = g_codes(words)
+
+        # ELIMINAR CÓDIGOS ESPECÍFICOS QUE QUEREMOS QUITAR
+        words, g_values = _rapid_setup_words(words, g_values)
+
+        if has_code(words, SKIP_CODES):
+            if profile:
+                profile.lap("skip", t)
+                profile.skip(matching_code(words, SKIP_CODES))
+            continue
+        if profile:
+            t = profile.lap("skip", t)
+
+        # DETECTAR SI LA LÍNEA TIENE CÓDIGO G
+        if g_values:
+            # Actualizar el último código G usado
+            last_g_code = g_values[0]
+        elif last_g_code is not None and has_address(words, MOVE_ADDRESSES):
+            # Si no tiene código G pero tiene movimiento, agregar el último G
+            words.insert(0, ("G", last_g_code))
+            g_values = [last_g_code]
+            if profile:
+                profile.count("g_inserted")
+
+        if profile:
+            t = clock()
+
+        # SOLO AGREGAR CEROS FALTANTES EN VALORES I y J (mantener I y J)
+        words = [(address, fix_ij_value(value)) if address in IJ_ADDRESSES else (address, value)
+                 for address, value in words]
+
+        # CONVERSIÓN DE G2/G3 - R A CR (pero mantener I y J)
+        if ARC_CODES.intersection(g_values):
+            if profile and has_address(words, R_ADDRESS):
+                profile.count("r_to_cr")
+            words = rename_address(words, "R", "CR")
+        if profile:
+            t = profile.lap("arcs", t)
+
+        # REEMPLAZAR F EXISTENTES
+        if feed is None:
+            pass
+        elif find_value(words, "F") is not None:
+            words = replace_value(words, "F", feed)
+            if profile:
+                profile.count("f_overridden")
+        # Si no tiene F pero es movimiento G0/G1/G2/G3, agregar F
+        elif MOTION_CODES.intersection(g_values):
+            words.append(("F", feed))
+            if profile:
+                profile.count("f_appended")
+        if profile:
+            profile.lap("feed", t)
+
+        # Escribir solo si queda contenido
+        if words:
+            yield format_block(words)
+
+def mastercam_modal_state(previous_lines):
+    """Estado modal al final de previous_lines, recorridas hacia atrás desde el corte.
+
+    Devuelve {"g": último código G, "position": {eje: texto}} para mastercam_stages.
+    """
+    state = {"g": None, "position": dict.fromkeys(AXES)}
+    pending = set(AXES) | {"g"}
+    for line in previous_lines:
+        words = tokenize(strip_comments(strip_sequence(line.strip())))
+        if not words:
+            continue
+        words, g_values = _rapid_setup_words(words, g_codes(words))
+        if has_code(words, SKIP_CODES):
+            continue
+        if g_values and "g" in pending:
+            state["g"] = g_values[0]
+            pending.discard("g")
+        for address, value in reversed(words):
+            if address in pending:
+                state["position"][address] = value
+                pending.discard(address)
+        if not pending:
+            break
+    return state
+
+def mastercam_stages(lines, S: int, F: int, report, profiler: ConversionProfile = None, state=None,
+                     simplify_tolerance: float = None):
+    """Bloques EMCO (sin cabecera ni números) de las líneas; report recibe los informes de las etapas."""
+    blocks = mastercam_blocks(lines, F, profiler, state)
+    if profiler:
+        blocks = profiler.iterate("dialect", blocks)
+    if simplify_tolerance:
+        report["simplify"] = {}
+        blocks = simplify_polylines(blocks, simplify_tolerance, report["simplify"], state and state["position"])
+        if profiler:
+            blocks = profiler.iterate("simplify", blocks)
+    return blocks
+
+def emco_blocks_from_mastercam_gcode(lines, S: int, F: int, units: str):
+    """Programa EMCO completo y numerado a partir de un iterable de líneas de Mastercam."""
+    return number_blocks(program_blocks(mastercam_blocks(lines, F), S, units))
+
+def emco_gcode_from_mastercam_gcode(mastercam_file: str, emco_file: str, S: int, F: int, units: str, progress=None, subprograms: bool = False,
+                                    simplify_tolerance: float = None, profile: bool = False, columnar: bool = False,
+                                    jobs: int = None, compact: bool = False, numbering: str = NUMBER_ALL,
+                                    validate=None, feed_plan=None):
+
+    report = {}
+    profiler = ConversionProfile() if profile else None
+    feed = dialect_feed(F, feed_plan)  # None: el plan de avances parte de los F del CAM
+    # Con columnar el F se fija sobre el modelo en columnas y el dialecto conserva los del CAM
+    stage_feed = None if columnar else feed
+    with open(mastercam_file, 'r') as input_file:
+        if jobs is not None and not profiler:
+            # Por trozos en varios procesos; la salida es la misma que la secuencial
+            blocks = chunked_blocks(input_file, mastercam_stages, mastercam_modal_state, skip_line_mastercam,
+                                    S, stage_feed, report, jobs, progress, any_line=not simplify_tolerance,
+                                    simplify_tolerance=simplify_tolerance)
+        else:
+            lines = track_progress(input_file, progress)
+            blocks = mastercam_stages(lines, S, stage_feed, report, profiler, simplify_tolerance=simplify_tolerance)
+        write_emco_program(emco_file, blocks, S, units, subprograms, report, columnar, compact, numbering,
+                           validate, feed_plan, feed, profiler=profiler)
+    if profiler:
+        report["profile"] = profiler.report()
+    return report
@@ -0,0 +1,92 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from conversion_job import track_progress
+from emco_program import is_tool_change
+from gcode_lexer import strip_comments
+
+# Conversión de un solo archivo grande por trozos en un pool de procesos.
+# Los cortes se hacen en los cambios de herramienta (M6), donde las etapas
+# por tramos (ajuste de arcos, simplificación) siempre terminan su tramo;
+# sin esas etapas el conversor es bloque a bloque y sirve cualquier línea.
+# Cada trozo empieza con el estado modal que tendría el conversor secuencial
+# en ese punto: la función modal_state del dialecto lo reconstruye leyendo
+# hacia atrás desde el corte solo las líneas necesarias (último G, última Z,
+# banderas de fresado, posición). Los bloques vuelven en orden y se numeran
+# una sola vez en write_emco_program, así la salida es idéntica byte a byte
+# a la conversión secuencial. A cambio el archivo entero y los bloques
+# convertidos se guardan en memoria.
+
+MIN_CHUNK_LINES = 50000   # Por debajo el arranque de los procesos no compensa
+CHUNKS_PER_JOB = 2        # Más trozos que procesos para repartir mejor la carga
+
+def _is_tool_change_line(line: str, skip_line):
+    # Filtro rápido antes de separar la línea en palabras
+    if "6" not in line:
+        return False
+    line = strip_comments(line.strip()).upper()
+    return is_tool_change(line) and not skip_line(line)
+
+def chunk_boundaries(lines, skip_line, chunks: int, any_line: bool = False):
+    """Índices de las líneas donde empieza cada trozo a partir del segundo.
+
+    Sin any_line solo se corta en cambios de herramienta que el dialecto no descarta.
+    """
+    total = len(lines)
+    size = max(MIN_CHUNK_LINES, -(-total // max(chunks, 1)))
+    cuts = []
+    index = size
+    while index < total:
+        if any_line or _is_tool_change_line(lines[index], skip_line):
+            cuts.append(index)
+            index += size
+        else:
+            index += 1
+    return cuts
+
+def merge_reports(report, part):
+    """Suma en report los informes de etapa ({etapa: {contador: valor}}) de un trozo."""
+    for name, stats in part.items():
+        total = report.setdefault(name, {})
+        for key, value in stats.items():
+            total[key] = total.get(key, 0) + value
+
+def _convert_chunk(stages, lines, S: int, F: int, state, options):
+    """Se ejecuta en un proceso del pool: convierte un trozo partiendo del estado modal state."""
+    report = {}
+    blocks = list(stages(lines, S, F, report, None, state, **options))
+    return blocks, report
+
+def _stream_chunks(lines, cuts, stages, modal_state, S, F, report, jobs, progress, options):
+    starts = [0] + cuts
+    stops = cuts + [len(lines)]
+    states = [None] + [modal_state(lines[index] for index in range(cut - 1, -1, -1)) for cut in cuts]
+    executor = ProcessPoolExecutor(max_workers=min(jobs, len(starts)))
+    try:
+        futures = [executor.submit(_convert_chunk, stages, lines[start:stop], S, F, state, options)
+                   for start, stop, state in zip(starts, stops, states)]
+        read_chars = 0
+        for future, start, stop in zip(futures, starts, stops):
+            blocks, part = future.result()
+            merge_reports(report, part)
+            yield from blocks
+            if progress is not None:
+                read_chars += sum(len(line) for line in lines[start:stop])
+                progress(read_chars)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+def chunked_blocks(input_file, stages, modal_state, skip_line, S: int, F: int, report, jobs: int,
+                   progress=None, any_line: bool = False, **options):
+    """Bloques EMCO de input_file (archivo abierto) convertidos por trozos en jobs procesos.
+
+    stages(líneas, S, F, informe, profiler, estado, **options) y modal_state(líneas_hacia_atrás)
+    son los del dialecto; skip_line descarta los cambios de herramienta que el dialecto no
+    escribe. Si el archivo no da para dos trozos se convierte en este proceso.
+    """
+    if jobs is not None and jobs < 1:
+        jobs = os.cpu_count() or 1
+    lines = input_file.readlines()
+    cuts = chunk_boundaries(lines, skip_line, jobs * CHUNKS_PER_JOB, any_line) if jobs > 1 else []
+    if not cuts:
+        return stages(track_progress(lines, progress), S, F, report, None, None, **options)
+    return _stream_chunks(lines, cuts, stages, modal_state, S, F, report, jobs, progress, options)
@@ -0,0 +1,105 @@
+import time
+
+# Perfilado opcional de los conversores. Los bucles de cada dialecto reciben
+# un ConversionProfile o None; con None solo cuesta una comprobación por
+# etapa y línea. Los tiempos por línea se toman con lap() y las etapas
+# encadenadas (dialecto, ajuste de arcos, simplificación) con iterate(), que
+# mide el tiempo acumulado de cada generador; el tiempo exclusivo de cada una
+# se obtiene restando el de la etapa anterior.
+
+# Etapas medidas línea a línea dentro de los bucles de cada dialecto
+LINE_STAGES = ("comments", "skip", "arcs", "feed")
+
+STAGE_NAMES = {
+    "comments": "comentarios y palabras",
+    "skip": "filtrado de códigos",
+    "arcs": "arcos",
+    "feed": "reescritura F/S",
+    "other": "resto del dialecto",
+    "arc_fitting": "ajuste de arcos",
+    "simplify": "simplificación",
+    "write": "escritura",
+}
+
+COUNTER_NAMES = {
+    "ij_to_cr": "arcos I/J -> CR",
+    "r_to_cr": "arcos R -> CR",
+    "bare_ij": "arcos con I/J sueltos",
+    "f_overridden": "F reemplazados",
+    "f_appended": "F añadidos",
+    "g_inserted": "G modales añadidos",
+    "g0_to_g1": "G0 -> G1",
+    "tool_changes": "cambios de herramienta con M05/M03",
+}
+
+clock = time.perf_counter
+
+class ConversionProfile:
+    def __init__(self):
+        self.seconds = dict.fromkeys(LINE_STAGES, 0.0)
+        self.counters = {}
+        self.skipped = {}
+        self._chain = []   # [(etapa, segundos acumulados)] en orden de la cadena
+        self._start = clock()
+
+    def lap(self, stage: str, since: float):
+        """Suma a stage el tiempo desde since y devuelve el instante actual."""
+        now = clock()
+        self.seconds[stage] += now - since
+        return now
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def skip(self, code: str):
+        self.skipped[code] = self.skipped.get(code, 0) + 1
+
+    def iterate(self, stage: str, blocks):
+        """Recorre blocks midiendo el tiempo acumulado que tarda en producir cada bloque.
+
+        Hay que llamarlo en el orden de la cadena: cada etapa se registra al envolverla.
+        """
+        entry = [stage, 0.0]
+        self._chain.append(entry)
+        return self._timed(entry, iter(blocks))
+
+    def _timed(self, entry, iterator):
+        while True:
+            start = clock()
+            try:
+                block = next(iterator)
+            except StopIteration:
+                entry[1] += clock() - start
+                return
+            entry[1] += clock() - start
+            yield block
+
+    def report(self):
+        seconds = dict(self.seconds)
+        previous = 0.0
+        for stage, cumulative in self._chain:
+            if stage == "dialect":
+                seconds["other"] = max(0.0, cumulative - sum(self.seconds.values()))
+            else:
+                seconds[stage] = max(0.0, cumulative - previous)
+            previous = cumulative
+        total = clock() - self._start
+        seconds["write"] = max(0.0, total - previous)
+        return {
+            "total_seconds": round(total, 4),
+            "seconds": {stage: round(value, 4) for stage, value in seconds.items()},
+            "counters": dict(self.counters),
+            "skipped": dict(sorted(self.skipped.items(), key=lambda item: -item[1])),
+        }
+
+def profile_summary(report):
+    total = report["total_seconds"] or 1.0
+    lines = [f"Perfil de conversión ({report['total_seconds']:.2f} s):"]
+    for stage, seconds in report["seconds"].items():
+        lines.append(f"  {STAGE_NAMES.get(stage, stage)}: {seconds:.3f} s ({100 * seconds / total:.0f}%)")
+    if report["counters"]:
+        lines.append("  " + ", ".join(f"{COUNTER_NAMES.get(name, name)}: {value}"
+                                      for name, value in report["counters"].items()))
+    if report["skipped"]:
+        lines.append("  Líneas omitidas: " + ", ".join(f"{code} {count}" for code, count in report["skipped"].items()))
+    return lines
@@ -0,0 +1,173 @@
+import os
+from collections import deque
+from cycle_time import AXES, ModalTracker
+from emco_program import SEQUENCE_STEP, is_tool_change, program_footer, program_header
+from gcode_lexer import MOTION_CODES, code_value, strip_sequence, tokenize
+from subprograms import SCALE, format_units
+
+# División de un programa EMCO ya convertido en varios archivos que caben en
+# la memoria del control. Cada parte lleva su propia cabecera (G90, G70/G71,
+# M03 S) y final (M05 M30) y se numera desde N10. Se corta antes de cada
+# cambio de herramienta (opcional) y, por tamaño, preferentemente antes de un
+# rápido con la herramienta arriba (a la Z más alta del programa hasta ese punto)
+# a partir del SOFT_LIMIT del máximo. Si no aparece ninguno se corta antes
+# del bloque que no cabe: si la herramienta está dentro del material, la
+# parte termina con un G0 a esa Z segura y la siguiente vuelve en G0 a X/Y y
+# baja en G1 a la Z del corte. Las partes cortadas por tamaño empiezan
+# repitiendo el G y el F modales: cada parte es un programa aparte y con la
+# salida compacta los bloques siguientes no llevan ni G ni F.
+
+SOFT_LIMIT = 0.9
+SAFE_EPSILON = 1e-6
+HEADER_BLOCKS = len(program_header(0, "mm"))
+OUTPUT_SUFFIX = "_FOR_EMCO.SPF"
+
+def part_filename(emco_file: str, number: int):
+    """programa_FOR_EMCO.SPF -> programa_01_FOR_EMCO.SPF"""
+    if emco_file.upper().endswith(OUTPUT_SUFFIX):
+        return f"{emco_file[:-len(OUTPUT_SUFFIX)]}_{number:02d}{emco_file[-len(OUTPUT_SUFFIX):]}"
+    base, extension = os.path.splitext(emco_file)
+    return f"{base}_{number:02d}{extension or '.SPF'}"
+
+def read_header(emco_file: str):
+    """(S, unidades) de la cabecera que escribe write_emco_program (G90, G70/G71, M03 S)."""
+    with open(emco_file, 'r') as program:
+        header = [strip_sequence(program.readline().strip()) for _ in range(HEADER_BLOCKS)]
+    words = tokenize(header[2])
+    if header[0] != "G90" or header[1] not in ("G70", "G71") or ("M", "03") not in words:
+        raise ValueError(f"{os.path.basename(emco_file)} no empieza con la cabecera EMCO (G90, G70/G71, M03 S)")
+    S = int(next(value for address, value in words if address == "S"))
+    return S, "mm" if header[1] == "G71" else "inches"
+
+def program_body(emco_file: str):
+    """Bloques sin número de secuencia entre la cabecera y el final (M05 M30)."""
+    footer = deque(maxlen=len(program_footer()))
+    with open(emco_file, 'r') as program:
+        for index, line in enumerate(program):
+            block = strip_sequence(line.strip())
+            if index < HEADER_BLOCKS or not block:
+                continue
+            if len(footer) == footer.maxlen:
+                yield footer[0]
+            footer.append(block)
+
+class _PartWriter:
+    def __init__(self, path: str, S: int, units: str):
+        self.path = path
+        self.file = open(path, 'w')
+        self.sequence = 0
+        self.size = 0
+        self.moves = 0
+        for block in program_header(S, units):
+            self.write(block)
+
+    def line_size(self, block: str, offset: int = 1):
+        return len(f"N{self.sequence + offset * SEQUENCE_STEP} {block}\n")
+
+    def write(self, block: str):
+        self.sequence += SEQUENCE_STEP
+        line = f"N{self.sequence} {block}\n"
+        self.file.write(line)
+        self.size += len(line)
+
+    def footer_size(self, extra: int = 0):
+        return sum(self.line_size(block, extra + index) for index, block in enumerate(program_footer(), 1))
+
+    def close(self):
+        for block in program_footer():
+            self.write(block)
+        self.file.close()
+
+def split_emco_program(emco_file: str, max_bytes: int = None, tool_changes: bool = True):
+    """Divide emco_file en partes programa_NN_FOR_EMCO.SPF y devuelve el informe de la división.
+
+    max_bytes limita el tamaño de cada parte; tool_changes corta antes de cada cambio de herramienta.
+    """
+    S, units = read_header(emco_file)
+    parts = []
+    motion = feed = None
+    modal = ModalTracker()
+    safe_z = None   # Z más alta programada: la de los retrocesos
+    writer = None
+
+    def retracted():
+        z = modal.position["Z"]
+        return z is not None and safe_z is not None and z >= safe_z - SAFE_EPSILON
+
+    def start_part(restore: bool, retract: bool = False):
+        nonlocal writer
+        position = dict(modal.position)
+        if writer is not None:
+            if retract:
+                writer.write(f"G0 Z{format_units(round(safe_z * SCALE))}")
+            writer.close()
+            parts.append((writer.path, writer.size))
+        writer = _PartWriter(part_filename(emco_file, len(parts) + 1), S, units)
+        if retract:
+            # Volver sobre el punto del corte y bajar en avance a su Z
+            if None not in (position["X"], position["Y"]):
+                writer.write(f"G0 X{format_units(round(position['X'] * SCALE))} "
+                             f"Y{format_units(round(position['Y'] * SCALE))}")
+            writer.write(f"G1 Z{format_units(round(position['Z'] * SCALE))}" + (f" F{feed}" if feed else ""))
+        words = ([f"G{motion}"] if motion is not None else []) + ([f"F{feed}"] if feed is not None else [])
+        if restore and words:
+            # La parte anterior se cortó a mitad del programa: repetir el estado modal
+            writer.write(" ".join(words))
+
+    start_part(False)
+    held = []  # M05 retenido hasta saber si precede a un cambio de herramienta
+    for block in program_body(emco_file):
+        if tool_changes and block == "M05":
+            held.append(block)
+            continue
+
+        words = tokenize(block)
+        g_values = [code_value(value) for address, value in words if address == "G"]
+        # G0 explícito o, en la salida compacta, movimiento que sigue en G0
+        rapid = g_values == ["0"] or (not g_values and motion == "0"
+                                      and any(address in AXES for address, _ in words))
+        if tool_changes and is_tool_change(block) and writer.moves:
+            # El M05 inyectado antes del cambio viaja con él a la parte siguiente
+            start_part(False)
+        elif max_bytes and writer.moves:
+            pending = held + [block]
+            size = writer.size + sum(writer.line_size(item, index) for index, item in enumerate(pending, 1))
+            # Sitio para el G0 de retroceso que puede necesitar el corte siguiente
+            reserve = writer.line_size(f"G0 Z{format_units(round((safe_z or 0.0) * SCALE))}", len(pending) + 1)
+            if size + reserve + writer.footer_size(len(pending) + 1) > max_bytes:
+                start_part(True, retract=not retracted() and safe_z is not None and modal.position["Z"] is not None)
+            elif size >= SOFT_LIMIT * max_bytes and rapid and retracted():
+                start_part(True)
+
+        for item in held:
+            writer.write(item)
+        held.clear()
+        writer.write(block)
+
+        for address, value in words:
+            if address == "G" and code_value(value) in MOTION_CODES:
+                motion = code_value(value)
+            elif address == "F":
+                feed = value
+        modal.advance([address + value for address, value in words])
+        if any(address == "L" for address, _ in words):
+            # Tras una llamada a subprograma la posición no se conoce
+            modal.position = dict.fromkeys(AXES)
+        elif modal.position["Z"] is not None and (safe_z is None or modal.position["Z"] > safe_z):
+            safe_z = modal.position["Z"]
+        if any(address in ("X", "Y", "Z") for address, _ in words):
+            writer.moves += 1
+
+    for item in held:
+        writer.write(item)
+    writer.close()
+    parts.append((writer.path, writer.size))
+
+    oversized = [path for path, size in parts if max_bytes and size > max_bytes]
+    return {
+        "parts": [os.path.basename(path) for path, _ in parts],
+        "sizes": [size for _, size in parts],
+        "max_bytes": max_bytes,
+        "tool_changes": tool_changes,
+        "oversized": [os.path.basename(path) for path in oversized],
+    }
@@ -0,0 +1,197 @@
+import math
+from cycle_time import ARC_ADDRESSES, AXES, INCH, ModalTracker
+from gcode_lexer import to_float
+
+# Validación del programa EMCO en la misma pasada en que se escribe: es una
+# etapa más que deja pasar los bloques y sigue la posición modal (G0-G3,
+# G90/G91, G70/G71) con cycle_time.ModalTracker. Comprueba:
+#   - límites de recorrido blandos, dados en mm y en coordenadas de pieza, y
+#     convertidos a las unidades del programa;
+#   - arcos G2/G3: con CR la cuerda no puede superar el diámetro; con I/J el
+#     punto final tiene que estar a la misma distancia del centro que el inicial;
+#   - rápidos G0 que bajan por debajo de la superficie del material o que se
+#     mueven dentro de él;
+#   - unidades: extensión de los ejes y avances que no encajan con G70/G71.
+# La memoria no depende del tamaño del programa: solo se guardan contadores,
+# la extensión de los ejes y unos pocos ejemplos de cada problema. Los bloques
+# ya salen de format_block (palabras separadas por espacios), así que se
+# separan con str.split en lugar de la expresión regular de tokenize, que
+# costaría más que el resto de la comprobación.
+
+SURFACE_Z = 0.0               # Z de la superficie del material (cero de pieza arriba, como en los CAM)
+ARC_RADIUS_TOLERANCE = 0.01   # mm de diferencia admitida entre radios (redondeo de la salida)
+POSITION_EPSILON = 1e-6
+MAX_EXAMPLES = 3
+
+# Valores que casi seguro indican unidades cambiadas
+MAX_SPAN_INCHES = 40.0   # Recorrido de un eje en G70
+MIN_SPAN_MM = 2.0        # Recorrido del eje más largo en G71
+MAX_FEED_INCHES = 400.0  # in/min
+MIN_FEED_MM = 5.0        # mm/min
+
+ISSUES = {
+    "limits": "Fuera de límites",
+    "arc_radius": "Arcos con radio incoherente",
+    "rapid_plunge": "Bajadas en rápido al material",
+    "rapid_in_material": "Rápidos dentro del material",
+    "units": "Posible error de unidades",
+}
+
+def validation_settings(limits=None, surface: float = SURFACE_Z):
+    """Opción validate de los conversores: límites {eje: (mín, máx)} en mm y Z de la superficie."""
+    return {"limits": {axis: [low, high] for axis, (low, high) in (limits or {}).items()}, "surface": surface}
+
+def parse_limits(text: str):
+    """'X-10:180,Y0:130,Z-60:20' -> {"X": (-10.0, 180.0), ...}."""
+    limits = {}
+    for item in text.replace(" ", "").upper().split(","):
+        axis = item[:1]
+        low, separator, high = item[1:].partition(":")
+        if axis not in AXES or not separator or to_float(low) is None or to_float(high) is None:
+            raise ValueError(f"límite no válido '{item}' (formato: X-10:180,Y0:130,Z-60:20)")
+        if to_float(low) > to_float(high):
+            raise ValueError(f"límite no válido '{item}': el mínimo es mayor que el máximo")
+        limits[axis] = (to_float(low), to_float(high))
+    return limits
+
+class ProgramValidator:
+    """Sigue la posición modal bloque a bloque y cuenta los problemas encontrados."""
+
+    def __init__(self, settings=None):
+        settings = settings or {}
+        self.limits = {axis: tuple(limit) for axis, limit in (settings.get("limits") or {}).items()}
+        self.surface = settings.get("surface", SURFACE_Z)
+        self.modal = ModalTracker()
+        self.low = {}
+        self.high = {}
+        self.min_feed = None
+        self.max_feed = None
+        self.last_feed = None
+        self.blocks = 0
+        self.counts = {}
+        self.examples = {}
+
+    def _issue(self, kind: str, text: str):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        examples = self.examples.setdefault(kind, [])
+        if len(examples) < MAX_EXAMPLES:
+            examples.append(text)
+
+    def check(self, block: str):
+        self.blocks += 1
+        start, moved, rest = self.modal.advance(block.split())
+        values = {}
+
+        for address, value in rest:
+            if address == "F":
+                if value == self.last_feed:
+                    continue
+                self.last_feed = value
+                feed = to_float(value)
+                if feed:
+                    self.min_feed = feed if self.min_feed is None else min(self.min_feed, feed)
+                    self.max_feed = feed if self.max_feed is None else max(self.max_feed, feed)
+            elif address in ARC_ADDRESSES:
+                values[address] = to_float(value)
+
+        if moved and self.modal.motion is not None:
+            self._move(block, start, self.modal.position, moved, values)
+
+    def _move(self, block: str, start, end, moved, values):
+        motion = self.modal.motion
+        scale = 1 / INCH if self.modal.inches else 1.0
+        # Solo los ejes del bloque: los demás no cambian y no se repite el aviso de límites
+        for axis in moved:
+            value = end[axis]
+            if value is None:
+                continue
+            if axis not in self.low or value < self.low[axis]:
+                self.low[axis] = value
+            if axis not in self.high or value > self.high[axis]:
+                self.high[axis] = value
+            limit = self.limits.get(axis)
+            if limit and not limit[0] * scale - POSITION_EPSILON <= value <= limit[1] * scale + POSITION_EPSILON:
+                self._issue("limits", f"bloque {self.blocks}: {block} ({axis} fuera de "
+                                      f"{limit[0] * scale:g} .. {limit[1] * scale:g})")
+                break
+
+        if motion == "0":
+            z0, z1 = start["Z"], end["Z"]
+            if z1 is None or z1 >= self.surface - POSITION_EPSILON:
+                return
+            if z0 is None or z1 < z0 - POSITION_EPSILON:
+                self._issue("rapid_plunge", f"bloque {self.blocks}: {block}")
+            elif start["X"] != end["X"] or start["Y"] != end["Y"]:
+                self._issue("rapid_in_material", f"bloque {self.blocks}: {block}")
+        elif motion in ("2", "3"):
+            self._check_arc(block, start, end, values, ARC_RADIUS_TOLERANCE * scale)
+
+    def _check_arc(self, block: str, start, end, values, tolerance: float):
+        if None in (start["X"], start["Y"], end["X"], end["Y"]):
+            return
+        if values.get("CR") is not None:
+            chord = math.hypot(end["X"] - start["X"], end["Y"] - start["Y"])
+            radius = abs(values["CR"])
+            if chord > 2 * radius + tolerance:
+                self._issue("arc_radius", f"bloque {self.blocks}: {block} (cuerda {chord:.4f} > 2·CR)")
+            return
+        if values.get("I") is None and values.get("J") is None:
+            self._issue("arc_radius", f"bloque {self.blocks}: {block} (sin CR ni I/J)")
+            return
+        cx = start["X"] + (values.get("I") or 0.0)
+        cy = start["Y"] + (values.get("J") or 0.0)
+        start_radius = math.hypot(start["X"] - cx, start["Y"] - cy)
+        end_radius = math.hypot(end["X"] - cx, end["Y"] - cy)
+        if abs(start_radius - end_radius) > tolerance:
+            self._issue("arc_radius", f"bloque {self.blocks}: {block} "
+                                      f"(radios {start_radius:.4f} y {end_radius:.4f})")
+
+    def finish(self):
+        """Al terminar el programa: avisos de unidades según la extensión de los ejes y los avances."""
+        spans = {axis: self.high[axis] - self.low[axis] for axis in self.low}
+        span = max(spans.values(), default=0.0)
+        if self.modal.inches:
+            if span > MAX_SPAN_INCHES:
+                self._issue("units", f"recorrido de {span:g} in en G70: ¿valores en mm?")
+            if self.max_feed is not None and self.max_feed > MAX_FEED_INCHES:
+                self._issue("units", f"avance F{self.max_feed:g} in/min en G70: ¿valores en mm?")
+            if self.counts.get("limits") and all(
+                    low >= self.limits[axis][0] - POSITION_EPSILON
+                    and self.high[axis] <= self.limits[axis][1] + POSITION_EPSILON
+                    for axis, low in self.low.items() if axis in self.limits):
+                # Lo que se sale en pulgadas cabe si los valores fueran mm
+                self._issue("units", "fuera de límites en pulgadas pero dentro si fueran mm")
+        else:
+            if spans and span < MIN_SPAN_MM:
+                self._issue("units", f"recorrido de {span:g} mm en G71: ¿valores en pulgadas?")
+            if self.min_feed is not None and self.min_feed < MIN_FEED_MM:
+                self._issue("units", f"avance F{self.min_feed:g} mm/min en G71: ¿valores en pulgadas?")
+
+    def report(self):
+        return {
+            "blocks": self.blocks,
+            "units": "inches" if self.modal.inches else "mm",
+            "counts": dict(self.counts),
+            "examples": {kind: list(examples) for kind, examples in self.examples.items()},
+            "bounds": {axis: [self.low[axis], self.high[axis]] for axis in AXES if axis in self.low},
+        }
+
+def validate_blocks(blocks, settings, stats):
+    """Etapa: deja pasar los bloques y, al terminar, escribe en stats el informe de validación."""
+    validator = ProgramValidator(settings)
+    check = validator.check
+    for block in blocks:
+        check(block)
+        yield block
+    validator.finish()
+    stats.update(validator.report())
+
+def validation_summary(report):
+    total = sum(report["counts"].values())
+    if not total:
+        return [f"Validación: {report['blocks']} bloques sin problemas"]
+    lines = [f"Validación: {total} problemas en {report['blocks']} bloques"]
+    for kind, label in ISSUES.items():
+        if kind in report["counts"]:
+            lines.append(f"  {label}: {report['counts'][kind]} ({'; '.join(report['examples'][kind])})")
+    return lines
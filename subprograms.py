@@ -0,0 +1,285 @@
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+from gcode_lexer import code_value, format_block, tokenize
+
+# Detección de trayectorias repetidas para la opción "Crear subprogramas".
+#
+# El programa se divide en tramos de movimiento separados por los
+# posicionamientos rápidos en XY (G0 X/Y) y por cualquier bloque que no sea de
+# movimiento (cambios de herramienta, M, S...). Cada tramo se normaliza a
+# coordenadas incrementales, así que el mismo recorrido hecho en otra posición
+# de la mesa produce la misma clave. Los tramos que se repiten pasan a un
+# subprograma L#### en G91 que el programa principal llama con "L####", y las
+# repeticiones seguidas con el mismo desplazamiento se agrupan en "L#### P<n>".
+#
+# Los L####.SPF se escriben junto al programa principal, así que varios
+# programas en la misma carpeta no pueden usar los mismos números. Cada
+# carpeta lleva un registro (emco_subprogramas.json) con el rango reservado
+# para cada programa; allocate_subprograms lo consulta con un cerrojo (por si
+# escriben varios procesos del lote a la vez) y el programa se renumera a su
+# rango antes de escribirlo. Los L####.SPF que ya hay en la carpeta y no
+# están en el registro (conversiones anteriores) también cuentan como ocupados.
+# Si la conversión se cancela o falla, release_subprograms borra sus L####.SPF
+# y libera el rango.
+
+FIRST_SUBPROGRAM = 1000
+LAST_SUBPROGRAM = 9999
+REGISTRY_FILE = "emco_subprogramas.json"
+LOCK_TIMEOUT = 10.0     # Segundos antes de dar por abandonado el cerrojo del registro
+_SUBPROGRAM_FILE_RE = re.compile(r"^L(\d+)\.SPF$", re.IGNORECASE)
+MIN_BLOCKS = 3          # Tramos más cortos no compensan la llamada
+SCALE = 10000           # Coordenadas en diezmilésimas para que G91 no acumule error
+
+MOTION_ADDRESSES = frozenset(("G", "X", "Y", "Z", "I", "J", "CR", "F"))
+AXES = ("X", "Y", "Z")
+
+def to_units(value: str):
+    """Coordenada en diezmilésimas, o None si no es exacta con 4 decimales."""
+    try:
+        scaled = float(value) * SCALE
+    except ValueError:
+        return None
+    units = round(scaled)
+    if abs(scaled - units) > 1e-3:
+        return None
+    return units
+
+def format_units(units: int):
+    sign = "-" if units < 0 else ""
+    integer, fraction = divmod(abs(units), SCALE)
+    if not fraction:
+        return f"{sign}{integer}"
+    return f"{sign}{integer}.{fraction:04d}".rstrip("0")
+
+class _Entry:
+    __slots__ = ("kind", "blocks", "key", "incremental")
+
+    def __init__(self, kind, blocks, key=None, incremental=None):
+        self.kind = kind              # "block", "position" o "body"
+        self.blocks = blocks          # bloques originales (absolutos)
+        self.key = key                # clave incremental normalizada o None
+        self.incremental = incremental
+
+def _classify(blocks):
+    """Agrupa los bloques en entradas: bloques sueltos, posicionamientos y tramos de movimiento."""
+    position = {"X": None, "Y": None, "Z": None}
+    entries = []
+    body_blocks = []
+    body_incremental = []
+
+    def close_body():
+        if body_blocks:
+            entries.append(_Entry("body", list(body_blocks), tuple(body_incremental), list(body_incremental)))
+            body_blocks.clear()
+            body_incremental.clear()
+
+    for block in blocks:
+        words = tokenize(block)
+        g_values = [code_value(value) for address, value in words if address == "G"]
+        motion = len(g_values) == 1 and g_values[0] in ("0", "1", "2", "3")
+        movable = motion and all(address in MOTION_ADDRESSES for address, _ in words)
+
+        # Bloque en incremental; None si alguna coordenada no se puede pasar a G91
+        incremental = [] if movable else None
+        for address, value in words:
+            if address in position:
+                units = to_units(value)
+                previous = position[address]
+                if incremental is not None:
+                    if units is None or previous is None:
+                        incremental = None
+                    else:
+                        incremental.append((address, format_units(units - previous)))
+                position[address] = units
+            elif incremental is not None:
+                incremental.append((address, code_value(value) if address == "G" else value))
+
+        moves_axes = any(address in position for address, _ in words)
+        if incremental is None or not moves_axes:
+            close_body()
+            entries.append(_Entry("block", [block]))
+        elif g_values[0] == "0" and any(address in ("X", "Y") for address, _ in words):
+            close_body()
+            text = format_block(incremental)
+            entries.append(_Entry("position", [block], text, [text]))
+        else:
+            body_blocks.append(block)
+            body_incremental.append(format_block(incremental))
+
+    close_body()
+    return entries
+
+def factor_subprograms(blocks, first_number: int = FIRST_SUBPROGRAM, min_blocks: int = MIN_BLOCKS):
+    """Sustituye los tramos repetidos por llamadas a subprogramas.
+
+    Devuelve (bloques_principales, subprogramas) donde subprogramas es un dict
+    {número: bloques} con los bloques de cada subprograma, incluidos G91/G90 y M17.
+    """
+    entries = _classify(blocks)
+
+    counts = {}
+    for entry in entries:
+        if entry.kind == "body" and len(entry.key) >= min_blocks:
+            counts[entry.key] = counts.get(entry.key, 0) + 1
+
+    numbers = {}
+    subprograms = {}
+
+    def subprogram_for(key, incremental):
+        number = numbers.get(key)
+        if number is None:
+            number = first_number + len(numbers)
+            numbers[key] = number
+            subprograms[number] = ["G91", *incremental, "G90", "M17"]
+        return number
+
+    def repeated(entry):
+        return entry.kind == "body" and counts.get(entry.key, 0) > 1
+
+    main = []
+    index = 0
+    while index < len(entries):
+        entry = entries[index]
+        if not repeated(entry):
+            main.extend(entry.blocks)
+            index += 1
+            continue
+
+        main.append(f"L{subprogram_for(entry.key, entry.incremental)}")
+        index += 1
+
+        # Repeticiones seguidas con el mismo desplazamiento: posicionamiento + tramo
+        count = 0
+        step = entries[index] if index < len(entries) else None
+        while (index + 2 * count + 1 < len(entries)
+               and step is not None and step.kind == "position"
+               and entries[index + 2 * count].kind == "position"
+               and entries[index + 2 * count].key == step.key
+               and entries[index + 2 * count + 1].key == entry.key):
+            count += 1
+        if count >= 2:
+            number = subprogram_for((step.key, entry.key), [step.key, *entry.incremental])
+            main.append(f"L{number} P{count}")
+            index += 2 * count
+
+    return main, subprograms
+
+def subprogram_path(emco_file: str, number: int):
+    return os.path.join(os.path.dirname(os.path.abspath(emco_file)), f"L{number}.SPF")
+
+@contextmanager
+def _registry_lock(folder: str):
+    lock = os.path.join(folder, REGISTRY_FILE + ".lock")
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while True:
+        try:
+            descriptor = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            if time.monotonic() > deadline:
+                # Cerrojo de un proceso que terminó sin soltarlo
+                try:
+                    os.remove(lock)
+                except OSError:
+                    pass
+                deadline = time.monotonic() + LOCK_TIMEOUT
+            time.sleep(0.01)
+    try:
+        yield
+    finally:
+        os.close(descriptor)
+        os.remove(lock)
+
+def _read_registry(registry_path: str):
+    try:
+        with open(registry_path, 'r') as registry_file:
+            return json.load(registry_file)
+    except (OSError, ValueError):
+        return {}
+
+def _write_registry(registry_path: str, registry):
+    with open(registry_path + ".tmp", 'w') as registry_file:
+        json.dump(registry, registry_file, indent=1, sort_keys=True)
+    os.replace(registry_path + ".tmp", registry_path)
+
+def allocate_subprograms(emco_file: str, count: int):
+    """Primer número del rango de count subprogramas reservado para emco_file en su carpeta.
+
+    Un programa que se vuelve a convertir conserva su rango si le cabe.
+    """
+    folder = os.path.dirname(os.path.abspath(emco_file))
+    name = os.path.basename(emco_file)
+    registry_path = os.path.join(folder, REGISTRY_FILE)
+    with _registry_lock(folder):
+        registry = _read_registry(registry_path)
+        own = registry.get(name)
+        if own is not None and own[1] >= count:
+            return own[0]
+
+        ranges = sorted((first, first + size) for program, (first, size) in registry.items() if program != name)
+        reserved = set()
+        for first, stop in ranges:
+            reserved.update(range(first, stop))
+        own_numbers = set(range(own[0], own[0] + own[1])) if own else set()
+        for entry in os.listdir(folder):
+            match = _SUBPROGRAM_FILE_RE.match(entry)
+            if match and int(match.group(1)) not in own_numbers:
+                reserved.add(int(match.group(1)))
+
+        first = FIRST_SUBPROGRAM
+        while first + count - 1 <= LAST_SUBPROGRAM:
+            taken = [number for number in range(first, first + count) if number in reserved]
+            if not taken:
+                break
+            first = taken[-1] + 1
+        else:
+            raise ValueError(f"no quedan {count} números de subprograma libres en {folder}")
+
+        registry[name] = [first, count]
+        _write_registry(registry_path, registry)
+        return first
+
+def release_subprograms(emco_file: str):
+    """Libera el rango reservado para emco_file y borra sus L####.SPF; devuelve los números borrados.
+
+    Para una conversión cancelada o fallida: sin el programa principal sus subprogramas sobran.
+    """
+    folder = os.path.dirname(os.path.abspath(emco_file))
+    registry_path = os.path.join(folder, REGISTRY_FILE)
+    with _registry_lock(folder):
+        registry = _read_registry(registry_path)
+        own = registry.pop(os.path.basename(emco_file), None)
+        if own is None:
+            return []
+        removed = []
+        for number in range(own[0], own[0] + own[1]):
+            try:
+                os.remove(subprogram_path(emco_file, number))
+                removed.append(number)
+            except FileNotFoundError:
+                pass
+        _write_registry(registry_path, registry)
+        return removed
+
+def renumber_calls(blocks, numbers):
+    """Bloques con las llamadas L#### cambiadas según numbers ({número antiguo: nuevo})."""
+    for block in blocks:
+        words = tokenize(block)
+        if any(address == "L" for address, _ in words):
+            block = format_block([(address, str(numbers.get(int(value), value)) if address == "L" else value)
+                                  for address, value in words])
+        yield block
+
+def assign_subprograms(emco_file: str, main, subprograms):
+    """Pasa los subprogramas de factor_subprograms al rango reservado para emco_file."""
+    if not subprograms:
+        return main, subprograms
+    first = allocate_subprograms(emco_file, len(subprograms))
+    numbers = {old: first + index for index, old in enumerate(sorted(subprograms))}
+    if all(old == new for old, new in numbers.items()):
+        return main, subprograms
+    return (list(renumber_calls(main, numbers)),
+            {numbers[old]: blocks for old, blocks in subprograms.items()})
@@ -0,0 +1,92 @@
+import glob
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+from conversion_cache import META_FILE, PROGRAM_FILE, ConversionCache
+from dialects import DIALECTS
+
+class ConversionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.folder = self.directory.name
+        self.input_file = os.path.join(self.folder, "input.nc")
+        with open(self.input_file, 'w') as program:
+            program.write("\n".join(benchmark.mastercam_lines(500, 1)) + "\n")
+        self.output_file = os.path.join(self.folder, "input_FOR_EMCO.SPF")
+        self.cache = ConversionCache(os.path.join(self.folder, "cache"))
+        self.conversions = 0
+        converter = DIALECTS["Mastercam"].converter
+
+        def counting(*args, **options):
+            self.conversions += 1
+            return converter(*args, **options)
+
+        self.convert = self.cache.cached("Mastercam", counting)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def output(self):
+        with open(self.output_file, 'r') as program:
+            return program.read()
+
+    def test_same_input_and_settings_hit(self):
+        first = self.convert(self.input_file, self.output_file, 1500, 150, "mm", compact=True)
+        expected = self.output()
+        os.remove(self.output_file)
+        second = self.convert(self.input_file, self.output_file, 1500, 150, "mm", compact=True, jobs=2)
+
+        self.assertNotIn("cache_hit", first)
+        self.assertTrue(second.get("cache_hit"))
+        self.assertEqual(self.conversions, 1)
+        self.assertEqual(self.output(), expected)
+
+    def test_changed_settings_or_input_miss(self):
+        self.convert(self.input_file, self.output_file, 1500, 150, "mm")
+        for S, F, units, options in ((1500, 200, "mm", {}), (1200, 150, "mm", {}), (1500, 150, "inches", {}),
+                                     (1500, 150, "mm", {"compact": True})):
+            with self.subTest(S=S, F=F, units=units, **options):
+                report = self.convert(self.input_file, self.output_file, S, F, units, **options)
+                self.assertNotIn("cache_hit", report)
+
+        with open(self.input_file, 'a') as program:
+            program.write("G0 X1. Y1.\n")
+        report = self.convert(self.input_file, self.output_file, 1500, 150, "mm")
+        self.assertNotIn("cache_hit", report)
+        self.assertEqual(self.conversions, 6)
+
+    def test_corrupted_entry_is_discarded(self):
+        self.convert(self.input_file, self.output_file, 1500, 150, "mm")
+        expected = self.output()
+        entry, = glob.glob(os.path.join(self.cache.directory, "*", "*", PROGRAM_FILE))
+        with open(entry, 'a') as program:
+            program.write("N99990 G0 Z-50\n")
+
+        report = self.convert(self.input_file, self.output_file, 1500, 150, "mm")
+        self.assertNotIn("cache_hit", report)
+        self.assertEqual(self.output(), expected)
+        self.assertEqual(self.conversions, 2)
+
+        # La entrada vuelve a guardarse sana y se reutiliza
+        report = self.convert(self.input_file, self.output_file, 1500, 150, "mm")
+        self.assertTrue(report.get("cache_hit"))
+        self.assertEqual(self.output(), expected)
+
+    def test_unreadable_meta_is_a_miss(self):
+        self.convert(self.input_file, self.output_file, 1500, 150, "mm")
+        meta, = glob.glob(os.path.join(self.cache.directory, "*", "*", META_FILE))
+        with open(meta, 'w') as meta_file:
+            meta_file.write("{")
+        report = self.convert(self.input_file, self.output_file, 1500, 150, "mm")
+        self.assertNotIn("cache_hit", report)
+        self.assertEqual(self.conversions, 2)
+        report = self.convert(self.input_file, self.output_file, 1500, 150, "mm")
+        self.assertTrue(report.get("cache_hit"))
+
+if __name__ == "__main__":
+    unittest.main()
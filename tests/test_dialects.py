@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+from dialects import DIALECTS, sniff_dialect, sniff_lines
+
+class SniffTest(unittest.TestCase):
+    def test_each_dialect_is_detected(self):
+        with tempfile.TemporaryDirectory() as folder:
+            for name, lines in benchmark.CORPORA.items():
+                with self.subTest(dialect=name):
+                    lines = [line + "\n" for line in lines(2000, 4)]
+                    path = os.path.join(folder, "input.nc")
+                    with open(path, 'w') as program:
+                        program.writelines(lines)
+                    self.assertEqual(sniff_dialect(path), name)
+
+                    source, replay = sniff_lines(iter(lines))
+                    self.assertEqual(source, name)
+                    # Las líneas leídas para detectar vuelven a salir
+                    self.assertEqual(list(replay), lines)
+
+    def test_small_signatures(self):
+        cases = {
+            "Mastercam": ["%", "O0001", "N100 G21", "N102 G0 G90 X0. Y0."],
+            "Aspire": ["%", "G90", "G17D1", "G2 X1.000 Y0.000 .500 0.000"],
+            "Kiri:Moto": ["; Generated by Kiri:Moto", "G21 ; set units to MM", "G90"],
+        }
+        for name, lines in cases.items():
+            with self.subTest(dialect=name):
+                self.assertIn(name, DIALECTS)
+                self.assertEqual(sniff_lines(lines)[0], name)
+
+    def test_unknown_input(self):
+        self.assertIsNone(sniff_lines(["hola", "G0 X1"])[0])
+        self.assertIsNone(sniff_lines([])[0])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import queue
+import select
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dnc
+
+PAUSE_CHECK = 0.3   # segundos sin datos que se esperan durante un XOFF
+
+@unittest.skipIf(dnc.termios is None, "sin termios no hay pty")
+class DripFeedTest(unittest.TestCase):
+    """El control es el lado maestro de un pty; drip_feed escribe en el esclavo como en un puerto serie."""
+
+    def setUp(self):
+        self.control, slave = os.openpty()
+        self.port = dnc.open_port(os.ttyname(slave), flow="xonxoff")
+        os.close(slave)
+        self.received = b""
+
+    def tearDown(self):
+        self.port.close()
+        os.close(self.control)
+
+    def read_control(self, timeout: float):
+        """Lee lo que llega al control hasta timeout segundos sin datos nuevos."""
+        while select.select([self.control], [], [], timeout)[0]:
+            self.received += os.read(self.control, 4096)
+
+    def start(self, lines, progress=None):
+        result = {}
+
+        def send():
+            try:
+                result["report"] = dnc.drip_feed(self.port, lines, progress=progress)
+            except Exception as e:
+                result["error"] = e
+
+        thread = threading.Thread(target=send, daemon=True)
+        thread.start()
+        return thread, result
+
+    def finish(self, thread, result):
+        while thread.is_alive():
+            self.read_control(0.05)
+        self.read_control(0.05)
+        self.assertNotIn("error", result)
+        return result["report"]
+
+    def test_blocks_arrive_in_order(self):
+        lines = [f"N{10 * index} G1 X{index} F150\n" for index in range(1, 501)]
+        report = self.finish(*self.start(lines))
+        self.assertEqual(self.received.decode("ascii"), "".join(line.rstrip("\n") + "\r\n" for line in lines))
+        self.assertEqual(report["blocks"], len(lines))
+
+    def test_xoff_pauses_between_blocks_until_xon(self):
+        lines = [f"N{10 * index} G1 X{index}\n" for index in range(1, 11)]
+
+        def progress(sent, paused):
+            if sent == 3:
+                # El control pide pausa justo después del tercer bloque
+                os.write(self.control, bytes([dnc.XOFF]))
+                time.sleep(0.1)
+
+        thread, result = self.start(lines, progress)
+        self.read_control(PAUSE_CHECK)
+        self.assertEqual(self.received.decode("ascii"), "".join(line.rstrip("\n") + "\r\n" for line in lines[:3]))
+
+        os.write(self.control, bytes([dnc.XON]))
+        report = self.finish(thread, result)
+        self.assertEqual(self.received.decode("ascii"), "".join(line.rstrip("\n") + "\r\n" for line in lines))
+        self.assertEqual(report["pauses"], 1)
+        self.assertGreater(report["paused_seconds"], 0)
+
+    def test_producer_stops_when_sending_stops(self):
+        # Cola llena con el único bloque: el None final no cabe hasta que alguien lea
+        blocks = queue.Queue(maxsize=1)
+        stop = threading.Event()
+        producer = threading.Thread(target=dnc._produce, args=(iter(["N10 G0 X0"]), blocks, stop), daemon=True)
+        producer.start()
+        time.sleep(0.2)
+        stop.set()
+        producer.join(1)
+        self.assertFalse(producer.is_alive())
+
+if __name__ == "__main__":
+    unittest.main()
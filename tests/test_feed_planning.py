@@ -0,0 +1,59 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+from dialects import DIALECTS
+from feed_planning import feed_plan_settings, parse_feeds, plan_feeds
+
+def plan(blocks, settings):
+    stats = {}
+    return list(plan_feeds(blocks, settings, stats)), stats
+
+class FeedPlanTest(unittest.TestCase):
+    def test_feed_per_move_class(self):
+        blocks, stats = plan(["G90", "G71", "G0 X0 Y0 Z5", "G1 Z-1 F150", "G1 X10", "G1 X10.2",
+                              "G2 X12.2 Y0 CR1", "G1 X20 Z-1.5", "G0 Z5"], feed_plan_settings(150))
+        self.assertEqual(blocks, ["G90", "G71", "G0 X0 Y0 Z5", "G1 Z-1 F45", "G1 X10 F150", "G1 X10.2 F120",
+                                  "G2 X12.2 Y0 CR1 F90", "G1 X20 Z-1.5 F75", "G0 Z5"])
+        self.assertEqual(stats["moves"], {"plunge": 1, "ramp": 1, "linear": 1, "small_arc": 1, "finishing": 1})
+        self.assertGreater(stats["seconds_after"], stats["seconds_before"])
+
+    def test_class_feeds_never_exceed_the_form_feed(self):
+        settings = feed_plan_settings(150, {"plunge": 50, "linear": 400})
+        self.assertEqual(settings["feeds"]["plunge"], 50)
+        self.assertEqual(settings["feeds"]["linear"], 150)
+        with self.assertRaises(ValueError):
+            feed_plan_settings(150, {"rapid": 10})
+
+    def test_cam_feed_factor(self):
+        blocks, _ = plan(["G0 X0 Y0 Z5", "G1 X5 F200", "G1 X10", "G1 X15 F400"],
+                         feed_plan_settings(150, cam_factor=0.5))
+        # F del CAM por el factor, con el F del formulario como tope; el F del CAM es modal
+        self.assertEqual(blocks, ["G0 X0 Y0 Z5", "G1 X5 F100", "G1 X10 F100", "G1 X15 F150"])
+
+    def test_parse_feeds(self):
+        self.assertEqual(parse_feeds("plunge=50, Ramp=80"), {"plunge": 50.0, "ramp": 80.0})
+        for text in ("plunge", "rapid=10", "plunge=-5", "plunge=x"):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    parse_feeds(text)
+
+    def test_converter_applies_the_plan(self):
+        with tempfile.TemporaryDirectory() as folder:
+            input_file = os.path.join(folder, "input.nc")
+            with open(input_file, 'w') as program:
+                program.write("\n".join(benchmark.mastercam_lines(1000, 2)) + "\n")
+            output_file = os.path.join(folder, "output.SPF")
+            report = DIALECTS["Mastercam"].converter(input_file, output_file, 1500, 150, "mm",
+                                                     feed_plan=feed_plan_settings(150))
+            with open(output_file, 'r') as program:
+                text = program.read()
+        self.assertGreater(report["feed_plan"]["moves"]["plunge"], 0)
+        self.assertIn(" F45\n", text)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import parallel_convert
+from dialects import DIALECTS
+
+LINES = 8000
+CHUNK_LINES = 1000        # Trozos pequeños para cortar muchas veces el archivo de prueba
+TOOL_CHANGE_EVERY = 700   # Cambios de herramienta frecuentes: puntos de corte de las etapas por tramos
+
+# Sin opciones el conversor es bloque a bloque y corta en cualquier línea; con
+# ajuste de arcos o simplificación solo en los cambios de herramienta
+CASES = [
+    ("Mastercam", {}),
+    ("Mastercam", {"simplify_tolerance": 0.01}),
+    ("Aspire", {}),
+    ("Aspire", {"simplify_tolerance": 0.01}),
+    ("Kiri:Moto", {}),
+    ("Kiri:Moto", {"arc_tolerance": 0.01, "simplify_tolerance": 0.01, "stock_top": 0.0}),
+]
+
+class ChunkedConversionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.folder = self.directory.name
+        patches = [mock.patch.object(parallel_convert, "MIN_CHUNK_LINES", CHUNK_LINES),
+                   mock.patch.object(benchmark, "TOOL_CHANGE_EVERY", TOOL_CHANGE_EVERY)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self, path: str):
+        with open(path, 'rb') as program:
+            return program.read()
+
+    def test_chunked_output_is_identical_to_sequential(self):
+        for source, options in CASES:
+            with self.subTest(source=source, **options):
+                input_file = os.path.join(self.folder, "input.nc")
+                with open(input_file, 'w') as program:
+                    program.write("\n".join(benchmark.CORPORA[source](LINES, 5)) + "\n")
+                sequential = os.path.join(self.folder, "sequential.SPF")
+                chunked = os.path.join(self.folder, "chunked.SPF")
+                converter = DIALECTS[source].converter
+                converter(input_file, sequential, 1500, 150, "mm", jobs=None, **options)
+                converter(input_file, chunked, 1500, 150, "mm", jobs=2, **options)
+
+                # El archivo se corta de verdad en varios trozos
+                with open(input_file, 'r') as program:
+                    lines = program.readlines()
+                any_line = not options.get("simplify_tolerance") and not options.get("arc_tolerance")
+                cuts = parallel_convert.chunk_boundaries(lines, lambda line: False,
+                                                         2 * parallel_convert.CHUNKS_PER_JOB, any_line)
+                self.assertGreater(len(cuts), 2)
+                self.assertEqual(self.read(chunked), self.read(sequential))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+from dialects import DIALECTS
+from gcode_lexer import strip_sequence, to_float, tokenize
+
+SOURCES = {"Mastercam": benchmark.mastercam_lines, "Aspire": benchmark.aspire_lines,
+           "Kiri:Moto": benchmark.kirimoto_lines}
+
+def program_words(emco_file: str):
+    """Palabras de cada bloque con los números como float (el modelo en columnas los canoniza)."""
+    with open(emco_file, 'r') as program:
+        return [[(address, to_float(value) if to_float(value) is not None else value)
+                 for address, value in tokenize(strip_sequence(line.strip()))] for line in program]
+
+class ColumnarOutputTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.folder = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_columnar_output_matches_row_output(self):
+        for source, lines in SOURCES.items():
+            with self.subTest(source=source):
+                input_file = os.path.join(self.folder, "input.nc")
+                with open(input_file, 'w') as program:
+                    program.write("\n".join(lines(2000, 3)) + "\n")
+                rows = os.path.join(self.folder, "rows.SPF")
+                columns = os.path.join(self.folder, "columns.SPF")
+                converter = DIALECTS[source].converter
+                row_report = converter(input_file, rows, 1500, 150, "mm", profile=True)
+                column_report = converter(input_file, columns, 1500, 150, "mm", profile=True, columnar=True)
+
+                self.assertEqual(program_words(columns), program_words(rows))
+                for counter in ("f_overridden", "f_appended"):
+                    self.assertEqual(column_report["profile"]["counters"].get(counter),
+                                     row_report["profile"]["counters"].get(counter), counter)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+from cycle_time import ModalTracker
+from dialects import DIALECTS
+from gcode_lexer import strip_sequence
+from program_split import HEADER_BLOCKS, split_emco_program
+
+SAFE_Z = 5.0
+
+def long_cut_program(path: str, moves: int = 120):
+    """Programa de Mastercam con un único corte largo en el material, sin retrocesos intermedios."""
+    lines = ["%", "O0001", "G21", "G90 G54", "G0 X0. Y0.", f"G0 Z{SAFE_Z:g}.", "G1 Z-1. F100."]
+    lines += [f"G1 X{index}. Y{index % 7}." for index in range(1, moves)]
+    lines += [f"G0 Z{SAFE_Z:g}.", "M30", "%"]
+    with open(path, 'w') as program:
+        program.write("\n".join(lines) + "\n")
+
+def body(path: str):
+    """Bloques de una parte sin números de secuencia, sin cabecera ni final."""
+    with open(path, 'r') as program:
+        blocks = [strip_sequence(line.strip()) for line in program]
+    return blocks[HEADER_BLOCKS:-2]
+
+def feed_moves(blocks):
+    """Puntos finales (X, Y) de los movimientos en avance con desplazamiento en el plano."""
+    modal = ModalTracker()
+    points = []
+    for block in blocks:
+        _, moved, _ = modal.advance(block.split())
+        if modal.motion == "1" and ("X" in moved or "Y" in moved):
+            points.append((modal.position["X"], modal.position["Y"]))
+    return points
+
+def modal_states(blocks):
+    """(G modal, F modal) en vigor en cada bloque."""
+    modal = ModalTracker()
+    feed = None
+    states = []
+    for block in blocks:
+        _, _, rest = modal.advance(block.split())
+        feed = next((value for address, value in rest if address == "F"), feed)
+        states.append((modal.motion, feed))
+    return states
+
+def moves(block: str):
+    return any(word[0] in "XYZ" for word in block.split())
+
+class SplitProgramTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.folder = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def convert(self, **options):
+        source = os.path.join(self.folder, "long.nc")
+        long_cut_program(source)
+        emco_file = os.path.join(self.folder, "long_FOR_EMCO.SPF")
+        DIALECTS["Mastercam"].converter(source, emco_file, 1500, 150, "mm", **options)
+        return emco_file
+
+    def test_size_cut_inside_the_material_retracts_and_reapproaches(self):
+        emco_file = self.convert()
+        report = split_emco_program(emco_file, 1000)
+        parts = [os.path.join(self.folder, name) for name in report["parts"]]
+        self.assertGreater(len(parts), 2)
+        self.assertFalse(report["oversized"])
+
+        for index, part in enumerate(parts):
+            blocks = body(part)
+            modal = ModalTracker()
+            for block in blocks:
+                modal.advance(block.split())
+            # Cada parte termina con la herramienta fuera del material
+            self.assertGreaterEqual(modal.position["Z"], SAFE_Z, part)
+            if index:
+                # ...y la siguiente vuelve en rápido a X/Y y baja en avance
+                self.assertTrue(blocks[0].startswith("G0 X"), blocks[:2])
+                self.assertTrue(blocks[1].startswith("G1 Z-1"), blocks[:2])
+
+        # Los cortes son los mismos que sin dividir
+        split_moves = [point for part in parts for point in feed_moves(body(part))]
+        self.assertEqual(split_moves, feed_moves(body(emco_file)))
+
+    def test_compact_parts_restore_modal_g_and_f(self):
+        source = os.path.join(self.folder, "program.nc")
+        with open(source, 'w') as program:
+            program.write("\n".join(benchmark.mastercam_lines(3000, 7)) + "\n")
+        emco_file = os.path.join(self.folder, "program_FOR_EMCO.SPF")
+        DIALECTS["Mastercam"].converter(source, emco_file, 1500, 150, "mm", compact=True)
+        report = split_emco_program(emco_file, 8000, tool_changes=False)
+        self.assertGreater(len(report["parts"]), 2)
+
+        original = body(emco_file)
+        states = modal_states(original)
+        position = 0
+        for index, name in enumerate(report["parts"]):
+            blocks = body(os.path.join(self.folder, name))
+            part_states = modal_states(blocks)
+            start = 0
+            if index:
+                # Bloques añadidos al empezar la parte: vuelta al punto del corte y G/F modales
+                restore = next((row for row, block in enumerate(blocks)
+                                if all(word[0] in "GF" for word in block.split())), None)
+                self.assertIsNotNone(restore, f"{name} no repite el G y el F modales")
+                start = restore + 1
+            first = next(row for row in range(start, len(blocks)) if moves(blocks[row]))
+            # El primer movimiento de la parte es el mismo bloque que en el programa sin dividir...
+            offset = position + first - start
+            self.assertEqual(blocks[first], original[offset])
+            # ...y se ejecuta con el mismo G y F aunque la salida compacta no los repita
+            self.assertEqual(part_states[first], states[offset], name)
+            kept = blocks[start:]
+            if original[position:position + len(kept)] != kept:
+                kept = kept[:-1]   # G0 de retroceso añadido al final
+            self.assertEqual(original[position:position + len(kept)], kept)
+            position += len(kept)
+        self.assertEqual(position, len(original))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from program_validation import parse_limits, validate_blocks, validation_settings
+
+LIMITS = {"X": (-10.0, 180.0), "Y": (0.0, 130.0), "Z": (-60.0, 20.0)}
+
+def validate(blocks, limits=None):
+    report = {}
+    passed = list(validate_blocks(blocks, validation_settings(limits), report))
+    assert passed == list(blocks)
+    return report
+
+class ProgramValidationTest(unittest.TestCase):
+    def test_limits_in_mm(self):
+        report = validate(["G90", "G71", "G0 X100 Y10 Z5", "G0 X200"], LIMITS)
+        self.assertEqual(report["counts"].get("limits"), 1)
+        self.assertIn("X fuera de -10 .. 180", report["examples"]["limits"][0])
+
+        self.assertNotIn("limits", validate(["G90", "G71", "G0 X179 Y10 Z5"], LIMITS)["counts"])
+
+    def test_limits_in_inches(self):
+        # Los límites se dan en mm: 180 mm = 7.087 in
+        self.assertNotIn("limits", validate(["G90", "G70", "G0 X7 Y1 Z0.2"], LIMITS)["counts"])
+        report = validate(["G90", "G70", "G0 X7.2 Y1 Z0.2"], LIMITS)
+        self.assertEqual(report["counts"].get("limits"), 1)
+        self.assertEqual(report["units"], "inches")
+
+    def test_inconsistent_arc(self):
+        start = ["G90", "G71", "G0 X0 Y0 Z5", "G1 Z-1 F100"]
+        self.assertNotIn("arc_radius", validate(start + ["G2 X10 Y0 I5 J0"])["counts"])
+        report = validate(start + ["G2 X10 Y0 I4 J0"])
+        self.assertEqual(report["counts"].get("arc_radius"), 1)
+        self.assertIn("radios 4.0000 y 6.0000", report["examples"]["arc_radius"][0])
+        # Con CR la cuerda no puede superar el diámetro
+        self.assertEqual(validate(start + ["G2 X10 Y0 CR4"])["counts"].get("arc_radius"), 1)
+
+    def test_rapid_moves_into_the_material(self):
+        report = validate(["G90", "G71", "G0 X0 Y0 Z5", "G0 Z-1"])
+        self.assertEqual(report["counts"], {"rapid_plunge": 1})
+
+        report = validate(["G90", "G71", "G0 X0 Y0 Z5", "G1 Z-1 F100", "G0 X10"])
+        self.assertEqual(report["counts"], {"rapid_in_material": 1})
+
+        # Bajar en rápido hasta encima de la superficie es normal
+        self.assertEqual(validate(["G90", "G71", "G0 X0 Y0 Z5", "G0 Z1", "G1 Z-1 F100", "G0 Z5"])["counts"], {})
+
+    def test_units_mismatch(self):
+        report = validate(["G90", "G70", "G0 X0 Y0 Z1", "G1 X150 F1000"])
+        self.assertEqual(report["counts"].get("units"), 2)   # Recorrido y avance de mm en G70
+
+class ParseLimitsTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_limits("X-10:180, y0:130,Z-60:20"), LIMITS)
+
+    def test_invalid(self):
+        for text in ("X10", "Q0:1", "X5:1", "Xa:1"):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    parse_limits(text)
+
+if __name__ == "__main__":
+    unittest.main()
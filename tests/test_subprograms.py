@@ -0,0 +1,113 @@
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversion_cache import ConversionCache
+from conversion_job import ConversionJob
+from dialects import DIALECTS
+from subprograms import REGISTRY_FILE
+
+CALL_RE = re.compile(r"\bL(\d+)")
+
+def pocket_program(path: str, size: float):
+    """Programa de Mastercam con el mismo cajeado repetido en varias posiciones."""
+    lines = ["%", "O0001", "G21", "G90 G54"]
+    for x, y in ((0, 0), (30, 0), (60, 0), (0, 40), (30, 40)):
+        lines += [f"G0 X{x}. Y{y}.", "G0 Z2.", "G1 Z-1. F100.", f"G1 X{x + size}.", f"G1 Y{y + size}.",
+                  f"G1 X{x}.", f"G1 Y{y}.", "G0 Z5."]
+    lines += ["M30", "%"]
+    with open(path, 'w') as program:
+        program.write("\n".join(lines) + "\n")
+
+def calls(emco_file: str):
+    with open(emco_file, 'r') as program:
+        return {int(number) for number in CALL_RE.findall(program.read())}
+
+def subprogram_texts(emco_file: str):
+    folder = os.path.dirname(emco_file)
+    texts = {}
+    for number in calls(emco_file):
+        with open(os.path.join(folder, f"L{number}.SPF"), 'r') as subprogram:
+            texts[number] = subprogram.read()
+    return texts
+
+class SubprogramNumberingTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.folder = self.directory.name
+        self.converter = DIALECTS["Mastercam"].converter
+        for name, size in (("a", 10), ("b", 6)):
+            pocket_program(os.path.join(self.folder, f"{name}.nc"), size)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def convert(self, name: str, output_folder: str = None, converter=None):
+        output_file = os.path.join(output_folder or self.folder, f"{name}_FOR_EMCO.SPF")
+        (converter or self.converter)(os.path.join(self.folder, f"{name}.nc"), output_file, 1500, 150, "mm",
+                                      subprograms=True)
+        return output_file
+
+    def test_programs_in_one_folder_call_only_their_own_subprograms(self):
+        a = self.convert("a")
+        a_texts = subprogram_texts(a)
+        self.assertTrue(a_texts)
+        b = self.convert("b")
+
+        self.assertTrue(calls(b))
+        self.assertFalse(calls(a) & calls(b))
+        self.assertEqual(subprogram_texts(a), a_texts)
+
+        # Volver a convertir a conserva su rango y no toca los de b
+        b_texts = subprogram_texts(b)
+        self.convert("a")
+        self.assertEqual(subprogram_texts(a), a_texts)
+        self.assertEqual(subprogram_texts(b), b_texts)
+
+    def test_cache_restore_uses_a_free_range(self):
+        with tempfile.TemporaryDirectory() as cache_folder, tempfile.TemporaryDirectory() as output_folder:
+            cached = ConversionCache(cache_folder).cached("Mastercam", self.converter)
+            first = self.convert("a", converter=cached)
+            a_texts = subprogram_texts(first)
+
+            b = self.convert("b", output_folder)
+            b_texts = subprogram_texts(b)
+            a = os.path.join(output_folder, "a_FOR_EMCO.SPF")
+            report = cached(os.path.join(self.folder, "a.nc"), a, 1500, 150, "mm", subprograms=True)
+
+            self.assertTrue(report.get("cache_hit"))
+            self.assertFalse(calls(a) & calls(b))
+            self.assertEqual(sorted(report["subprograms"]["numbers"]), sorted(calls(a)))
+            self.assertEqual(sorted(subprogram_texts(a).values()), sorted(a_texts.values()))
+            self.assertEqual(subprogram_texts(b), b_texts)
+
+    def test_failed_job_removes_its_subprograms_and_range(self):
+        b = self.convert("b")
+        b_texts = subprogram_texts(b)
+
+        def failing(*args, **options):
+            self.converter(*args, **options)
+            raise OSError("disco lleno")
+
+        a = os.path.join(self.folder, "a_FOR_EMCO.SPF")
+        job = ConversionJob(failing, os.path.join(self.folder, "a.nc"), a, 1500, 150, "mm", subprograms=True)
+        job.start()
+        while job.is_alive():
+            time.sleep(0.01)
+        self.assertEqual(job.drain()[-1], ("error", "disco lleno"))
+
+        self.assertFalse(os.path.exists(a))
+        spf_files = {name for name in os.listdir(self.folder) if name.upper().startswith("L")}
+        self.assertEqual(spf_files, {f"L{number}.SPF" for number in b_texts})
+        self.assertEqual(subprogram_texts(b), b_texts)
+        with open(os.path.join(self.folder, REGISTRY_FILE), 'r') as registry:
+            self.assertEqual(set(json.load(registry)), {"b_FOR_EMCO.SPF"})
+
+if __name__ == "__main__":
+    unittest.main()
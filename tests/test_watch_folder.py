@@ -0,0 +1,64 @@
+import glob
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import watch_folder
+from watch_folder import FolderWatcher
+
+DEFAULTS = {"source": "Mastercam", "S": 1500, "F": 150, "units": "mm", "subprograms": False}
+
+class FolderWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.folder = os.path.join(self.directory.name, "cam")
+        os.mkdir(self.folder)
+        with open(os.path.join(self.folder, "pieza.nc"), 'w') as program:
+            program.write("\n".join(benchmark.mastercam_lines(300, 3)) + "\n")
+        self.output_file = os.path.join(self.folder, "pieza_FOR_EMCO.SPF")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def watch(self, defaults):
+        watcher = FolderWatcher([self.folder], defaults, jobs=1, interval=0.01, settle=0)
+        watcher.log = lambda message: None
+        watcher.run(once=True)
+        return watcher.converted
+
+    def output(self):
+        with open(self.output_file, 'r') as program:
+            return program.read()
+
+    def test_changed_defaults_reconvert(self):
+        self.assertEqual(self.watch(DEFAULTS), 1)
+        self.assertIn(" F150", self.output())
+        self.assertEqual(self.watch(DEFAULTS), 0)
+
+        # Otro F por defecto en la línea de órdenes: la salida ya no está al día
+        self.assertEqual(self.watch(dict(DEFAULTS, F=300)), 1)
+        self.assertIn(" F300", self.output())
+        self.assertNotIn(" F150", self.output())
+        self.assertEqual(self.watch(dict(DEFAULTS, F=300)), 0)
+        self.assertEqual(self.watch(dict(DEFAULTS, F=300, compact=True)), 1)
+
+    def test_output_without_state_is_reconverted(self):
+        self.assertEqual(self.watch(DEFAULTS), 1)
+        os.remove(os.path.join(self.folder, watch_folder.STATE_FILE))
+        self.assertEqual(self.watch(DEFAULTS), 1)
+        self.assertEqual(self.watch(DEFAULTS), 0)
+
+    def test_cache_dir_option(self):
+        cache_dir = os.path.join(self.directory.name, "cache")
+        code = watch_folder.main([self.folder, "--source", "Mastercam", "--once", "--jobs", "1",
+                                  "--interval", "0.01", "--settle", "0", "--cache-dir", cache_dir])
+        self.assertEqual(code, 0)
+        self.assertTrue(os.path.exists(self.output_file))
+        self.assertTrue(glob.glob(os.path.join(cache_dir, "*", "*", "program.SPF")))
+
+if __name__ == "__main__":
+    unittest.main()
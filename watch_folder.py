@@ -0,0 +1,295 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from batch_convert import (
+    AUTO_SOURCE, INPUT_EXTENSIONS, OUTPUT_SUFFIX, convert_file, generate_output_filename, source_name)
+from conversion_cache import MAX_CACHE_BYTES, default_cache_dir
+from emco_program import NUMBER_ALL, NUMBERING_MODES, report_summary
+
+# Vigilancia de carpetas: convierte los archivos que los puestos CAM dejan en
+# una carpeta compartida. Se recorre cada carpeta con os.scandir cada
+# POLL_INTERVAL segundos (sin dependencias y barato en reposo) y un archivo
+# se convierte cuando su tamaño y fecha no cambian durante SETTLE_SECONDS,
+# para no leer exportaciones a medio escribir. Un archivo está al día si su
+# salida es más reciente que él y que la configuración de la carpeta, y se
+# convirtió con los mismos valores: la firma de los valores efectivos de cada
+# salida se guarda en un .emco_watch_state.json junto a las salidas, así que
+# cambiar S, F, unidades u opciones (en la carpeta o en la línea de órdenes)
+# vuelve a convertir los archivos.
+#
+# Cada carpeta puede tener un emco_watch.json con sus propios valores, p. ej.
+#   {"S": 12000, "F": 800, "units": "mm", "source": "auto", "output_dir": "salida"}
+# y cualquier opción del conversor (subprograms, compact, numbering,
+# simplify_tolerance, arc_tolerance, stock_top). output_dir es relativo a la carpeta.
+
+SETTINGS_FILE = "emco_watch.json"
+STATE_FILE = ".emco_watch_state.json"
+POLL_INTERVAL = 2.0
+SETTLE_SECONDS = 3.0
+
+SETTINGS_TYPES = {
+    "source": source_name, "S": int, "F": int, "units": str, "output_dir": str,
+    "subprograms": bool, "compact": bool, "numbering": str,
+    "simplify_tolerance": float, "arc_tolerance": float, "stock_top": float,
+}
+
+def load_settings(folder: str, defaults):
+    """Valores de la carpeta: los de defaults con lo que indique su emco_watch.json."""
+    settings = dict(defaults)
+    path = os.path.join(folder, SETTINGS_FILE)
+    if not os.path.exists(path):
+        return settings
+    with open(path, 'r') as settings_file:
+        values = json.load(settings_file)
+    for name, value in values.items():
+        if name not in SETTINGS_TYPES:
+            raise ValueError(f"{SETTINGS_FILE}: opción desconocida '{name}'")
+        settings[name] = SETTINGS_TYPES[name](value)
+    if settings["units"] not in ("mm", "inches"):
+        raise ValueError(f"{SETTINGS_FILE}: unidades desconocidas '{settings['units']}'")
+    if settings.get("numbering", NUMBER_ALL) not in NUMBERING_MODES:
+        raise ValueError(f"{SETTINGS_FILE}: numeración desconocida '{settings['numbering']}'")
+    if settings.get("output_dir"):
+        settings["output_dir"] = os.path.join(folder, settings["output_dir"])
+    return settings
+
+def settings_signature(settings):
+    """Huella de los valores efectivos con los que se convierte un archivo."""
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+def is_input_name(name: str):
+    return (name.lower().endswith(INPUT_EXTENSIONS) and not name.upper().endswith(OUTPUT_SUFFIX)
+            and not name.startswith((".", "~")))
+
+class FolderWatcher:
+    """Recorre las carpetas y convierte los archivos nuevos o cambiados en un pool de jobs procesos."""
+
+    def __init__(self, folders, defaults, jobs: int = 2, interval: float = POLL_INTERVAL,
+                 settle: float = SETTLE_SECONDS, cache=None, log=None):
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.defaults = defaults
+        self.jobs = jobs
+        self.interval = interval
+        self.settle = settle
+        self.cache = cache
+        self.log_file = log
+        self.settings = {}    # carpeta -> (mtime de emco_watch.json, valores o excepción)
+        self.changing = {}    # ruta -> (firma, instante en que se vio por primera vez)
+        self.failed = {}      # ruta -> firma con la que falló (no se reintenta hasta que cambie)
+        self.running = {}     # futuro -> (ruta, firma, valores)
+        self.states = {}      # carpeta de salida -> {nombre de la salida: firma de los valores}
+        self.converted = 0
+        self.failures = 0
+
+    def log(self, message: str):
+        line = f"{time.strftime('%Y-%m-%d %H:%M:%S')} {message}"
+        print(line, flush=True)
+        if self.log_file:
+            with open(self.log_file, 'a') as log_file:
+                log_file.write(line + "\n")
+
+    def folder_settings(self, folder: str):
+        """Valores de la carpeta, releídos solo cuando cambia su emco_watch.json."""
+        path = os.path.join(folder, SETTINGS_FILE)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        cached = self.settings.get(folder)
+        if cached is None or cached[0] != mtime:
+            try:
+                values = load_settings(folder, self.defaults)
+            except (OSError, ValueError, TypeError) as e:
+                values = e
+                self.log(f"ERROR {path}: {e}")
+            cached = self.settings[folder] = (mtime, values)
+        return cached
+
+    def ready_files(self):
+        """(ruta, firma, valores) de los archivos asentados cuya salida no está al día."""
+        now = time.monotonic()
+        busy = {path for path, _, _ in self.running.values()}
+        present = set()
+        ready = []
+        for folder in self.folders:
+            settings_mtime, settings = self.folder_settings(folder)
+            if isinstance(settings, Exception):
+                continue
+            try:
+                entries = list(os.scandir(folder))
+            except OSError as e:
+                self.log(f"ERROR {folder}: {e}")
+                continue
+            for entry in entries:
+                if not is_input_name(entry.name) or entry.path in busy:
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue  # Borrado mientras se recorría la carpeta
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if (self.failed.get(entry.path) == signature
+                        or self.up_to_date(entry.path, stat.st_mtime_ns, settings_mtime, settings)):
+                    continue
+
+                # Esperar a que el tamaño y la fecha no cambien durante settle segundos
+                present.add(entry.path)
+                seen = self.changing.get(entry.path)
+                if seen is None or seen[0] != signature:
+                    self.changing[entry.path] = (signature, now)
+                elif now - seen[1] >= self.settle:
+                    ready.append((entry.path, signature, settings))
+
+        for path in set(self.changing) - present:
+            del self.changing[path]
+        return ready
+
+    @staticmethod
+    def output_file(path: str, settings):
+        output_file = generate_output_filename(path)
+        if settings.get("output_dir"):
+            output_file = os.path.join(settings["output_dir"], os.path.basename(output_file))
+        return output_file
+
+    def output_state(self, output_dir: str):
+        """Firmas de las salidas de output_dir, leídas de su STATE_FILE la primera vez."""
+        state = self.states.get(output_dir)
+        if state is None:
+            try:
+                with open(os.path.join(output_dir, STATE_FILE), 'r') as state_file:
+                    state = json.load(state_file)
+                if not isinstance(state, dict):
+                    state = {}
+            except (OSError, ValueError):
+                state = {}
+            self.states[output_dir] = state
+        return state
+
+    def record_output(self, output_file: str, settings):
+        """Guarda la firma de los valores con los que se escribió output_file."""
+        output_dir, name = os.path.split(output_file)
+        state = self.output_state(output_dir)
+        state[name] = settings_signature(settings)
+        path = os.path.join(output_dir, STATE_FILE)
+        try:
+            with open(path + ".tmp", 'w') as state_file:
+                json.dump(state, state_file, indent=1, sort_keys=True)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            self.log(f"ERROR {path}: {e}")
+
+    def up_to_date(self, path: str, mtime: int, settings_mtime, settings):
+        output_file = self.output_file(path, settings)
+        try:
+            output_mtime = os.stat(output_file).st_mtime_ns
+        except OSError:
+            return False
+        if output_mtime < mtime or (settings_mtime is not None and output_mtime < settings_mtime):
+            return False
+        output_dir, name = os.path.split(output_file)
+        return self.output_state(output_dir).get(name) == settings_signature(settings)
+
+    def submit(self, executor, path: str, signature, settings):
+        options = {name: value for name, value in settings.items() if name not in ("source", "S", "F", "units")}
+        if options.get("output_dir"):
+            os.makedirs(options["output_dir"], exist_ok=True)
+        future = executor.submit(convert_file, path, settings["source"], settings["S"], settings["F"],
+                                 settings["units"], cache=self.cache, **options)
+        self.running[future] = (path, signature, settings)
+        self.changing.pop(path, None)
+        self.log(f"CONV  {path}")
+
+    def collect(self, futures):
+        for future in futures:
+            path, signature, settings = self.running.pop(future)
+            try:
+                output_file, seconds, report = future.result()
+            except Exception as e:
+                self.failures += 1
+                self.failed[path] = signature
+                self.log(f"ERROR {path}: {e}")
+            else:
+                self.converted += 1
+                self.failed.pop(path, None)
+                self.record_output(self.output_file(path, settings), settings)
+                self.log(f"OK    {path} -> {output_file} ({seconds:.2f} s)")
+                for line in report_summary(report):
+                    self.log(f"      {line}")
+
+    def run(self, once: bool = False):
+        """Vigila las carpetas hasta Ctrl+C; con once convierte lo pendiente y termina."""
+        self.log(f"Vigilando {', '.join(self.folders)} (cada {self.interval:g} s, {self.jobs} procesos)")
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            try:
+                while True:
+                    for path, signature, settings in self.ready_files():
+                        if len(self.running) >= self.jobs:
+                            break  # Los demás se recogen en la siguiente vuelta
+                        self.submit(executor, path, signature, settings)
+                    if once and not self.running and not self.changing:
+                        break
+                    if self.running:
+                        # Despertar al terminar una conversión o al tocar el siguiente recorrido
+                        done, _ = wait(self.running, timeout=self.interval, return_when=FIRST_COMPLETED)
+                        self.collect(done)
+                    else:
+                        time.sleep(self.interval)
+            except KeyboardInterrupt:
+                self.log("Deteniendo: esperando las conversiones en curso")
+                self.collect(list(self.running))
+        self.log(f"{self.converted} archivos convertidos, {self.failures} errores")
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Vigila carpetas y convierte automáticamente los GCode nuevos o cambiados a programas EMCO.")
+    parser.add_argument("folders", nargs="+", help=f"carpetas a vigilar (cada una puede tener su {SETTINGS_FILE})")
+    parser.add_argument("--source", "-s", type=source_name, default=AUTO_SOURCE,
+                        help="fuente GCode: Mastercam, Aspire, Kiri:Moto o auto (auto)")
+    parser.add_argument("-S", "--spindle-speed", type=int, default=1500, help="velocidad husillo en RPM (1500)")
+    parser.add_argument("-F", "--feed-rate", type=int, default=150, help="velocidad avance (150)")
+    parser.add_argument("--units", choices=("mm", "inches"), default="mm", help="sistema de unidades (mm)")
+    parser.add_argument("--output-dir", default=None, help="escribir las salidas aquí en lugar de junto a la entrada")
+    parser.add_argument("--subprograms", action="store_true", help="crear subprogramas L####.SPF")
+    parser.add_argument("--compact", action="store_true", help="salida compacta (sin G/F modales repetidos)")
+    parser.add_argument("--numbering", choices=NUMBERING_MODES, default=NUMBER_ALL, help="bloques con número N (all)")
+    parser.add_argument("--jobs", "-j", type=int, default=2, help="conversiones simultáneas (2)")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL,
+                        help=f"segundos entre recorridos de las carpetas ({POLL_INTERVAL:g})")
+    parser.add_argument("--settle", type=float, default=SETTLE_SECONDS,
+                        help=f"segundos sin cambios antes de convertir un archivo ({SETTLE_SECONDS:g})")
+    parser.add_argument("--log", help="añadir el registro de estado a este archivo")
+    parser.add_argument("--no-cache", action="store_true", help="no usar la caché de conversiones")
+    parser.add_argument("--cache-dir", default=default_cache_dir(),
+                        help=f"directorio de la caché de conversiones ({default_cache_dir()})")
+    parser.add_argument("--cache-size", type=int, default=MAX_CACHE_BYTES // 1_000_000,
+                        help=f"tamaño máximo de la caché en MB ({MAX_CACHE_BYTES // 1_000_000})")
+    parser.add_argument("--once", action="store_true", help="convertir lo pendiente y terminar")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    for folder in args.folders:
+        if not os.path.isdir(folder):
+            parser.error(f"no es una carpeta: {folder}")
+    defaults = {"source": args.source, "S": args.spindle_speed, "F": args.feed_rate, "units": args.units,
+                "subprograms": args.subprograms}
+    if args.output_dir:
+        defaults["output_dir"] = os.path.abspath(args.output_dir)
+    if args.compact:
+        defaults["compact"] = True
+    if args.numbering != NUMBER_ALL:
+        defaults["numbering"] = args.numbering
+    cache = None if args.no_cache else (args.cache_dir, args.cache_size * 1_000_000)
+    watcher = FolderWatcher(args.folders, defaults, max(args.jobs, 1), args.interval, args.settle, cache, args.log)
+    watcher.run(args.once)
+    return 1 if watcher.failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())